@@ -0,0 +1,299 @@
+from __future__ import annotations
+import functools
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from badge_connection import BadgeConnection
+from badge_scanner import (
+    DEFAULT_SCAN_SECONDS,
+    BadgeNotSeenError,
+    scan_for_badges,
+    split_by_scan,
+)
+from connection_manager import ConnectionManager, connect_to_badge
+from fleet_executor import DEFAULT_BADGE_TIMEOUT, BadgeResult, FleetReport, run_on_fleet
+from retry_policy import CircuitBreaker, CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+# Badges each adapter handles at the same time. BlueZ controllers typically hold 5 to 10
+#   LE links, and set up one connection at a time.
+DEFAULT_WORKERS_PER_ADAPTER = 4
+
+# RSSIs (dBm) at which a link counts as good and as weak, and the weight of the most recent
+#   RSSI heard in the running average kept per adapter and badge.
+GOOD_RSSI = -60
+WEAK_RSSI = -90
+RSSI_SMOOTHING = 0.3
+
+# Costs added when placing a badge, in units of one extra badge queued on the adapter:
+#   for a link as weak as WEAK_RSSI, for an adapter that always failed with the badge, and
+#   (subtracted) for an adapter already holding a link to the badge.
+RSSI_WEIGHT = 1.0
+FAILURE_WEIGHT = 2.0
+LINK_REUSE_BONUS = 0.5
+
+
+# What the scheduler knows about one adapter: its connection pool, and per badge the
+#   running average RSSI and the (successes, failures) of past operations through it.
+class _Adapter(object):
+    def __init__(self, iface, manager):
+        self.iface = iface
+        self.manager = manager
+        self.rssi = {}
+        self.outcomes = {}
+
+
+# AdapterScheduler spreads fleet operations over several HCI adapters (hci`iface` for every
+#   iface in `adapters`), so each extra USB dongle adds the links and the connection setup
+#   capacity of one more controller.
+# Each adapter has its own ConnectionManager, whose links are opened through it by
+#   connection_factory(address, iface=iface). run() places every badge on the adapter with
+#   the lowest cost: the badges already queued on it, plus penalties for a weak RSSI and for
+#   past failures with that badge on that adapter, minus a bonus if it still holds a link to
+#   the badge. Each adapter then works through its queue on its own pool of
+#   `workers_per_adapter` workers.
+# RSSIs come from record_rssi(), e.g. from a scan on each adapter; outcomes are recorded
+#   by run() itself. With a `circuit_breaker`, run() skips the badges whose circuit is open,
+#   reporting them as failed with CircuitOpenError, and records every outcome in it.
+class AdapterScheduler(object):
+    def __init__(
+        self,
+        adapters: Sequence[int] = (0,),
+        workers_per_adapter: int = DEFAULT_WORKERS_PER_ADAPTER,
+        connection_factory: Callable[..., BadgeConnection] = connect_to_badge,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        **manager_options,
+    ):
+        if not adapters:
+            raise ValueError("AdapterScheduler needs at least one adapter")
+        self.workers_per_adapter = workers_per_adapter
+        self.circuit_breaker = circuit_breaker
+        # A controller only holds a few links, which idle pooled links would use up.
+        manager_options.setdefault("max_connections", workers_per_adapter)
+        self.adapters = {}
+        for iface in adapters:
+            factory = functools.partial(connection_factory, iface=iface)
+            self.adapters[iface] = _Adapter(
+                iface, ConnectionManager(connection_factory=factory, **manager_options)
+            )
+        self.lock = threading.Lock()
+
+    def manager(self, iface: int) -> ConnectionManager:
+        return self.adapters[iface].manager
+
+    # Returns the iface of the adapter holding a link to `address`, or else of the adapter
+    #   the badge would be placed on now.
+    def adapter_for(self, address: str) -> int:
+        for adapter in self.adapters.values():
+            if address in adapter.manager:
+                return adapter.iface
+        with self.lock:
+            return min(
+                self.adapters.values(),
+                key=lambda adapter: self._cost(adapter, address, adapter.manager.in_use()),
+            ).iface
+
+    # Returns the ConnectionManager to use for `address`, e.g. for an interactive session.
+    def manager_for(self, address: str) -> ConnectionManager:
+        return self.manager(self.adapter_for(address))
+
+    def record_rssi(self, iface: int, address: str, rssi: float):
+        adapter = self.adapters.get(iface)
+        if adapter is None:
+            return
+        with self.lock:
+            previous = adapter.rssi.get(address)
+            if previous is not None:
+                rssi = previous + RSSI_SMOOTHING * (rssi - previous)
+            adapter.rssi[address] = rssi
+
+    def record_result(self, iface: int, address: str, ok: bool):
+        adapter = self.adapters[iface]
+        with self.lock:
+            successes, failures = adapter.outcomes.get(address, (0, 0))
+            if ok:
+                successes += 1
+            else:
+                failures += 1
+            adapter.outcomes[address] = (successes, failures)
+
+    def _cost(self, adapter, address, load):
+        cost = load / self.workers_per_adapter
+        rssi = adapter.rssi.get(address)
+        if rssi is not None:
+            weakness = (GOOD_RSSI - rssi) / (GOOD_RSSI - WEAK_RSSI)
+            cost += RSSI_WEIGHT * min(1.0, max(0.0, weakness))
+        successes, failures = adapter.outcomes.get(address, (0, 0))
+        if failures:
+            cost += FAILURE_WEIGHT * failures / (successes + failures)
+        if address in adapter.manager:
+            cost -= LINK_REUSE_BONUS
+        return cost
+
+    # Places the badges, given as (participant, address) pairs, on the adapters and returns
+    #   {iface: [(index, (participant, address)), ...]} with the queue of every adapter.
+    def assign(self, badges: Sequence[Tuple[Any, str]]) -> Dict[int, List[Tuple[int, Any]]]:
+        queues = {iface: [] for iface in self.adapters}
+        with self.lock:
+            for index, badge in enumerate(badges):
+                address = badge[1]
+                adapter = min(
+                    self.adapters.values(),
+                    key=lambda adapter: self._cost(
+                        adapter, address, len(queues[adapter.iface])
+                    ),
+                )
+                queues[adapter.iface].append((index, badge))
+        return queues
+
+    # Runs operation(participant, address, manager) for every (participant, address) pair
+    #   in `badges`, where `manager` is the ConnectionManager of the badge's adapter, and
+    #   returns a FleetReport over all adapters. Timeouts and failures are handled per badge
+    #   as in run_on_fleet(); the link of a badge that timed out is dropped from its pool.
+    def run(
+        self,
+        badges: Iterable[Tuple[Any, str]],
+        operation: Callable[[Any, str, ConnectionManager], Any],
+        timeout: Optional[float] = DEFAULT_BADGE_TIMEOUT,
+        name: str = "fleet operation",
+        workers_per_adapter: Optional[int] = None,
+    ) -> FleetReport:
+        if workers_per_adapter is None:
+            workers_per_adapter = self.workers_per_adapter
+        start = time.monotonic()
+        badges = list(badges)
+        results = [None] * len(badges)
+        allowed = []
+        for index, (participant, address) in enumerate(badges):
+            if self.circuit_breaker is None or self.circuit_breaker.allow(address):
+                allowed.append(index)
+                continue
+            results[index] = BadgeResult(
+                participant,
+                address,
+                error=CircuitOpenError(
+                    "{} keeps failing, skipped for another {:.0f}s".format(
+                        address, self.circuit_breaker.retry_after(address)
+                    )
+                ),
+            )
+        queues = self.assign([badges[index] for index in allowed])
+
+        # A badge moved to another adapter must not keep an idle link on its old one.
+        for iface, queue in queues.items():
+            for _, (_, address) in queue:
+                for other in self.adapters.values():
+                    if other.iface != iface:
+                        other.manager.discard(address)
+
+        def run_adapter(iface, queue):
+            manager = self.adapters[iface].manager
+            report = run_on_fleet(
+                [badge for _, badge in queue],
+                lambda participant, address: operation(participant, address, manager),
+                workers_per_adapter,
+                timeout,
+                "{} on hci{}".format(name, iface),
+                # The abandoned operation keeps using its link; the next round must not.
+                on_timeout=lambda participant, address: manager.discard(address),
+            )
+            logger.debug(report.summary())
+            for (index, _), result in zip(queue, report.results):
+                results[allowed[index]] = result
+                self.record_result(iface, result.address, result.ok)
+                if self.circuit_breaker is None:
+                    continue
+                if result.ok:
+                    self.circuit_breaker.record_success(result.address)
+                else:
+                    self.circuit_breaker.record_failure(result.address)
+
+        threads = [
+            threading.Thread(
+                target=run_adapter, args=(iface, queue), name="hci{}".format(iface)
+            )
+            for iface, queue in queues.items()
+            if queue
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return FleetReport(name, results, time.monotonic() - start)
+
+    # Scan-first run(): scans on all adapters for `scan_seconds` with scanner(seconds,
+    #   ifaces) (see badge_scanner.scan_for_badges), records the RSSIs heard, and runs
+    #   `operation` only on the badges heard or already linked, strongest first. The others
+    #   are logged right away and reported as failed with BadgeNotSeenError, instead of each
+    #   costing a connection timeout; this counts as a failure on every adapter and with the
+    #   circuit breaker. Badges with a pooled link are not expected to be
+    #   heard, since a connected midge stops advertising. A `scan_seconds` of 0 skips the
+    #   scan and runs on all badges, as does a scan that fails (e.g. ScanFailedError): a
+    #   scan that heard nothing must not skip the whole fleet.
+    def scan_and_run(
+        self,
+        badges: Iterable[Tuple[Any, str]],
+        operation: Callable[[Any, str, ConnectionManager], Any],
+        scan_seconds: float = DEFAULT_SCAN_SECONDS,
+        scanner: Callable[..., Dict[str, Any]] = scan_for_badges,
+        name: str = "fleet operation",
+        **run_options,
+    ) -> FleetReport:
+        badges = list(badges)
+        if not scan_seconds:
+            return self.run(badges, operation, name=name, **run_options)
+        start = time.monotonic()
+
+        # (index, address) of the badges, so badges sharing an address keep their own results.
+        linked = []
+        unlinked = []
+        for index, (_, address) in enumerate(badges):
+            if any(address in adapter.manager for adapter in self.adapters.values()):
+                linked.append((index, address))
+            else:
+                unlinked.append((index, address))
+        try:
+            seen = scanner(scan_seconds, list(self.adapters)) if unlinked else {}
+        except Exception as err:
+            logger.warning(
+                "Scanning failed ({}), trying to connect to every midge.".format(err)
+            )
+            return self.run(badges, operation, name=name, **run_options)
+        present, missing = split_by_scan(unlinked, seen)
+
+        for _, address in present:
+            for iface, rssi in seen[address.lower()].rssi_by_iface.items():
+                self.record_rssi(iface, address, rssi)
+        results = [None] * len(badges)
+        for index, address in missing:
+            participant = badges[index][0]
+            logger.info(
+                "Midge {} ({}) was not seen advertising, skipping it.".format(
+                    participant, address
+                )
+            )
+            results[index] = BadgeResult(
+                participant,
+                address,
+                error=BadgeNotSeenError("{} was not seen advertising".format(address)),
+            )
+            # No adapter heard it, so the failure counts against all of them.
+            for iface in self.adapters:
+                self.record_result(iface, address, False)
+            if self.circuit_breaker is not None:
+                self.circuit_breaker.record_failure(address)
+
+        running = [index for index, _ in linked + present]
+        report = self.run([badges[index] for index in running], operation, name=name, **run_options)
+        for index, result in zip(running, report.results):
+            results[index] = result
+        return FleetReport(name, results, time.monotonic() - start)
+
+    # Closes the pooled links on every adapter, except those to the addresses in `keep`.
+    def close_all(self, keep: Iterable[str] = ()):
+        keep = set(keep)
+        for adapter in self.adapters.values():
+            adapter.manager.close_all(keep)
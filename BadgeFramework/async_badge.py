@@ -0,0 +1,272 @@
+from __future__ import annotations
+import asyncio
+import contextlib
+import functools
+import logging
+import time
+from concurrent.futures import Executor
+from typing import Optional
+
+from badge import (
+    DEFAULT_IMU_ACC_FSR,
+    DEFAULT_IMU_DATARATE,
+    DEFAULT_IMU_GYR_FSR,
+    DEFAULT_MICROPHONE_MODE,
+    DEFAULT_RESPONSE_TIMEOUT,
+    DEFAULT_SCAN_INTERVAL,
+    DEFAULT_SCAN_WINDOW,
+    FREE_SDC_SPACE_REQUEST_TEMPLATE,
+    RESTART_REQUEST_TEMPLATE,
+    STOP_IMU_REQUEST_TEMPLATE,
+    STOP_MICROPHONE_REQUEST_TEMPLATE,
+    STOP_SCAN_REQUEST_TEMPLATE,
+    PendingRequests,
+    ResponseDecodeError,
+    ResponseFrameDecoder,
+    identify_request_frame,
+    render_frame,
+    start_imu_request_frame,
+    start_microphone_request_frame,
+    start_scan_request_frame,
+    status_request_frame,
+)
+from badge_connection import AsyncBadgeConnection, BadgeConnection
+from badge_metrics import LatencyRecorder, default_recorder
+from badge_protocol import (
+    Response_free_sdc_space_response_tag,
+    Response_start_imu_response_tag,
+    Response_start_microphone_response_tag,
+    Response_start_scan_response_tag,
+    Response_status_response_tag,
+)
+
+logger = logging.getLogger(__name__)
+
+
+# Runs a blocking BadgeConnection (e.g. a BLEBadgeConnection) from asyncio code.
+#    Every call is offloaded to `executor` (the loop's default executor if None), and calls
+#    on the same connection are serialized, since bluepy peripherals are not thread safe.
+#    Pass an executor with enough workers to keep one thread per concurrently used badge.
+class ExecutorBadgeConnection(AsyncBadgeConnection):
+    def __init__(self, connection: BadgeConnection, executor: Optional[Executor] = None):
+        AsyncBadgeConnection.__init__(self)
+        self.connection = connection
+        self.address = getattr(connection, "address", None)
+        self.executor = executor
+        self.lock = asyncio.Lock()
+
+    async def _call(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        async with self.lock:
+            return await loop.run_in_executor(
+                self.executor, functools.partial(func, *args, **kwargs)
+            )
+
+    async def connect(self):
+        return await self._call(self.connection.connect)
+
+    async def disconnect(self):
+        return await self._call(self.connection.disconnect)
+
+    def is_connected(self):
+        return self.connection.is_connected()
+
+    async def send(self, message, response_len=0, timeout=None, acknowledged=True):
+        return await self._call(
+            self.connection.send,
+            message,
+            response_len=response_len,
+            timeout=timeout,
+            acknowledged=acknowledged,
+        )
+
+    async def await_data(self, data_len, timeout=None):
+        return await self._call(self.connection.await_data, data_len, timeout=timeout)
+
+    async def receive_available(self, timeout=None):
+        return await self._call(self.connection.receive_available, timeout=timeout)
+
+
+# asyncio counterpart of OpenBadge: the same commands, as coroutines.
+#    Commands on one badge run one at a time; commands on different badges run concurrently,
+#    e.g. asyncio.gather(*(badge.get_status() for badge in badges)).
+#    Responses go through the same frame decoder and pending-request table (see
+#    PendingRequests) as OpenBadge's, received by the command waiting for one; a late
+#    response to a command that timed out is dropped as stale.
+#    Like OpenBadge, it records the write and wait phases of every command in `metrics`.
+class AsyncOpenBadge(object):
+    def __init__(
+        self,
+        connection: AsyncBadgeConnection,
+        timeout: float = DEFAULT_RESPONSE_TIMEOUT,
+        metrics: Optional[LatencyRecorder] = default_recorder,
+    ):
+        self.connection = connection
+        self.timeout = timeout
+        self.metrics = metrics
+        self.address = getattr(connection, "address", None)
+        self.lock = asyncio.Lock()
+        self.requests = PendingRequests()
+        self.frame_decoder = ResponseFrameDecoder()
+
+    # `frame` may be a callable rendering it when it is written (see render_frame()).
+    async def send_frame(self, frame, acknowledged=True):
+        frame = render_frame(frame)
+        logger.debug("Sending frame, Raw: {}".format(frame.hex()))
+
+        await self.connection.send(frame, response_len=0, acknowledged=acknowledged)
+
+    # Receives data until at least one response is complete and dispatches every complete
+    #   response, waiting at most `timeout` seconds. A partial response stays in the frame
+    #   decoder, so a timeout never leaves the stream out of step.
+    async def receive_response(self, timeout: Optional[float] = None):
+        if timeout is None:
+            timeout = self.timeout
+        deadline = time.monotonic() + timeout
+        while True:
+            data = await self.connection.receive_available(
+                timeout=max(0.0, deadline - time.monotonic())
+            )
+            if self.receive_data(data):
+                return
+
+    # Feeds received bytes to the frame decoder and dispatches the complete responses, as
+    #   OpenBadge.receive_data() does.
+    def receive_data(self, data):
+        try:
+            responses = self.frame_decoder.feed(data)
+        except ResponseDecodeError as err:
+            for response_message in err.responses:
+                self.requests.dispatch(response_message)
+            raise
+        for response_message in responses:
+            self.requests.dispatch(response_message)
+        return len(responses)
+
+    def _timed(self, phase, command):
+        if self.metrics is None:
+            return contextlib.nullcontext()
+        return self.metrics.time(phase, self.address, command)
+
+    # Sends `frame` for `command` and returns the response with tag `response_tag`, or None
+    #   if `response_tag` is None. Only requests whose delivery nothing depends on (identify,
+    #   restart) should be sent with acknowledged=False.
+    async def _command(
+        self,
+        command,
+        frame,
+        response_tag=None,
+        timeout: Optional[float] = None,
+        acknowledged=True,
+    ):
+        if timeout is None:
+            timeout = self.timeout
+        async with self.lock:
+            pending = None
+            if response_tag is not None:
+                pending = self.requests.expect(response_tag)
+            try:
+                with self._timed("write", command):
+                    await self.send_frame(frame, acknowledged=acknowledged)
+            except BaseException:
+                if pending is not None:
+                    self.requests.cancel(pending)
+                raise
+            if pending is None:
+                return None
+
+            with self._timed("wait", command):
+                return await self._await_response(pending, timeout)
+
+    async def _await_response(self, pending, timeout):
+        deadline = time.monotonic() + timeout
+        try:
+            while not pending.done:
+                await self.receive_response(timeout=max(0.0, deadline - time.monotonic()))
+        except BaseException:
+            if self.requests.cancel(pending):
+                raise
+        return pending.result()
+
+    # `t` may be a callable, as for OpenBadge.get_status().
+    async def get_status(
+        self,
+        t=None,
+        new_id: Optional[int] = None,
+        new_group_number: Optional[int] = None,
+        timeout: Optional[float] = None,
+    ):
+        if callable(t):
+            stamp = t
+            frame = lambda: status_request_frame(stamp(), new_id, new_group_number)
+        else:
+            frame = status_request_frame(t, new_id, new_group_number)
+        return await self._command(
+            "get_status", frame, Response_status_response_tag, timeout
+        )
+
+    async def start_microphone(
+        self, t=None, mode=DEFAULT_MICROPHONE_MODE, timeout: Optional[float] = None
+    ):
+        return await self._command(
+            "start_microphone",
+            start_microphone_request_frame(t, mode),
+            Response_start_microphone_response_tag,
+            timeout,
+        )
+
+    async def stop_microphone(self):
+        await self._command("stop_microphone", STOP_MICROPHONE_REQUEST_TEMPLATE.render())
+
+    async def start_scan(
+        self,
+        t=None,
+        window_ms=DEFAULT_SCAN_WINDOW,
+        interval_ms=DEFAULT_SCAN_INTERVAL,
+        timeout: Optional[float] = None,
+    ):
+        return await self._command(
+            "start_scan",
+            start_scan_request_frame(t, window_ms, interval_ms),
+            Response_start_scan_response_tag,
+            timeout,
+        )
+
+    async def stop_scan(self):
+        await self._command("stop_scan", STOP_SCAN_REQUEST_TEMPLATE.render())
+
+    async def start_imu(
+        self,
+        t=None,
+        acc_fsr=DEFAULT_IMU_ACC_FSR,
+        gyr_fsr=DEFAULT_IMU_GYR_FSR,
+        datarate=DEFAULT_IMU_DATARATE,
+        timeout: Optional[float] = None,
+    ):
+        return await self._command(
+            "start_imu",
+            start_imu_request_frame(t, acc_fsr, gyr_fsr, datarate),
+            Response_start_imu_response_tag,
+            timeout,
+        )
+
+    async def stop_imu(self):
+        await self._command("stop_imu", STOP_IMU_REQUEST_TEMPLATE.render())
+
+    async def identify(self, duration_seconds=10):
+        await self._command(
+            "identify", identify_request_frame(duration_seconds), acknowledged=False
+        )
+        return True
+
+    async def restart(self):
+        await self._command("restart", RESTART_REQUEST_TEMPLATE.render(), acknowledged=False)
+        return True
+
+    async def get_free_sdc_space(self, timeout: Optional[float] = None):
+        return await self._command(
+            "get_free_sdc_space",
+            FREE_SDC_SPACE_REQUEST_TEMPLATE.render(),
+            Response_free_sdc_space_response_tag,
+            timeout,
+        )
@@ -1,11 +1,46 @@
-from __future__ import division, absolute_import, print_function
+from __future__ import division, absolute_import, print_function, annotations
+import collections
 import time
 import logging
 import sys
 import struct
 import queue
-from typing import Optional, Final
-from badge_protocol import Request as mRequest
+import threading
+from badge_connection import BadgeTimeoutError
+from badge_protocol import (
+    BadgeAssignement,
+    IdentifyRequest,
+    Request as mRequest,
+    Request_free_sdc_space_request_tag,
+    Request_identify_request_tag,
+    Request_restart_request_tag,
+    Request_start_imu_request_tag,
+    Request_start_microphone_request_tag,
+    Request_start_scan_request_tag,
+    Request_status_request_tag,
+    Request_stop_imu_request_tag,
+    Request_stop_microphone_request_tag,
+    Request_stop_scan_request_tag,
+    Response,
+    Response_free_sdc_space_response_tag,
+    Response_start_imu_response_tag,
+    Response_start_microphone_response_tag,
+    Response_start_scan_response_tag,
+    Response_status_response_tag,
+    StartImuRequest,
+    StartMicrophoneRequest,
+    StartScanRequest,
+    StatusRequest,
+)
+from badge_metrics import default_recorder
+
+# typing is only needed by type checkers; importing it at runtime is a noticeable part of
+# the startup time of the hub scripts, and annotations are not evaluated (see __future__).
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import Final, Optional
+
+    from badge_metrics import LatencyRecorder
 
 DEFAULT_SCAN_WINDOW: Final[int] = 250
 DEFAULT_SCAN_INTERVAL: Final[int] = 1000
@@ -16,7 +51,11 @@ DEFAULT_IMU_DATARATE: Final[int] = 50
 
 DEFAULT_MICROPHONE_MODE: Final[int] = 1  # Valid options: 0=Stereo, 1=Mono
 
-from badge_protocol import *
+# Seconds a command waits for the badge's response before raising a BadgeTimeoutError.
+DEFAULT_RESPONSE_TIMEOUT: Final[float] = 10.0
+
+# Every request and response frame is prefixed with its payload length.
+LENGTH_HEADER: Final[struct.Struct] = struct.Struct("<H")
 
 logger = logging.getLogger(__name__)
 
@@ -43,17 +82,414 @@ def timestamps_to_time(timestamp_seconds, timestamp_miliseconds):
     return float(timestamp_seconds) + (float(timestamp_miliseconds) / 1000.0)
 
 
+# A pre-serialized request frame (length header included) for one request type.
+#   The payload following the union tag is described by `payload_struct`; render() copies
+#   the cached frame and packs the given field values into it, so issuing a command costs
+#   a memcpy and one pack_into instead of building and encoding a Request object tree.
+#   Requests without payload are sent as the cached frame itself.
+class RequestTemplate(object):
+    PAYLOAD_OFFSET: Final[int] = LENGTH_HEADER.size + 1
+
+    def __init__(self, which: int, payload_struct: Optional[struct.Struct] = None):
+        self.which = which
+        self.payload_struct = payload_struct
+        payload_len = payload_struct.size if payload_struct is not None else 0
+        frame = bytearray(self.PAYLOAD_OFFSET + payload_len)
+        LENGTH_HEADER.pack_into(frame, 0, 1 + payload_len)
+        frame[LENGTH_HEADER.size] = which
+        self.frame = bytes(frame)
+
+    def render(self, *values):
+        if self.payload_struct is None:
+            return self.frame
+        frame = bytearray(self.frame)
+        self.payload_struct.pack_into(frame, self.PAYLOAD_OFFSET, *values)
+        return frame
+
+
+STATUS_REQUEST_TEMPLATE = RequestTemplate(
+    Request_status_request_tag, StatusRequest._struct
+)
+# Status request carrying a badge assignement: the has_badge_assignement flag is followed
+# by the assignement itself.
+STATUS_ASSIGNEMENT_REQUEST_TEMPLATE = RequestTemplate(
+    Request_status_request_tag,
+    struct.Struct(StatusRequest._struct.format + BadgeAssignement._struct.format[1:]),
+)
+START_MICROPHONE_REQUEST_TEMPLATE = RequestTemplate(
+    Request_start_microphone_request_tag, StartMicrophoneRequest._struct
+)
+STOP_MICROPHONE_REQUEST_TEMPLATE = RequestTemplate(Request_stop_microphone_request_tag)
+START_SCAN_REQUEST_TEMPLATE = RequestTemplate(
+    Request_start_scan_request_tag, StartScanRequest._struct
+)
+STOP_SCAN_REQUEST_TEMPLATE = RequestTemplate(Request_stop_scan_request_tag)
+START_IMU_REQUEST_TEMPLATE = RequestTemplate(
+    Request_start_imu_request_tag, StartImuRequest._struct
+)
+STOP_IMU_REQUEST_TEMPLATE = RequestTemplate(Request_stop_imu_request_tag)
+IDENTIFY_REQUEST_TEMPLATE = RequestTemplate(
+    Request_identify_request_tag, IdentifyRequest._struct
+)
+RESTART_REQUEST_TEMPLATE = RequestTemplate(Request_restart_request_tag)
+FREE_SDC_SPACE_REQUEST_TEMPLATE = RequestTemplate(Request_free_sdc_space_request_tag)
+
+
+# -- Request frames of the badge commands, shared by the blocking and asyncio badge APIs --
+
+# `t` is the time sent to the badge (now if None), as for the OpenBadge methods.
+def _timestamps(t=None):
+    if t is None:
+        return get_timestamps()
+    return get_timestamps_from_time(t)
+
+
+# Returns `frame`, or the frame it renders if it is a callable. Frames can be given as
+#   callables so that a timestamp in them is taken right before they are written, not when
+#   they are queued for the reader thread, which may be waiting on the link for a response.
+def render_frame(frame):
+    return frame() if callable(frame) else frame
+
+
+def status_request_frame(
+    t=None, new_id: Optional[int] = None, new_group_number: Optional[int] = None
+):
+    (timestamp_seconds, timestamp_ms) = _timestamps(t)
+    if (new_id is None) or (new_group_number is None):
+        return STATUS_REQUEST_TEMPLATE.render(timestamp_seconds, timestamp_ms, False)
+    return STATUS_ASSIGNEMENT_REQUEST_TEMPLATE.render(
+        timestamp_seconds, timestamp_ms, True, new_id, new_group_number
+    )
+
+
+def start_microphone_request_frame(t=None, mode=DEFAULT_MICROPHONE_MODE):
+    (timestamp_seconds, timestamp_ms) = _timestamps(t)
+    return START_MICROPHONE_REQUEST_TEMPLATE.render(timestamp_seconds, timestamp_ms, mode)
+
+
+def start_scan_request_frame(
+    t=None, window_ms=DEFAULT_SCAN_WINDOW, interval_ms=DEFAULT_SCAN_INTERVAL
+):
+    (timestamp_seconds, timestamp_ms) = _timestamps(t)
+    return START_SCAN_REQUEST_TEMPLATE.render(
+        timestamp_seconds, timestamp_ms, window_ms, interval_ms
+    )
+
+
+def start_imu_request_frame(
+    t=None,
+    acc_fsr=DEFAULT_IMU_ACC_FSR,
+    gyr_fsr=DEFAULT_IMU_GYR_FSR,
+    datarate=DEFAULT_IMU_DATARATE,
+):
+    (timestamp_seconds, timestamp_ms) = _timestamps(t)
+    return START_IMU_REQUEST_TEMPLATE.render(
+        timestamp_seconds, timestamp_ms, acc_fsr, gyr_fsr, datarate
+    )
+
+
+def identify_request_frame(duration_seconds=10):
+    return IDENTIFY_REQUEST_TEMPLATE.render(duration_seconds)
+
+
+# Raised by ResponseFrameDecoder.feed() when frames could not be decoded. `responses` holds
+#   the Responses decoded from the other frames, which the caller still has to handle.
+class ResponseDecodeError(ValueError):
+    def __init__(self, message, responses):
+        ValueError.__init__(self, message)
+        self.responses = responses
+
+
+# Incrementally splits a byte stream into length-prefixed Response frames.
+#   Chunks can be fed as they arrive (e.g. one BLE notification at a time); feed() returns
+#   every Response completed by the chunk. Partial frames stay in the buffer and are decoded
+#   in place once the rest arrives. A frame that fails to decode is skipped, and feed()
+#   raises a ResponseDecodeError carrying the Responses of the other frames.
+class ResponseFrameDecoder(object):
+    def __init__(self):
+        self.buffer = bytearray()
+        # Start of the first frame that has not been decoded yet.
+        self.offset = 0
+
+    # Returns the number of buffered bytes that do not form a complete frame yet.
+    def pending(self):
+        return len(self.buffer) - self.offset
+
+    def reset(self):
+        self.buffer = bytearray()
+        self.offset = 0
+
+    def feed(self, data):
+        if self.offset:
+            # Dropping consumed bytes from the front of a bytearray does not copy the rest.
+            del self.buffer[: self.offset]
+            self.offset = 0
+        self.buffer += data
+
+        responses = []
+        errors = []
+        with memoryview(self.buffer) as view:
+            while len(view) - self.offset >= LENGTH_HEADER.size:
+                frame_len = LENGTH_HEADER.unpack_from(view, self.offset)[0]
+                start = self.offset + LENGTH_HEADER.size
+                end = start + frame_len
+                if end > len(view):
+                    break
+                # Skip the frame before decoding it, so a corrupt frame is not retried forever.
+                self.offset = end
+                with view[start:end] as frame:
+                    try:
+                        responses.append(Response.decode(frame))
+                    except Exception as err:
+                        # The traceback holds views of the buffer, which would keep the
+                        #   next feed() from resizing it.
+                        errors.append(err.with_traceback(None))
+        if errors:
+            raise ResponseDecodeError(
+                "Could not decode {} response frame(s): {}".format(len(errors), errors[0]),
+                responses,
+            ) from errors[0]
+        return responses
+
+
+# Response tags a request can wait for; the keys of the pending-request table.
+RESPONSE_TAGS: Final[tuple] = (
+    Response_status_response_tag,
+    Response_start_microphone_response_tag,
+    Response_start_scan_response_tag,
+    Response_start_imu_response_tag,
+    Response_free_sdc_space_response_tag,
+)
+
+# Seconds a request that timed out keeps its place in the pending-request table, so that a
+#   late response to it is dropped as stale instead of completing the next request. After
+#   that, the request is taken to have got no response.
+STALE_RESPONSE_WINDOW: Final[float] = 2.0
+
+# Seconds the reader thread waits on the link for an awaited response before it checks for
+#   frames to send. A reader awaiting no response sleeps until a frame is submitted.
+DEFAULT_READER_POLL_INTERVAL: Final[float] = 0.01
+
+
+# Entry of the pending-request table, completed with the response's message or an error.
+#   Lighter than a concurrent.futures.Future: a waiter needs an `event` (a threading.Event,
+#   or an asyncio.Event on the event loop's thread) only when someone else completes the
+#   request. Guarded by the table's lock, except in the reader's outbox where it tracks one
+#   write.
+class PendingResponse(object):
+    __slots__ = ("response", "error", "done", "cancelled", "cancelled_at", "event")
+
+    def __init__(self, event: Optional[threading.Event] = None):
+        self.response = None
+        self.error = None
+        self.done = False
+        self.cancelled = False
+        self.cancelled_at = 0.0
+        self.event = event
+
+    def result(self):
+        if self.error is not None:
+            raise self.error
+        return self.response
+
+
+# Pending-request table of OpenBadge and AsyncOpenBadge: one FIFO of PendingResponses per
+#   response tag, completed in order since the firmware answers in request order.
+#   Responses nobody waits for are counted: as stale if they answer a request that timed
+#   out less than STALE_RESPONSE_WINDOW seconds before, as unexpected otherwise.
+class PendingRequests(object):
+    def __init__(self):
+        self.entries = {tag: collections.deque() for tag in RESPONSE_TAGS}
+        self.lock = threading.Lock()
+        self.stale_responses = 0
+        self.unexpected_responses = 0
+
+    # Registers a request awaiting a response with tag `response_tag` and returns the
+    #   PendingResponse its response will complete, setting `event` if given.
+    def expect(self, response_tag: int, event=None) -> PendingResponse:
+        pending = PendingResponse(event)
+        with self.lock:
+            entries = self.entries[response_tag]
+            # Requests that timed out long before got no response.
+            while entries and self._expired(entries[0]):
+                entries.popleft()
+            entries.append(pending)
+        return pending
+
+    @staticmethod
+    def _expired(pending, now: Optional[float] = None) -> bool:
+        if not pending.cancelled:
+            return False
+        if now is None:
+            now = time.monotonic()
+        return now - pending.cancelled_at > STALE_RESPONSE_WINDOW
+
+    # Returns whether a response is awaited, or may still arrive for a request that timed out.
+    def awaiting(self) -> bool:
+        now = time.monotonic()
+        with self.lock:
+            return any(
+                not self._expired(pending, now)
+                for entries in self.entries.values()
+                for pending in entries
+            )
+
+    # Completes the oldest pending request of the response's type with the response.
+    def dispatch(self, response_message):
+        with self.lock:
+            entries = self.entries.get(response_message.type.which)
+            pending = entries.popleft() if entries else None
+            if pending is None:
+                self.unexpected_responses += 1
+            elif pending.cancelled:
+                self.stale_responses += 1
+            else:
+                pending.response = response_message.type._value
+                pending.done = True
+        if pending is None:
+            logger.debug("Unexpected response {}".format(response_message))
+        elif pending.cancelled:
+            logger.debug("Stale response {}".format(response_message))
+        elif pending.event is not None:
+            pending.event.set()
+
+    # Fails every pending request with `error`, e.g. because the connection was lost.
+    def fail_all(self, error):
+        with self.lock:
+            failed = []
+            for entries in self.entries.values():
+                for pending in entries:
+                    if not pending.cancelled:
+                        pending.error = error
+                        pending.done = True
+                        failed.append(pending)
+                entries.clear()
+        for pending in failed:
+            if pending.event is not None:
+                pending.event.set()
+
+    # Marks `pending` as abandoned unless it has been completed meanwhile, and returns
+    #   whether it is abandoned.
+    def cancel(self, pending) -> bool:
+        with self.lock:
+            if not pending.done and not pending.cancelled:
+                pending.cancelled = True
+                pending.cancelled_at = time.monotonic()
+            return pending.cancelled
+
+
+# Thread that owns the connection of an OpenBadge: it writes the frames submitted to it and,
+#   in between, receives data and hands it to OpenBadge.receive_data().
+#   bluepy peripherals cannot be used from two threads at once, so while the reader runs
+#   every send goes through submit(). A wait on the link cannot be interrupted, so the
+#   reader only waits on it in short polls while responses are awaited; otherwise it sleeps
+#   until submit() wakes it. Stops, failing the pending requests, if the connection raises
+#   anything but a timeout.
+class _ResponseReader(threading.Thread):
+    def __init__(self, badge, poll_interval):
+        threading.Thread.__init__(self, name="badge-reader-{}".format(badge.address), daemon=True)
+        self.badge = badge
+        self.poll_interval = poll_interval
+        self.outbox = queue.SimpleQueue()
+        # Set by submit() and stop(); cleared by the reader before it checks for work.
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+        self.error = None
+
+    # Queues `frame` for writing and returns a PendingResponse completed once it is written.
+    def submit(self, frame, acknowledged):
+        pending = PendingResponse(threading.Event())
+        self.outbox.put((frame, acknowledged, pending))
+        self.wake.set()
+        if self.error is not None or not self.is_alive():
+            self._fail_outbox(self.error or RuntimeError("Badge reader is not running"))
+        return pending
+
+    def stop(self):
+        self.stopping.set()
+        self.wake.set()
+
+    def _fail_outbox(self, error):
+        while True:
+            try:
+                _, _, pending = self.outbox.get_nowait()
+            except queue.Empty:
+                return
+            pending.error = error
+            pending.event.set()
+
+    def _flush_outbox(self):
+        connection = self.badge.connection
+        while True:
+            try:
+                frame, acknowledged, pending = self.outbox.get_nowait()
+            except queue.Empty:
+                return
+            if pending.cancelled:
+                # The caller stopped waiting for this write.
+                pending.event.set()
+                continue
+            try:
+                connection.send(render_frame(frame), response_len=0, acknowledged=acknowledged)
+            except BaseException as err:
+                pending.error = err
+                raise
+            finally:
+                pending.event.set()
+
+    def run(self):
+        connection = self.badge.connection
+        try:
+            while not self.stopping.is_set():
+                self.wake.clear()
+                self._flush_outbox()
+                if not self.badge.awaiting_response():
+                    self.wake.wait()
+                    continue
+                try:
+                    data = connection.receive_available(timeout=self.poll_interval)
+                except BadgeTimeoutError:
+                    continue
+                self.badge.receive_data(data)
+            self.error = RuntimeError("Badge reader stopped")
+        except BaseException as err:
+            logger.info("Reader for {} stopped: {}".format(self.badge.address, err))
+            self.error = err
+            self.badge.fail_pending(err)
+        self._fail_outbox(self.error)
+
+
 # Represents an OpenBadge currently connected via the BadgeConnection 'connection'.
 #    The 'connection' should already be connected when it is used to initialize this class.
 # Implements methods that allow for interaction with that badge.
+#    Commands expecting a response wait for at most `timeout` seconds (overridable per call).
+#    The durations of the write and wait phases of every command are recorded in `metrics`
+#    (a badge_metrics.LatencyRecorder, None to disable) under the connection's address.
+# Requests awaiting a response are kept in a pending-request table (PendingRequests).
+#    Responses are received by the waiting caller itself or, after start_reader(), by a
+#    dedicated reader thread.
 class OpenBadge(object):
-    def __init__(self, connection):
+    def __init__(
+        self,
+        connection,
+        timeout: float = DEFAULT_RESPONSE_TIMEOUT,
+        metrics: Optional[LatencyRecorder] = default_recorder,
+    ):
         self.connection = connection
-        self.status_response_queue = queue.Queue()
-        self.start_microphone_response_queue = queue.Queue()
-        self.start_scan_response_queue = queue.Queue()
-        self.start_imu_response_queue = queue.Queue()
-        self.free_sdc_space_response_queue = queue.Queue()
+        self.timeout = timeout
+        self.metrics = metrics
+        self.address = getattr(connection, "address", None)
+        self.requests = PendingRequests()
+        self.reader = None
+        self.frame_decoder = ResponseFrameDecoder()
+
+    @property
+    def stale_responses(self):
+        return self.requests.stale_responses
+
+    @property
+    def unexpected_responses(self):
+        return self.requests.unexpected_responses
 
     # Helper function to send a BadgeMessage `command_message` to a device, expecting a response
     # of class `response_type` that is a subclass of BadgeMessage, or None if no response is expected.
@@ -79,159 +515,305 @@ class OpenBadge(object):
             return True
 
     def send_request(self, request_message: mRequest):
-        print(type(request_message))
-        serialized_request = request_message.encode()
+        request_len = request_message.length()
 
-        # Adding length header:
-        serialized_request_len = struct.pack("<H", len(serialized_request))
-        serialized_request: bytes = serialized_request_len + serialized_request
+        # Length header and payload are written into one preallocated buffer.
+        serialized_request = bytearray(LENGTH_HEADER.size + request_len)
+        LENGTH_HEADER.pack_into(serialized_request, 0, request_len)
+        request_message.encode_into(serialized_request, LENGTH_HEADER.size)
 
         logger.debug(
             "Sending: {}, Raw: {}".format(request_message, serialized_request.hex())
         )
 
-        self.connection.send(serialized_request, response_len=0)
-
-    def receive_response(self):
-        response_len = struct.unpack("<H", self.connection.await_data(2))[0]
-        logger.debug("Wait response len: " + str(response_len))
-        serialized_response = self.connection.await_data(response_len)
-
-        response_message = Response.decode(serialized_response)
-
-        queue_options = {
-            Response_status_response_tag: self.status_response_queue,
-            Response_start_microphone_response_tag: self.start_microphone_response_queue,
-            Response_start_scan_response_tag: self.start_scan_response_queue,
-            Response_start_imu_response_tag: self.start_imu_response_queue,
-            Response_free_sdc_space_response_tag: self.free_sdc_space_response_queue,
-        }
-        response_options = {
-            Response_status_response_tag: response_message.type.status_response,
-            Response_start_microphone_response_tag: response_message.type.start_microphone_response,
-            Response_start_scan_response_tag: response_message.type.start_scan_response,
-            Response_start_imu_response_tag: response_message.type.start_imu_response,
-            Response_free_sdc_space_response_tag: response_message.type.free_sdc_space_response,
-        }
-        queue_options[response_message.type.which].put(
-            response_options[response_message.type.which]
+        self._write(serialized_request, True)
+
+    # Starts a reader thread that receives the responses in the background, so they are
+    #   dispatched as soon as they arrive. Call stop_reader() before closing the connection.
+    def start_reader(self, poll_interval: float = DEFAULT_READER_POLL_INTERVAL):
+        if self.reader is None:
+            self.reader = _ResponseReader(self, poll_interval)
+            self.reader.start()
+
+    def stop_reader(self):
+        reader, self.reader = self.reader, None
+        if reader is not None:
+            reader.stop()
+            if reader is not threading.current_thread():
+                reader.join()
+
+    def _write(self, frame, acknowledged):
+        if self.reader is None:
+            self.connection.send(render_frame(frame), response_len=0, acknowledged=acknowledged)
+        else:
+            self._await_write(self.reader.submit(frame, acknowledged), self.timeout)
+
+    # Waits at most `timeout` seconds for the reader thread to write a submitted frame, so a
+    #   wedged reader does not block the caller forever. A frame given up on is not written.
+    def _await_write(self, pending, timeout):
+        if not pending.event.wait(timeout):
+            pending.cancelled = True
+            raise BadgeTimeoutError(
+                "Reader of {} did not write the request within {:.1f}s".format(
+                    self.address, timeout
+                )
+            )
+        pending.result()
+
+    # Sends an already serialized request frame, e.g. one rendered from a RequestTemplate,
+    #   or a callable rendering it when it is written (see render_frame()).
+    #   Requests without a response may be sent with acknowledged=False, which saves the
+    #   round trip of an acknowledged BLE write but confirms nothing: only identify and
+    #   restart are, since a link is often closed right after a stop request.
+    def send_frame(self, frame, acknowledged=True, command: Optional[str] = None):
+        if callable(frame):
+            logger.debug("Sending frame rendered on write")
+        else:
+            logger.debug("Sending frame, Raw: {}".format(frame.hex()))
+
+        if self.metrics is None:
+            self._write(frame, acknowledged)
+            return
+        with self.metrics.time("write", self.address, command):
+            self._write(frame, acknowledged)
+
+    # Receives data until at least one response is complete and dispatches every complete
+    #   response, waiting at most `timeout` seconds. A partial response stays in the frame
+    #   decoder, so a timeout never leaves the stream out of step.
+    def receive_response(self, timeout: Optional[float] = None):
+        if timeout is None:
+            timeout = self.timeout
+        deadline = time.monotonic() + timeout
+        while True:
+            data = self.connection.receive_available(
+                timeout=max(0.0, deadline - time.monotonic())
+            )
+            if self.receive_data(data):
+                return
+
+    # Feeds raw bytes received from the badge (e.g. a BLE notification) and dispatches every
+    #   complete Response they contain. Returns the number of responses dispatched. If a
+    #   frame cannot be decoded, the other responses are dispatched before the
+    #   ResponseDecodeError is raised.
+    def receive_data(self, data):
+        try:
+            responses = self.frame_decoder.feed(data)
+        except ResponseDecodeError as err:
+            for response_message in err.responses:
+                self.dispatch_response(response_message)
+            raise
+        for response_message in responses:
+            self.dispatch_response(response_message)
+        return len(responses)
+
+    # Registers a request awaiting a response with tag `response_tag` and returns the
+    #   PendingResponse its response will complete. Must be called before the request is sent.
+    def expect_response(self, response_tag: int) -> PendingResponse:
+        return self.requests.expect(
+            response_tag, threading.Event() if self.reader is not None else None
+        )
+
+    def awaiting_response(self) -> bool:
+        return self.requests.awaiting()
+
+    def dispatch_response(self, response_message):
+        self.requests.dispatch(response_message)
+
+    def fail_pending(self, error):
+        self.requests.fail_all(error)
+
+    def _cancel(self, pending):
+        return self.requests.cancel(pending)
+
+    # Waits until `pending` (from expect_response()) is completed and returns the response.
+    #   Without a reader thread, receives responses in the calling thread meanwhile.
+    #   Raises a BadgeTimeoutError if none arrives within `timeout` seconds.
+    def await_response(
+        self, pending, timeout: Optional[float] = None, command: Optional[str] = None
+    ):
+        if timeout is None:
+            timeout = self.timeout
+        if self.metrics is None:
+            return self._await_response(pending, timeout)
+        with self.metrics.time("wait", self.address, command):
+            return self._await_response(pending, timeout)
+
+    def _await_response(self, pending, timeout):
+        deadline = time.monotonic() + timeout
+        try:
+            if pending.event is not None:
+                pending.event.wait(timeout)
+            else:
+                while not pending.done:
+                    self.receive_response(timeout=max(0.0, deadline - time.monotonic()))
+        except BaseException:
+            if self._cancel(pending):
+                raise
+        if not pending.done and self._cancel(pending):
+            raise BadgeTimeoutError(
+                "No response from {} within {:.1f}s".format(self.address, timeout)
+            )
+        return pending.result()
+
+    # Sends `frame` and returns the response with tag `response_tag`.
+    def _request(self, command, frame, response_tag, timeout):
+        pending = self.expect_response(response_tag)
+        try:
+            self.send_frame(frame, command=command)
+        except BaseException:
+            self._cancel(pending)
+            raise
+        return self.await_response(pending, timeout, command)
+
+    # Sends `requests`, a list of (command name, frame, response tag or None) tuples, back
+    #   to back and only then collects their responses, so the round trips overlap. Frames
+    #   expecting a response go out as unacknowledged writes: the responses confirm them.
+    # Returns the responses in request order (None for requests without a response).
+    #   Raises a BadgeTimeoutError if they do not all arrive within `timeout` seconds.
+    def send_pipelined(self, requests, timeout: Optional[float] = None):
+        if timeout is None:
+            timeout = self.timeout
+        deadline = time.monotonic() + timeout
+
+        entries = [
+            None if response_tag is None else self.expect_response(response_tag)
+            for _, _, response_tag in requests
+        ]
+        try:
+            if self.reader is None:
+                for command, frame, response_tag in requests:
+                    self.send_frame(
+                        frame, acknowledged=response_tag is None, command=command
+                    )
+            else:
+                self._submit_all(requests)
+            return [
+                None
+                if pending is None
+                else self.await_response(
+                    pending, max(0.0, deadline - time.monotonic()), command
+                )
+                for (command, _, _), pending in zip(requests, entries)
+            ]
+        finally:
+            for pending in entries:
+                if pending is not None:
+                    self._cancel(pending)
+
+    # Queues the frames of `requests` (as for send_pipelined()) for the reader thread at once,
+    #   so it writes them back to back instead of one per poll of the link, and waits at most
+    #   the badge's timeout until they are written. Each write is timed from the submission
+    #   of the batch. If one fails, the frames after it are not written.
+    def _submit_all(self, requests):
+        logger.debug("Sending {} frames".format(len(requests)))
+        submitted = time.monotonic()
+        writes = [
+            (command, self.reader.submit(frame, response_tag is None))
+            for command, frame, response_tag in requests
+        ]
+        deadline = submitted + self.timeout
+        try:
+            for command, pending in writes:
+                self._await_write(pending, max(0.0, deadline - time.monotonic()))
+                if self.metrics is not None:
+                    self.metrics.record(
+                        "write", time.monotonic() - submitted, self.address, command
+                    )
+        finally:
+            for _, pending in writes:
+                pending.cancelled = True
+
+    # Sends a status request and starts scan, microphone and IMU with default settings, as
+    #   one pipeline. With `new_id` and `new_group_number`, the status request also sets the
+    #   badge's ID and group, as in get_status().
+    # Returns the StatusResponse, StartScanResponse, StartMicrophoneResponse and
+    #   StartImuResponse.
+    def start_all_sensors(
+        self,
+        t=None,
+        timeout: Optional[float] = None,
+        new_id: Optional[int] = None,
+        new_group_number: Optional[int] = None,
+    ):
+        return self.send_pipelined(
+            [
+                (
+                    "get_status",
+                    status_request_frame(t, new_id, new_group_number),
+                    Response_status_response_tag,
+                ),
+                ("start_scan", start_scan_request_frame(t), Response_start_scan_response_tag),
+                (
+                    "start_microphone",
+                    start_microphone_request_frame(t),
+                    Response_start_microphone_response_tag,
+                ),
+                ("start_imu", start_imu_request_frame(t), Response_start_imu_response_tag),
+            ],
+            timeout,
         )
 
     # Sends a status request to this Badge.
     #   Optional fields new_id and new_group number will set the badge's id
     #     and group number. They must be sent together.
+    #   `t` may also be a callable returning the time to send, called right before the
+    #     request is written, e.g. to time a clock sync.
     # Returns a StatusResponse() representing badge's response.
     def get_status(
         self,
         t=None,
         new_id: Optional[int] = None,
         new_group_number: Optional[int] = None,
+        timeout: Optional[float] = None,
     ):
-        if t is None:
-            (timestamp_seconds, timestamp_ms) = get_timestamps()
+        if callable(t):
+            stamp = t
+            frame = lambda: status_request_frame(stamp(), new_id, new_group_number)
         else:
-            (timestamp_seconds, timestamp_ms) = get_timestamps_from_time(t)
-
-        request = Request()
-        request.type.which = Request_status_request_tag
-        request.type.status_request = StatusRequest()
-        request.type.status_request.timestamp = Timestamp()
-        request.type.status_request.timestamp.seconds = timestamp_seconds
-        request.type.status_request.timestamp.ms = timestamp_ms
-        if not ((new_id is None) or (new_group_number is None)):
-            request.type.status_request.badge_assignement = BadgeAssignement()
-            request.type.status_request.badge_assignement.ID = new_id
-            request.type.status_request.badge_assignement.group = new_group_number
-            request.type.status_request.has_badge_assignement = True
-
-        self.send_request(request)
-
-        # Clear the queue before receiving
-        with self.status_response_queue.mutex:
-            self.status_response_queue.queue.clear()
-
-        while self.status_response_queue.empty():
-            self.receive_response()
-
-        return self.status_response_queue.get()
+            frame = status_request_frame(t, new_id, new_group_number)
+        return self._request("get_status", frame, Response_status_response_tag, timeout)
 
     # Sends a request to the badge to start recording microphone data.
     # Returns a StartRecordResponse() representing the badges response.
-    def start_microphone(self, t=None, mode=DEFAULT_MICROPHONE_MODE):
-        if t is None:
-            (timestamp_seconds, timestamp_ms) = get_timestamps()
-        else:
-            (timestamp_seconds, timestamp_ms) = get_timestamps_from_time(t)
-
-        request = Request()
-        request.type.which = Request_start_microphone_request_tag
-        request.type.start_microphone_request = StartMicrophoneRequest()
-        request.type.start_microphone_request.timestamp = Timestamp()
-        request.type.start_microphone_request.timestamp.seconds = timestamp_seconds
-        request.type.start_microphone_request.timestamp.ms = timestamp_ms
-        request.type.start_microphone_request.mode = mode
-
-        self.send_request(request)
-
-        with self.start_microphone_response_queue.mutex:
-            self.start_microphone_response_queue.queue.clear()
-
-        while self.start_microphone_response_queue.empty():
-            self.receive_response()
-
-        return self.start_microphone_response_queue.get()
+    def start_microphone(
+        self, t=None, mode=DEFAULT_MICROPHONE_MODE, timeout: Optional[float] = None
+    ):
+        return self._request(
+            "start_microphone",
+            start_microphone_request_frame(t, mode),
+            Response_start_microphone_response_tag,
+            timeout,
+        )
 
     # Sends a request to the badge to stop recording.
     # Returns True if request was successfuly sent.
     def stop_microphone(self):
 
-        request = Request()
-        request.type.which = Request_stop_microphone_request_tag
-        request.type.stop_microphone_request = StopMicrophoneRequest()
-
-        self.send_request(request)
+        self.send_frame(STOP_MICROPHONE_REQUEST_TEMPLATE.render(), command="stop_microphone")
 
     # Sends a request to the badge to start performing scans and collecting scan data.
     #   window_miliseconds and interval_miliseconds controls radio duty cycle during scanning (0 for firmware default)
     #     radio is active for [window_miliseconds] every [interval_miliseconds]
     # Returns a StartScanningResponse() representing the badge's response.
     def start_scan(
-        self, t=None, window_ms=DEFAULT_SCAN_WINDOW, interval_ms=DEFAULT_SCAN_INTERVAL
+        self,
+        t=None,
+        window_ms=DEFAULT_SCAN_WINDOW,
+        interval_ms=DEFAULT_SCAN_INTERVAL,
+        timeout: Optional[float] = None,
     ):
-        if t is None:
-            (timestamp_seconds, timestamp_ms) = get_timestamps()
-        else:
-            (timestamp_seconds, timestamp_ms) = get_timestamps_from_time(t)
-
-        request = Request()
-        request.type.which = Request_start_scan_request_tag
-        request.type.start_scan_request = StartScanRequest()
-        request.type.start_scan_request.timestamp = Timestamp()
-        request.type.start_scan_request.timestamp.seconds = timestamp_seconds
-        request.type.start_scan_request.timestamp.ms = timestamp_ms
-        request.type.start_scan_request.window = window_ms
-        request.type.start_scan_request.interval = interval_ms
-
-        self.send_request(request)
-
-        # Clear the queue before receiving
-        with self.start_scan_response_queue.mutex:
-            self.start_scan_response_queue.queue.clear()
-
-        while self.start_scan_response_queue.empty():
-            self.receive_response()
-
-        return self.start_scan_response_queue.get()
+        return self._request(
+            "start_scan",
+            start_scan_request_frame(t, window_ms, interval_ms),
+            Response_start_scan_response_tag,
+            timeout,
+        )
 
     # Sends a request to the badge to stop scanning.
     # Returns True if request was successfuly sent.
     def stop_scan(self):
 
-        request = Request()
-        request.type.which = Request_stop_scan_request_tag
-        request.type.stop_scan_request = StopScanRequest()
-
-        self.send_request(request)
+        self.send_frame(STOP_SCAN_REQUEST_TEMPLATE.render(), command="stop_scan")
 
     def start_imu(
         self,
@@ -239,78 +821,42 @@ class OpenBadge(object):
         acc_fsr=DEFAULT_IMU_ACC_FSR,
         gyr_fsr=DEFAULT_IMU_GYR_FSR,
         datarate=DEFAULT_IMU_DATARATE,
+        timeout: Optional[float] = None,
     ):
-        if t is None:
-            (timestamp_seconds, timestamp_ms) = get_timestamps()
-        else:
-            (timestamp_seconds, timestamp_ms) = get_timestamps_from_time(t)
-
-        request = Request()
-        request.type.which = Request_start_imu_request_tag
-        request.type.start_imu_request = StartImuRequest()
-        request.type.start_imu_request.timestamp = Timestamp()
-        request.type.start_imu_request.timestamp.seconds = timestamp_seconds
-        request.type.start_imu_request.timestamp.ms = timestamp_ms
-        request.type.start_imu_request.acc_fsr = acc_fsr
-        request.type.start_imu_request.gyr_fsr = gyr_fsr
-        request.type.start_imu_request.datarate = datarate
-
-        self.send_request(request)
-
-        # Clear the queue before receiving
-        with self.start_imu_response_queue.mutex:
-            self.start_imu_response_queue.queue.clear()
-
-        while self.start_imu_response_queue.empty():
-            self.receive_response()
-
-        return self.start_imu_response_queue.get()
+        return self._request(
+            "start_imu",
+            start_imu_request_frame(t, acc_fsr, gyr_fsr, datarate),
+            Response_start_imu_response_tag,
+            timeout,
+        )
 
     def stop_imu(self):
 
-        request = Request()
-        request.type.which = Request_stop_imu_request_tag
-        request.type.stop_imu_request = StopImuRequest()
-
-        self.send_request(request)
+        self.send_frame(STOP_IMU_REQUEST_TEMPLATE.render(), command="stop_imu")
 
     # Send a request to the badge to light an led to identify its self.
     #   If duration_seconds == 0, badge will turn off LED if currently lit.
     # Returns True if request was successfuly sent.
     def identify(self, duration_seconds=10):
 
-        request = Request()
-        request.type.which = Request_identify_request_tag
-        request.type.identify_request = IdentifyRequest()
-        request.type.identify_request.timeout = duration_seconds
-
-        self.send_request(request)
+        self.send_frame(
+            identify_request_frame(duration_seconds), acknowledged=False, command="identify"
+        )
 
         return True
 
     def restart(self):
 
-        request = Request()
-        request.type.which = Request_restart_request_tag
-        request.type.restart_request = RestartRequest()
-
-        self.send_request(request)
+        self.send_frame(
+            RESTART_REQUEST_TEMPLATE.render(), acknowledged=False, command="restart"
+        )
 
         return True
 
-    def get_free_sdc_space(self):
-
-        request = Request()
-        request.type.which = Request_free_sdc_space_request_tag
-        request.type.free_sdc_space_request = FreeSDCSpaceRequest()
-
-        self.send_request(request)
-
-        # Clear the queue before receiving
-        with self.free_sdc_space_response_queue.mutex:
-            self.free_sdc_space_response_queue.queue.clear()
-
-        while self.free_sdc_space_response_queue.empty():
-            self.receive_response()
-
-        return self.free_sdc_space_response_queue.get()
+    def get_free_sdc_space(self, timeout: Optional[float] = None):
+        return self._request(
+            "get_free_sdc_space",
+            FREE_SDC_SPACE_REQUEST_TEMPLATE.render(),
+            Response_free_sdc_space_response_tag,
+            timeout,
+        )
@@ -0,0 +1,133 @@
+from __future__ import annotations
+import struct
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+# AD type of the manufacturer specific data, and the company identifier the midges put in
+#   front of their custom_advdata_t (rythmbadge/advertiser_lib.c).
+MANUFACTURER_DATA_AD_TYPE = 0xFF
+COMPANY_IDENTIFIER = 0xFF00
+COMPANY_IDENTIFIER_HEADER = struct.Struct("<H")
+
+# custom_advdata_t: battery percentage, status flags, badge ID, group and the MAC address
+#   (most significant byte first), 11 bytes.
+CUSTOM_ADVDATA = struct.Struct("<BBHB6s")
+
+# Bits of custom_advdata_t.status_flags.
+CLOCK_SYNCED_FLAG = 1 << 0
+MICROPHONE_FLAG = 1 << 1
+SCAN_FLAG = 1 << 2
+IMU_FLAG = 1 << 3
+
+# ID and group of a badge that has not been assigned one since it booted.
+RESET_ID = 0xFFFF
+RESET_GROUP = 0xFF
+
+
+# The state a midge advertises in its manufacturer specific data. The *_status properties
+#   are 0 or 1, like the fields of the same name in a StatusResponse.
+class BadgeAdvertisement(NamedTuple):
+    address: str
+    battery: int
+    status_flags: int
+    badge_id: int
+    group: int
+
+    @property
+    def clock_status(self):
+        return int(bool(self.status_flags & CLOCK_SYNCED_FLAG))
+
+    @property
+    def microphone_status(self):
+        return int(bool(self.status_flags & MICROPHONE_FLAG))
+
+    @property
+    def scan_status(self):
+        return int(bool(self.status_flags & SCAN_FLAG))
+
+    @property
+    def imu_status(self):
+        return int(bool(self.status_flags & IMU_FLAG))
+
+    # Whether the badge was given an ID and group since it booted.
+    @property
+    def is_assigned(self):
+        return self.badge_id != RESET_ID or self.group != RESET_GROUP
+
+
+# Yields the (AD type, data) of every AD structure in the advertising data `advdata`.
+def iter_ad_structures(advdata: bytes) -> Iterator[Tuple[int, bytes]]:
+    offset = 0
+    while offset < len(advdata):
+        length = advdata[offset]
+        if length == 0 or offset + 1 + length > len(advdata):
+            return
+        yield advdata[offset + 1], bytes(advdata[offset + 2 : offset + 1 + length])
+        offset += 1 + length
+
+
+# Returns the manufacturer specific data in the advertising data `advdata`, or None.
+def manufacturer_data(advdata: bytes) -> Optional[bytes]:
+    for ad_type, data in iter_ad_structures(advdata):
+        if ad_type == MANUFACTURER_DATA_AD_TYPE:
+            return data
+    return None
+
+
+# Parses manufacturer specific data, starting with the company identifier as reported by
+#   bluepy's ScanEntry.getValue(0xFF). Returns None for data that is not a midge's.
+def parse_manufacturer_data(data: Optional[bytes]) -> Optional[BadgeAdvertisement]:
+    if data is None:
+        return None
+    if len(data) != COMPANY_IDENTIFIER_HEADER.size + CUSTOM_ADVDATA.size:
+        return None
+    if COMPANY_IDENTIFIER_HEADER.unpack_from(data)[0] != COMPANY_IDENTIFIER:
+        return None
+    battery, status_flags, badge_id, group, mac = CUSTOM_ADVDATA.unpack_from(
+        data, COMPANY_IDENTIFIER_HEADER.size
+    )
+    return BadgeAdvertisement(
+        ":".join("{:02x}".format(byte) for byte in mac), battery, status_flags, badge_id, group
+    )
+
+
+# Parses a complete advertising packet, see parse_manufacturer_data().
+def parse_advertising_data(advdata: bytes) -> Optional[BadgeAdvertisement]:
+    return parse_manufacturer_data(manufacturer_data(advdata))
+
+
+# Returns the manufacturer specific data (company identifier included) a midge in the given
+#   state advertises; the inverse of parse_manufacturer_data().
+def encode_manufacturer_data(advertisement: BadgeAdvertisement) -> bytes:
+    return COMPANY_IDENTIFIER_HEADER.pack(COMPANY_IDENTIFIER) + CUSTOM_ADVDATA.pack(
+        advertisement.battery,
+        advertisement.status_flags,
+        advertisement.badge_id,
+        advertisement.group,
+        bytes.fromhex(advertisement.address.replace(":", "")),
+    )
+
+
+# Returns what is wrong with a midge according to its advertisement, as a list of short
+#   descriptions (empty if nothing): an unsynchronised clock, a sensor that is not
+#   recording (if `expect_recording`), and an ID or group other than the expected ones.
+def advertisement_problems(
+    advertisement: BadgeAdvertisement,
+    expected_id: Optional[int] = None,
+    expected_group: Optional[int] = None,
+    expect_recording: bool = True,
+) -> List[str]:
+    problems = []
+    if not advertisement.clock_status:
+        problems.append("clock not synced")
+    if expect_recording:
+        if not advertisement.microphone_status:
+            problems.append("microphone not recording")
+        if not advertisement.scan_status:
+            problems.append("scan not recording")
+        if not advertisement.imu_status:
+            problems.append("IMU not recording")
+    if expected_id is not None and advertisement.badge_id != expected_id:
+        problems.append("ID {} instead of {}".format(advertisement.badge_id, expected_id))
+    if expected_group is not None and advertisement.group != expected_group:
+        problems.append("group {} instead of {}".format(advertisement.group, expected_group))
+    return problems
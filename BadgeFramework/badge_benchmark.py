@@ -0,0 +1,480 @@
+#! /usr/bin/python3
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import timeit
+import tracemalloc
+
+import badge_protocol
+from badge import LENGTH_HEADER, START_IMU_REQUEST_TEMPLATE, OpenBadge
+from badge_connection import BadgeConnection
+from badge_protocol_schema import MESSAGES, SCALAR_FORMATS, UNIONS
+
+# Micro-benchmarks of the protocol codec and the OpenBadge framing paths.
+#
+#   python -m badge_benchmark                      (run everything, print a table)
+#   python -m badge_benchmark -k decode -n 20000   (only benchmarks whose name contains "decode")
+#   python -m badge_benchmark --json result.json   (also store results, to compare runs over time)
+#   python -m badge_benchmark --compare result.json (report the change against stored results)
+#   python -m badge_benchmark --import-budget 30    (fail if `import badge` takes longer than 30 ms)
+#   python -m badge_benchmark --ble-throughput      (BLE send throughput against a fake peripheral)
+#   python -m badge_benchmark --fleet 200 --latency 0.01  (start/sync/stop rounds over simulated badges)
+#   python -m badge_benchmark --fleet 200 --latency 0.01 --workers 16  (the same, 16 badges at a time)
+#   python -m badge_benchmark --fleet 200 --latency 0.01 --workers 4 --adapters 3 --connect-seconds 0.05
+#     (the same, spread over 3 simulated HCI adapters handling 4 badges each)
+#
+# For every benchmark the runner reports operations per second (best of --repeat runs)
+# and the peak number of bytes allocated while performing a single operation.
+# The import check runs `python -X importtime` in fresh interpreters, reports the best
+# cumulative import time and the slowest modules, and exits with status 1 when the
+# budget is exceeded, so it can gate CI or deployment of the hub scripts.
+
+_MESSAGES_BY_NAME = {m.name: m for m in MESSAGES}
+
+
+# BadgeConnection that keeps everything in memory: sent frames are dropped and
+# await_data() and receive_available() serve bytes from a fixed stream, restarting at its end.
+class MemoryBadgeConnection(BadgeConnection):
+    def __init__(self, rx_stream=b""):
+        BadgeConnection.__init__(self)
+        self.rx_stream = bytes(rx_stream)
+        self.rx_offset = 0
+        self.sent_bytes = 0
+
+    def connect(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def is_connected(self):
+        return True
+
+    def send(self, message, response_len=0, timeout=None, acknowledged=True):
+        self.sent_bytes += len(message)
+        if response_len > 0:
+            return self.await_data(response_len)
+        return None
+
+    def await_data(self, data_len, timeout=None):
+        if data_len == 0:
+            return None
+        if self.rx_offset + data_len > len(self.rx_stream):
+            self.rx_offset = 0
+        data = self.rx_stream[self.rx_offset : self.rx_offset + data_len]
+        self.rx_offset += data_len
+        return data
+
+    # Serves the rest of the stream as one chunk.
+    def receive_available(self, timeout=None):
+        if self.rx_offset >= len(self.rx_stream):
+            self.rx_offset = 0
+        data = self.rx_stream[self.rx_offset :]
+        self.rx_offset = len(self.rx_stream)
+        return data
+
+
+# Builds a message of the schema type `name` with every field set, optional ones included.
+def sample_message(name):
+    schema = _MESSAGES_BY_NAME[name]
+    message = getattr(badge_protocol, name)()
+    for i, field in enumerate(schema.fields, start=1):
+        if field.type in SCALAR_FORMATS:
+            value = i
+        else:
+            value = sample_message(field.type)
+        if field.optional:
+            setattr(message, "has_" + field.name, 1)
+        setattr(message, field.name, value)
+    return message
+
+
+def sample_union(union_name, option):
+    union = getattr(badge_protocol, union_name)()
+    setattr(union.type, option.name, sample_message(option.message))
+    return union
+
+
+def framed(payload):
+    return LENGTH_HEADER.pack(len(payload)) + payload
+
+
+class Benchmark(object):
+    def __init__(self, name, func):
+        self.name = name
+        self.func = func
+
+    def peak_bytes(self):
+        self.func()  # warm up caches (e.g. lazily built dtypes) before measuring
+        tracemalloc.start()
+        try:
+            tracemalloc.reset_peak()
+            base, _ = tracemalloc.get_traced_memory()
+            self.func()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return peak - base
+
+    def run(self, number, repeat):
+        best = min(timeit.repeat(self.func, number=number, repeat=repeat))
+        return {
+            "name": self.name,
+            "ops_per_sec": number / best if best > 0 else float("inf"),
+            "usec_per_op": best / number * 1e6,
+            "peak_bytes_per_op": self.peak_bytes(),
+        }
+
+
+def codec_benchmarks():
+    benchmarks = []
+    for union in UNIONS:
+        union_cls = getattr(badge_protocol, union.name)
+        for option in union.options:
+            message = sample_union(union.name, option)
+            encoded = message.encode()
+            benchmarks.append(
+                Benchmark(f"encode {union.name}.{option.name}", message.encode)
+            )
+            benchmarks.append(
+                Benchmark(
+                    f"decode {union.name}.{option.name}",
+                    lambda cls=union_cls, buf=encoded: cls.decode(buf),
+                )
+            )
+    return benchmarks
+
+
+def framing_benchmarks():
+    benchmarks = []
+
+    connection = MemoryBadgeConnection()
+    badge = OpenBadge(connection)
+    for option in UNIONS[0].options:
+        request = sample_union("Request", option)
+        benchmarks.append(
+            Benchmark(
+                f"send_request {option.name}",
+                lambda request=request: badge.send_request(request),
+            )
+        )
+    benchmarks.append(Benchmark("send_frame stop_imu", badge.stop_imu))
+    benchmarks.append(Benchmark("send_frame identify", badge.identify))
+    benchmarks.append(
+        Benchmark(
+            "render start_imu template",
+            lambda: START_IMU_REQUEST_TEMPLATE.render(1700000000, 500, 4, 1000, 50),
+        )
+    )
+
+    for option in UNIONS[1].options:
+        response_connection = MemoryBadgeConnection(
+            framed(sample_union("Response", option).encode())
+        )
+        response_badge = OpenBadge(response_connection, metrics=None)
+
+        def receive(badge=response_badge, response_tag=option.tag):
+            pending = badge.expect_response(response_tag)
+            badge.receive_response()
+            pending.result()
+
+        benchmarks.append(Benchmark(f"receive_response {option.name}", receive))
+    return benchmarks
+
+
+# Stands in for a bluepy Peripheral in BLEBadgeConnection: it accepts MTU exchanges and
+#   writes, rejecting writes longer than the ATT MTU, and advances a simulated clock.
+#   Every connection event carries up to `packets_per_event` writes; an acknowledged write
+#   (or an MTU exchange) waits for the response in the next connection event.
+class FakePeripheral(object):
+    max_mtu = 23
+    connection_interval = 0.0125
+    packets_per_event = 4
+
+    def __init__(self, address, address_type=None, iface=None):
+        self.address = address
+        self.delegate = None
+        self.mtu = 23
+        self.clock = 0.0
+        self.writes = 0
+        self.pending = 0
+        self.received = bytearray()
+
+    def setDelegate(self, delegate):
+        self.delegate = delegate
+        return self
+
+    def setMTU(self, mtu):
+        self.mtu = min(mtu, self.max_mtu)
+        self.flush()
+        self.clock += self.connection_interval
+        return {"mtu": [self.mtu]}
+
+    def writeCharacteristic(self, handle, val, withResponse=False):
+        if len(val) > self.mtu - 3:
+            raise ValueError(f"{len(val)} byte write exceeds ATT MTU {self.mtu}")
+        self.received += val
+        self.writes += 1
+        self.pending += 1
+        if withResponse:
+            self.pending = 0
+            self.clock += self.connection_interval
+        elif self.pending == self.packets_per_event:
+            self.flush()
+
+    # Sends the writes still waiting for a connection event.
+    def flush(self):
+        if self.pending:
+            self.pending = 0
+            self.clock += self.connection_interval
+
+    def waitForNotifications(self, timeout):
+        return False
+
+    def getState(self):
+        return "conn"
+
+    def disconnect(self):
+        pass
+
+
+# Sends `count` messages of `message_size` bytes through a BLEBadgeConnection connected to a
+#   FakePeripheral accepting `max_mtu`, and returns the simulated throughput in bytes per
+#   second and the number of writes per message.
+def ble_throughput(message_size, max_mtu, acknowledged, count=200):
+    from ble_badge_connection import BLEBadgeConnection
+    from gatt_handle_cache import GattHandleCache, GattHandles
+
+    peripheral_class = type("FakePeripheral", (FakePeripheral,), {"max_mtu": max_mtu})
+    connection_class = type(
+        "FakeBLEBadgeConnection", (BLEBadgeConnection,), {"peripheral_class": peripheral_class}
+    )
+    handle_cache = GattHandleCache(path=None)
+    handle_cache.put("fake", GattHandles(tx=0x10, rx=0x12, cccd=0x13))
+    connection = connection_class("fake", handle_cache=handle_cache)
+    connection.connect()
+
+    peripheral = connection.conn
+    peripheral.clock = 0.0
+    peripheral.writes = 0
+    message = bytes(message_size)
+    for _ in range(count):
+        connection.send(message, acknowledged=acknowledged)
+    peripheral.flush()
+    assert len(peripheral.received) >= count * message_size
+    return count * message_size / peripheral.clock, peripheral.writes / count
+
+
+def report_ble_throughput():
+    print(f"{'message':>8} {'MTU':>4} {'mode':<14} {'bytes/s':>10} {'writes/msg':>10}")
+    for message_size in (8, 13, 64, 244):
+        for max_mtu in (23, 247):
+            for acknowledged in (True, False):
+                throughput, writes = ble_throughput(message_size, max_mtu, acknowledged)
+                mode = "with response" if acknowledged else "no response"
+                print(f"{message_size:>8} {max_mtu:>4} {mode:<14} {throughput:>10,.0f} {writes:>10.1f}")
+
+
+# Runs the hub's start, synchronise and stop rounds over `count` simulated badges through an
+#   AdapterScheduler, `workers` badges at a time on each of `adapters` simulated adapters (or
+#   on one unlimited adapter if 0), and returns (round, wall-clock seconds, failures) rows.
+def fleet_rounds(
+    count, timeout=1.0, workers=1, adapters=0, connect_seconds=0.0, **connection_options
+):
+    from adapter_scheduler import AdapterScheduler
+    from simulated_badge_connection import SimulatedFleet
+
+    fleet = SimulatedFleet(count, seed=0, timeout=timeout, **connection_options)
+    if adapters:
+        # Controllers with limited links and serialized connection setup.
+        fleet.adapters(adapters, connect_seconds=connect_seconds)
+        scheduler = AdapterScheduler(range(adapters), workers, fleet.connect_through)
+    else:
+        scheduler = AdapterScheduler(
+            (0,), workers, lambda address, iface: fleet.connect(address), max_connections=count
+        )
+
+    def start(badge, i):
+        badge.get_status(new_id=i, new_group_number=1)
+        badge.start_all_sensors()
+
+    def start_sequential(badge, i):
+        badge.get_status(new_id=i, new_group_number=1)
+        badge.get_status()
+        badge.start_scan()
+        badge.start_microphone()
+        badge.start_imu()
+
+    def synchronise(badge, i):
+        badge.get_status()
+
+    def stop(badge, i):
+        badge.stop_scan()
+        badge.stop_microphone()
+        badge.stop_imu()
+
+    rows = []
+    rounds = (
+        ("start", start),
+        ("synchronise", synchronise),
+        ("stop", stop),
+        ("start (sequential)", start_sequential),
+        ("stop", stop),
+    )
+    for name, command in rounds:
+
+        def operation(i, address, manager, command=command):
+            connection = manager.acquire(address)
+            try:
+                command(OpenBadge(connection, timeout=timeout), i)
+                manager.release(address, connection)
+            except Exception:
+                manager.discard(address, connection)
+                raise
+
+        report = scheduler.run(enumerate(fleet.addresses()), operation, timeout=None)
+        rows.append((name, report.seconds, len(report.failed)))
+    scheduler.close_all()
+    return rows
+
+
+def report_fleet_rounds(count, **connection_options):
+    print(f"{'round':<20} {'seconds':>8} {'ms/badge':>9} {'failures':>8}  ({count} badges)")
+    for name, seconds, failures in fleet_rounds(count, **connection_options):
+        print(f"{name:<20} {seconds:>8.3f} {seconds / count * 1000:>9.2f} {failures:>8}")
+
+
+# Returns the best cumulative import time of `module` in microseconds over `runs` fresh
+# interpreters, together with the (self time, module) entries of that run.
+def measure_import_time(module, runs):
+    best = None
+    for _ in range(runs):
+        completed = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        entries = []
+        total = None
+        for line in completed.stderr.splitlines():
+            if not line.startswith("import time:") or "self [us]" in line:
+                continue
+            self_us, cumulative_us, name = line[len("import time:") :].split("|")
+            entries.append((int(self_us), name.strip()))
+            if not name.startswith("  "):
+                # Top-level entry: it closes the list of modules it imported.
+                if name.rstrip() == " " + module:
+                    total = int(cumulative_us)
+                    break
+                entries = []
+        if total is None:
+            raise RuntimeError(f"{module} was not imported")
+        if best is None or total < best[0]:
+            best = (total, entries)
+    return best
+
+
+def check_import_budget(module, budget_ms, runs):
+    total_us, entries = measure_import_time(module, runs)
+    print(f"import {module}: {total_us / 1000:.1f} ms (budget {budget_ms:.1f} ms, best of {runs})")
+    for self_us, name in sorted(entries, reverse=True)[:10]:
+        print(f"  {self_us / 1000:>6.2f} ms  {name}")
+    return total_us <= budget_ms * 1000
+
+
+def all_benchmarks():
+    return codec_benchmarks() + framing_benchmarks()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the badge protocol codec.")
+    parser.add_argument("-n", "--number", type=int, default=10000, help="operations per timing run")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="timing runs, the best is reported")
+    parser.add_argument("-k", "--filter", default="", help="only run benchmarks whose name contains this")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="results file (from --json) to compare against")
+    parser.add_argument(
+        "--import-budget", type=float, metavar="MS", help="only check the import time against this budget"
+    )
+    parser.add_argument("--import-module", default="badge", help="module checked by --import-budget")
+    parser.add_argument(
+        "--ble-throughput", action="store_true", help="only report BLE send throughput (needs bluepy)"
+    )
+    parser.add_argument("--fleet", type=int, metavar="N", help="only run hub rounds over N simulated badges")
+    parser.add_argument("--latency", type=float, default=0.0, help="--fleet one-way latency in seconds")
+    parser.add_argument("--loss", type=float, default=0.0, help="--fleet probability a frame is lost")
+    parser.add_argument("--timeout", type=float, default=1.0, help="--fleet response timeout in seconds")
+    parser.add_argument("--workers", type=int, default=1, help="--fleet badges handled at the same time")
+    parser.add_argument(
+        "--adapters", type=int, default=0, help="--fleet simulated HCI adapters (0: no link limits)"
+    )
+    parser.add_argument(
+        "--connect-seconds", type=float, default=0.0, help="--adapters connection setup time"
+    )
+    args = parser.parse_args(argv)
+
+    if args.fleet:
+        report_fleet_rounds(
+            args.fleet,
+            latency=args.latency,
+            loss=args.loss,
+            timeout=args.timeout,
+            workers=args.workers,
+            adapters=args.adapters,
+            connect_seconds=args.connect_seconds,
+        )
+        return
+
+    if args.ble_throughput:
+        report_ble_throughput()
+        return
+
+    if args.import_budget is not None:
+        within_budget = check_import_budget(args.import_module, args.import_budget, args.repeat)
+        sys.exit(0 if within_budget else 1)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {r["name"]: r for r in json.load(f)["results"]}
+
+    results = []
+    for benchmark in all_benchmarks():
+        if args.filter not in benchmark.name:
+            continue
+        result = benchmark.run(args.number, args.repeat)
+        results.append(result)
+        line = (
+            f"{result['name']:<50} {result['ops_per_sec']:>12,.0f} ops/s "
+            f"{result['usec_per_op']:>8.2f} us/op {result['peak_bytes_per_op']:>7} B/op"
+        )
+        if result["name"] in baseline:
+            before = baseline[result["name"]]
+            change = result["ops_per_sec"] / before["ops_per_sec"] - 1.0
+            line += f" {change:>+8.1%} ops/s vs baseline"
+        print(line)
+        sys.stdout.flush()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(
+                {
+                    "timestamp": time.time(),
+                    "python": platform.python_version(),
+                    "number": args.number,
+                    "repeat": args.repeat,
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
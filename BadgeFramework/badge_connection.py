@@ -15,6 +15,17 @@ from __future__ import division, absolute_import, print_function
 #    a physical badge.
 
 
+# Raised by send() and await_data() when the badge does not deliver the expected bytes
+#   before the deadline of the operation.
+class BadgeTimeoutError(TimeoutError):
+    pass
+
+
+# Raised by send() and await_data() when the link to the badge was lost.
+class BadgeDisconnectedError(ConnectionError):
+    pass
+
+
 class BadgeConnection(object):
     def __init__(self):
         pass
@@ -35,18 +46,56 @@ class BadgeConnection(object):
 
     # Send the `message` byte string to the badge over this BadgeConnection.
     # Await a response of length response_len.
-    #   Blocks until response recieved.
+    #   Blocks until response recieved, for at most `timeout` seconds (None uses the
+    #   connection's default) and throws a BadgeTimeoutError after that.
     #   Returns None immediately after sending if response_len == 0
+    # With acknowledged=False the message may be sent without waiting for the badge to
+    #   confirm each write (e.g. BLE write without response), for requests without a reply.
     # This method should throw a RuntimeError if this BadgeConnection is not currently
     # connected.
-    def send(self, message, response_len=0):
+    def send(self, message, response_len=0, timeout=None, acknowledged=True):
         raise NotImplementedError
 
     # Await data_len bytes to be recieved from the badge over this connection
     #  and return them after they have been recieved.
     # Returns None immediately if data_len == 0.
-    # This method blocks until data_len bytes have been recieved.
+    # This method blocks until data_len bytes have been recieved, for at most `timeout`
+    #  seconds (None uses the connection's default), and throws a BadgeTimeoutError after that.
     # This method should throw a RuntimeError if this BadgeConnection is not currently
     # connected.
-    def await_data(self, data_len):
+    def await_data(self, data_len, timeout=None):
+        raise NotImplementedError
+
+    # Await data from the badge and return all the bytes received so far, at least one,
+    #  e.g. the payload of one or more BLE notifications. Blocks for at most `timeout`
+    #  seconds (None uses the connection's default), and throws a BadgeTimeoutError after that.
+    # The default reads a single byte with await_data(); connections receiving data in
+    #  chunks should override it, so that a chunk is handed over at once.
+    def receive_available(self, timeout=None):
+        return self.await_data(1, timeout)
+
+
+# AsyncBadgeConnection is the asyncio counterpart of BadgeConnection, used by AsyncOpenBadge.
+#    The methods follow the BadgeConnection specs above, but the ones communicating with the
+#    badge are coroutines, so one event loop can talk to many badges at the same time.
+class AsyncBadgeConnection(object):
+    def __init__(self):
+        pass
+
+    async def connect(self):
         raise NotImplementedError
+
+    async def disconnect(self):
+        raise NotImplementedError
+
+    def is_connected(self):
+        raise NotImplementedError
+
+    async def send(self, message, response_len=0, timeout=None, acknowledged=True):
+        raise NotImplementedError
+
+    async def await_data(self, data_len, timeout=None):
+        raise NotImplementedError
+
+    async def receive_available(self, timeout=None):
+        return await self.await_data(1, timeout)
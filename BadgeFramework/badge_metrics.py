@@ -0,0 +1,165 @@
+from __future__ import annotations
+import bisect
+import os
+import threading
+import time
+from typing import Optional
+
+# Upper bounds, in seconds, of the latency histogram buckets (Prometheus' defaults).
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PROMETHEUS_METRIC = "badge_phase_duration_seconds"
+
+
+class Histogram(object):
+    __slots__ = ("bounds", "counts", "count", "sum", "min", "max")
+
+    def __init__(self, bounds=DEFAULT_BUCKETS):
+        self.bounds = bounds
+        # counts[i] observations fell in (bounds[i - 1], bounds[i]]; the last one is +Inf.
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    # Cumulative (upper bound, count) pairs, ending with +Inf.
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            total += count
+            yield bound, total
+
+    # Upper bound of the bucket holding quantile q, capped by the largest observation.
+    def quantile(self, q: float) -> float:
+        rank = q * self.count
+        for bound, total in self.cumulative():
+            if total >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+# LatencyRecorder collects the durations of the phases of badge operations (connect,
+#   discovery, cccd, mtu, write, wait, ...) in one Histogram per (phase, MAC address,
+#   command) and exports them as JSON or as a Prometheus text file. Thread safe.
+class LatencyRecorder(object):
+    def __init__(self, bounds=DEFAULT_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def record(self, phase: str, seconds: float, address: Optional[str] = None, command: Optional[str] = None):
+        key = (phase, address or "", command or "")
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.bounds)
+            histogram.observe(seconds)
+
+    # Context manager recording the duration of its block, also when it raises.
+    def time(self, phase: str, address: Optional[str] = None, command: Optional[str] = None):
+        return _Timer(self, phase, address, command)
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+
+    def to_dict(self):
+        with self.lock:
+            items = sorted(self.histograms.items())
+            return {
+                "timestamp": time.time(),
+                "histograms": [
+                    {
+                        "phase": phase,
+                        "address": address,
+                        "command": command,
+                        "count": h.count,
+                        "sum": h.sum,
+                        "min": h.min,
+                        "max": h.max,
+                        "mean": h.sum / h.count,
+                        "p50": h.quantile(0.5),
+                        "p90": h.quantile(0.9),
+                        "p99": h.quantile(0.99),
+                        "buckets": [[bound, count] for bound, count in h.cumulative()][:-1],
+                    }
+                    for (phase, address, command), h in items
+                ],
+            }
+
+    def to_json(self) -> str:
+        import json  # only needed for exports, kept off the import path of badge
+
+        return json.dumps(self.to_dict(), indent=1)
+
+    def to_prometheus(self) -> str:
+        lines = [
+            "# HELP {} Duration of badge operation phases.".format(PROMETHEUS_METRIC),
+            "# TYPE {} histogram".format(PROMETHEUS_METRIC),
+        ]
+        with self.lock:
+            items = sorted(self.histograms.items())
+            for (phase, address, command), h in items:
+                labels = 'phase="{}",address="{}",command="{}"'.format(phase, address, command)
+                for bound, total in h.cumulative():
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append('{}_bucket{{{},le="{}"}} {}'.format(PROMETHEUS_METRIC, labels, le, total))
+                lines.append("{}_sum{{{}}} {!r}".format(PROMETHEUS_METRIC, labels, h.sum))
+                lines.append("{}_count{{{}}} {}".format(PROMETHEUS_METRIC, labels, h.count))
+        return "\n".join(lines) + "\n"
+
+    def write_json(self, path: str):
+        write_atomically(path, self.to_json())
+
+    def write_prometheus(self, path: str):
+        write_atomically(path, self.to_prometheus())
+
+
+class _Timer(object):
+    __slots__ = ("recorder", "phase", "address", "command", "start")
+
+    def __init__(self, recorder, phase, address, command):
+        self.recorder = recorder
+        self.phase = phase
+        self.address = address
+        self.command = command
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.recorder.record(
+            self.phase, time.perf_counter() - self.start, self.address, self.command
+        )
+        return False
+
+
+# Writes `text` to `path` through a temporary file in the same directory, so readers never
+#   see a partial file; the temporary file is removed if writing it fails.
+def write_atomically(path, text):
+    import tempfile
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+# Recorder shared by the BLE connections and the badges unless they are given their own.
+default_recorder = LatencyRecorder()
@@ -1,3 +1,5 @@
+# Generated by generate_badge_protocol.py from badge_protocol_schema.py.
+# Do not edit by hand: change the schema and regenerate.
 import struct
 
 Request_status_request_tag = 1
@@ -17,44 +19,125 @@ Response_start_scan_response_tag = 3
 Response_start_imu_response_tag = 4
 Response_free_sdc_space_response_tag = 5
 
+_which_struct = struct.Struct('<B')
+
 class _Ostream:
-	def __init__(self):
-		self.buf = b''
+	__slots__ = ('buf', 'offset')
+	def __init__(self, buf, offset=0):
+		self.buf = buf
+		self.offset = offset
 	def write(self, data):
-		self.buf += data
+		end = self.offset + len(data)
+		if(end > len(self.buf)):
+			raise Exception("Not enough space in Ostream to write")
+		self.buf[self.offset:end] = data
+		self.offset = end
+	def pack(self, s, *values):
+		end = self.offset + s.size
+		if(end > len(self.buf)):
+			raise Exception("Not enough space in Ostream to write")
+		s.pack_into(self.buf, self.offset, *values)
+		self.offset = end
 
 class _Istream:
-	def __init__(self, buf):
-		self.buf = buf
+	__slots__ = ('buf', 'offset')
+	def __init__(self, buf, offset=0):
+		self.buf = memoryview(buf)
+		self.offset = offset
 	def read(self, l):
-		if(l > len(self.buf)):
+		end = self.offset + l
+		if(end > len(self.buf)):
 			raise Exception("Not enough bytes in Istream to read")
-		ret = self.buf[0:l]
-		self.buf = self.buf[l:]
+		ret = self.buf[self.offset:end]
+		self.offset = end
 		return ret
+	def unpack(self, s):
+		end = self.offset + s.size
+		if(end > len(self.buf)):
+			raise Exception("Not enough bytes in Istream to read")
+		ret = s.unpack_from(self.buf, self.offset)
+		self.offset = end
+		return ret
+
+def _union_option(tag):
+	def fget(self):
+		return self._value if self.which == tag else None
+	def fset(self, value):
+		self.which = tag
+		self._value = value
+	return property(fget, fset)
+
+class _Message:
+	__slots__ = ()
 
-class Timestamp:
+	# numpy.dtype spec of fixed-layout messages, materialised by numpy_dtype().
+	_dtype_spec = None
+	_dtype = None
 
 	def __init__(self):
 		self.reset()
 
 	def __repr__(self):
-		return str(self.__dict__)
+		return str({name: getattr(self, name) for name in self.__slots__})
+
+	def encode(self):
+		buf = bytearray(self.length())
+		self.encode_into(buf)
+		return bytes(buf)
+
+	def encode_into(self, buf, offset=0):
+		ostream = _Ostream(buf, offset)
+		self.encode_internal(ostream)
+		return ostream.offset
+
+	@classmethod
+	def decode(cls, buf):
+		obj = cls()
+		obj.decode_internal(_Istream(buf))
+		return obj
+
+	@classmethod
+	def decode_from(cls, buf, offset=0):
+		obj = cls()
+		obj.decode_internal(_Istream(buf, offset))
+		return obj
+
+	# Structured NumPy dtype matching the wire layout of a fixed-layout message.
+	@classmethod
+	def numpy_dtype(cls):
+		if cls._dtype is None:
+			if cls._dtype_spec is None:
+				raise TypeError(cls.__name__ + " has no fixed layout")
+			import numpy
+			cls._dtype = numpy.dtype(cls._dtype_spec)
+		return cls._dtype
+
+	# Decodes `count` consecutive records (all complete records if -1) starting at `offset`
+	# into a structured array in a single numpy.frombuffer call, without copying `buf`.
+	# Fields are available as columns, e.g. decode_array(buf)['rssi'].
+	@classmethod
+	def decode_array(cls, buf, offset=0, count=-1):
+		import numpy
+		dtype = cls.numpy_dtype()
+		if count == -1:
+			count = (len(memoryview(buf).cast('B')) - offset) // dtype.itemsize
+		return numpy.frombuffer(buf, dtype=dtype, count=count, offset=offset)
+
+class Timestamp(_Message):
+
+	__slots__ = ('seconds', 'ms')
+	_struct = struct.Struct('<IH')
+	_dtype_spec = {'names': ['seconds', 'ms'], 'formats': ['<I', '<H'], 'itemsize': 6}
 
 	def reset(self):
 		self.seconds = 0
 		self.ms = 0
-		pass
 
-	def encode(self):
-		ostream = _Ostream()
-		self.encode_internal(ostream)
-		return ostream.buf
+	def length(self):
+		return self._struct.size
 
 	def encode_internal(self, ostream):
-		self.encode_seconds(ostream)
-		self.encode_ms(ostream)
-		pass
+		ostream.pack(self._struct, self.seconds, self.ms)
 
 	def encode_seconds(self, ostream):
 		ostream.write(struct.pack('<I', self.seconds))
@@ -62,48 +145,38 @@ class Timestamp:
 	def encode_ms(self, ostream):
 		ostream.write(struct.pack('<H', self.ms))
 
-
-	@classmethod
-	def decode(cls, buf):
-		obj = cls()
-		obj.decode_internal(_Istream(buf))
-		return obj
-
 	def decode_internal(self, istream):
-		self.reset()
-		self.decode_seconds(istream)
-		self.decode_ms(istream)
-		pass
+		self.seconds, self.ms = istream.unpack(self._struct)
 
 	def decode_seconds(self, istream):
-		self.seconds= struct.unpack('<I', istream.read(4))[0]
+		self.seconds = struct.unpack('<I', istream.read(4))[0]
 
 	def decode_ms(self, istream):
-		self.ms= struct.unpack('<H', istream.read(2))[0]
+		self.ms = struct.unpack('<H', istream.read(2))[0]
 
+	@classmethod
+	def _from_fields(cls, seconds, ms):
+		obj = cls.__new__(cls)
+		obj.seconds = seconds
+		obj.ms = ms
+		return obj
 
-class BadgeAssignement:
 
-	def __init__(self):
-		self.reset()
+class BadgeAssignement(_Message):
 
-	def __repr__(self):
-		return str(self.__dict__)
+	__slots__ = ('ID', 'group')
+	_struct = struct.Struct('<HB')
+	_dtype_spec = {'names': ['ID', 'group'], 'formats': ['<H', '<B'], 'itemsize': 3}
 
 	def reset(self):
 		self.ID = 0
 		self.group = 0
-		pass
 
-	def encode(self):
-		ostream = _Ostream()
-		self.encode_internal(ostream)
-		return ostream.buf
+	def length(self):
+		return self._struct.size
 
 	def encode_internal(self, ostream):
-		self.encode_ID(ostream)
-		self.encode_group(ostream)
-		pass
+		ostream.pack(self._struct, self.ID, self.group)
 
 	def encode_ID(self, ostream):
 		ostream.write(struct.pack('<H', self.ID))
@@ -111,48 +184,38 @@ class BadgeAssignement:
 	def encode_group(self, ostream):
 		ostream.write(struct.pack('<B', self.group))
 
-
-	@classmethod
-	def decode(cls, buf):
-		obj = cls()
-		obj.decode_internal(_Istream(buf))
-		return obj
-
 	def decode_internal(self, istream):
-		self.reset()
-		self.decode_ID(istream)
-		self.decode_group(istream)
-		pass
+		self.ID, self.group = istream.unpack(self._struct)
 
 	def decode_ID(self, istream):
-		self.ID= struct.unpack('<H', istream.read(2))[0]
+		self.ID = struct.unpack('<H', istream.read(2))[0]
 
 	def decode_group(self, istream):
-		self.group= struct.unpack('<B', istream.read(1))[0]
+		self.group = struct.unpack('<B', istream.read(1))[0]
 
+	@classmethod
+	def _from_fields(cls, ID, group):
+		obj = cls.__new__(cls)
+		obj.ID = ID
+		obj.group = group
+		return obj
 
-class ScanDevice:
 
-	def __init__(self):
-		self.reset()
+class ScanDevice(_Message):
 
-	def __repr__(self):
-		return str(self.__dict__)
+	__slots__ = ('ID', 'rssi')
+	_struct = struct.Struct('<Hb')
+	_dtype_spec = {'names': ['ID', 'rssi'], 'formats': ['<H', '<b'], 'itemsize': 3}
 
 	def reset(self):
 		self.ID = 0
 		self.rssi = 0
-		pass
 
-	def encode(self):
-		ostream = _Ostream()
-		self.encode_internal(ostream)
-		return ostream.buf
+	def length(self):
+		return self._struct.size
 
 	def encode_internal(self, ostream):
-		self.encode_ID(ostream)
-		self.encode_rssi(ostream)
-		pass
+		ostream.pack(self._struct, self.ID, self.rssi)
 
 	def encode_ID(self, ostream):
 		ostream.write(struct.pack('<H', self.ID))
@@ -160,50 +223,40 @@ class ScanDevice:
 	def encode_rssi(self, ostream):
 		ostream.write(struct.pack('<b', self.rssi))
 
-
-	@classmethod
-	def decode(cls, buf):
-		obj = cls()
-		obj.decode_internal(_Istream(buf))
-		return obj
-
 	def decode_internal(self, istream):
-		self.reset()
-		self.decode_ID(istream)
-		self.decode_rssi(istream)
-		pass
+		self.ID, self.rssi = istream.unpack(self._struct)
 
 	def decode_ID(self, istream):
-		self.ID= struct.unpack('<H', istream.read(2))[0]
+		self.ID = struct.unpack('<H', istream.read(2))[0]
 
 	def decode_rssi(self, istream):
-		self.rssi= struct.unpack('<b', istream.read(1))[0]
-
+		self.rssi = struct.unpack('<b', istream.read(1))[0]
 
+	@classmethod
+	def _from_fields(cls, ID, rssi):
+		obj = cls.__new__(cls)
+		obj.ID = ID
+		obj.rssi = rssi
+		return obj
 
-class StatusRequest:
 
-	def __init__(self):
-		self.reset()
+class StatusRequest(_Message):
 
-	def __repr__(self):
-		return str(self.__dict__)
+	__slots__ = ('timestamp', 'has_badge_assignement', 'badge_assignement')
+	_struct = struct.Struct('<IHB')
 
 	def reset(self):
 		self.timestamp = None
 		self.has_badge_assignement = 0
 		self.badge_assignement = None
-		pass
 
-	def encode(self):
-		ostream = _Ostream()
-		self.encode_internal(ostream)
-		return ostream.buf
+	def length(self):
+		return self._struct.size + (self.badge_assignement.length() if self.has_badge_assignement else 0)
 
 	def encode_internal(self, ostream):
-		self.encode_timestamp(ostream)
-		self.encode_badge_assignement(ostream)
-		pass
+		ostream.pack(self._struct, self.timestamp.seconds, self.timestamp.ms, self.has_badge_assignement)
+		if self.has_badge_assignement:
+			self.badge_assignement.encode_internal(ostream)
 
 	def encode_timestamp(self, ostream):
 		self.timestamp.encode_internal(ostream)
@@ -213,52 +266,42 @@ class StatusRequest:
 		if self.has_badge_assignement:
 			self.badge_assignement.encode_internal(ostream)
 
-
-	@classmethod
-	def decode(cls, buf):
-		obj = cls()
-		obj.decode_internal(_Istream(buf))
-		return obj
-
 	def decode_internal(self, istream):
-		self.reset()
-		self.decode_timestamp(istream)
-		self.decode_badge_assignement(istream)
-		pass
+		timestamp_seconds, timestamp_ms, self.has_badge_assignement = istream.unpack(self._struct)
+		self.timestamp = Timestamp._from_fields(timestamp_seconds, timestamp_ms)
+		if self.has_badge_assignement:
+			self.badge_assignement = BadgeAssignement()
+			self.badge_assignement.decode_internal(istream)
+		else:
+			self.badge_assignement = None
 
 	def decode_timestamp(self, istream):
 		self.timestamp = Timestamp()
 		self.timestamp.decode_internal(istream)
 
 	def decode_badge_assignement(self, istream):
-		self.has_badge_assignement= struct.unpack('<B', istream.read(1))[0]
+		self.has_badge_assignement = struct.unpack('<B', istream.read(1))[0]
+		self.badge_assignement = None
 		if self.has_badge_assignement:
 			self.badge_assignement = BadgeAssignement()
 			self.badge_assignement.decode_internal(istream)
 
 
-class StartMicrophoneRequest:
-
-	def __init__(self):
-		self.reset()
+class StartMicrophoneRequest(_Message):
 
-	def __repr__(self):
-		return str(self.__dict__)
+	__slots__ = ('timestamp', 'mode')
+	_struct = struct.Struct('<IHB')
+	_dtype_spec = {'names': ['timestamp', 'mode'], 'formats': [[('seconds', '<I'), ('ms', '<H')], '<B'], 'itemsize': 7}
 
 	def reset(self):
 		self.timestamp = None
 		self.mode = 0
-		pass
 
-	def encode(self):
-		ostream = _Ostream()
-		self.encode_internal(ostream)
-		return ostream.buf
+	def length(self):
+		return self._struct.size
 
 	def encode_internal(self, ostream):
-		self.encode_timestamp(ostream)
-		self.encode_mode(ostream)
-		pass
+		ostream.pack(self._struct, self.timestamp.seconds, self.timestamp.ms, self.mode)
 
 	def encode_timestamp(self, ostream):
 		self.timestamp.encode_internal(ostream)
@@ -266,80 +309,58 @@ class StartMicrophoneRequest:
 	def encode_mode(self, ostream):
 		ostream.write(struct.pack('<B', self.mode))
 
-	@classmethod
-	def decode(cls, buf):
-		obj = cls()
-		obj.decode_internal(_Istream(buf))
-		return obj
-
 	def decode_internal(self, istream):
-		self.reset()
-		self.decode_timestamp(istream)
-		self.decode_mode(istream)
-		pass
+		timestamp_seconds, timestamp_ms, self.mode = istream.unpack(self._struct)
+		self.timestamp = Timestamp._from_fields(timestamp_seconds, timestamp_ms)
 
 	def decode_timestamp(self, istream):
 		self.timestamp = Timestamp()
 		self.timestamp.decode_internal(istream)
 
 	def decode_mode(self, istream):
-		self.mode= struct.unpack('<B', istream.read(1))[0]
+		self.mode = struct.unpack('<B', istream.read(1))[0]
 
-class StopMicrophoneRequest:
+	@classmethod
+	def _from_fields(cls, timestamp, mode):
+		obj = cls.__new__(cls)
+		obj.timestamp = timestamp
+		obj.mode = mode
+		return obj
 
-	def __init__(self):
-		self.reset()
 
-	def __repr__(self):
-		return str(self.__dict__)
+class StopMicrophoneRequest(_Message):
+
+	__slots__ = ()
 
 	def reset(self):
 		pass
 
-	def encode(self):
-		ostream = _Ostream()
-		self.encode_internal(ostream)
-		return ostream.buf
+	def length(self):
+		return 0
 
 	def encode_internal(self, ostream):
 		pass
 
-
-	@classmethod
-	def decode(cls, buf):
-		obj = cls()
-		obj.decode_internal(_Istream(buf))
-		return obj
-
 	def decode_internal(self, istream):
-		self.reset()
 		pass
 
 
-class StartScanRequest:
-
-	def __init__(self):
-		self.reset()
+class StartScanRequest(_Message):
 
-	def __repr__(self):
-		return str(self.__dict__)
+	__slots__ = ('timestamp', 'window', 'interval')
+	_struct = struct.Struct('<IHHH')
+	_dtype_spec = {'names': ['timestamp', 'window', 'interval'], 'formats': [[('seconds', '<I'), ('ms', '<H')], '<H', '<H'], 'itemsize': 10}
 
 	def reset(self):
 		self.timestamp = None
 		self.window = 0
 		self.interval = 0
-		pass
 
-	def encode(self):
-		ostream = _Ostream()
-		self.encode_internal(ostream)
-		return ostream.buf
+	def length(self):
+		return self._struct.size
 
 	def encode_internal(self, ostream):
-		self.encode_timestamp(ostream)
-		self.encode_window(ostream)
-		self.encode_interval(ostream)
-		pass
+		ostream.pack(self._struct, self.timestamp.seconds, self.timestamp.ms, self.window, self.interval)
 
 	def encode_timestamp(self, ostream):
 		self.timestamp.encode_internal(ostream)
@@ -350,88 +371,63 @@ class StartScanRequest:
 	def encode_interval(self, ostream):
 		ostream.write(struct.pack('<H', self.interval))
 
-	@classmethod
-	def decode(cls, buf):
-		obj = cls()
-		obj.decode_internal(_Istream(buf))
-		return obj
-
 	def decode_internal(self, istream):
-		self.reset()
-		self.decode_timestamp(istream)
-		self.decode_window(istream)
-		self.decode_interval(istream)
-		pass
+		timestamp_seconds, timestamp_ms, self.window, self.interval = istream.unpack(self._struct)
+		self.timestamp = Timestamp._from_fields(timestamp_seconds, timestamp_ms)
 
 	def decode_timestamp(self, istream):
 		self.timestamp = Timestamp()
 		self.timestamp.decode_internal(istream)
 
 	def decode_window(self, istream):
-		self.window= struct.unpack('<H', istream.read(2))[0]
+		self.window = struct.unpack('<H', istream.read(2))[0]
 
 	def decode_interval(self, istream):
-		self.interval= struct.unpack('<H', istream.read(2))[0]
-
+		self.interval = struct.unpack('<H', istream.read(2))[0]
 
+	@classmethod
+	def _from_fields(cls, timestamp, window, interval):
+		obj = cls.__new__(cls)
+		obj.timestamp = timestamp
+		obj.window = window
+		obj.interval = interval
+		return obj
 
-class StopScanRequest:
 
-	def __init__(self):
-		self.reset()
+class StopScanRequest(_Message):
 
-	def __repr__(self):
-		return str(self.__dict__)
+	__slots__ = ()
 
 	def reset(self):
 		pass
 
-	def encode(self):
-		ostream = _Ostream()
-		self.encode_internal(ostream)
-		return ostream.buf
+	def length(self):
+		return 0
 
 	def encode_internal(self, ostream):
 		pass
 
-
-	@classmethod
-	def decode(cls, buf):
-		obj = cls()
-		obj.decode_internal(_Istream(buf))
-		return obj
-
 	def decode_internal(self, istream):
-		self.reset()
 		pass
 
 
-class StartImuRequest:
-
-	def __init__(self):
-		self.reset()
+class StartImuRequest(_Message):
 
-	def __repr__(self):
-		return str(self.__dict__)
+	__slots__ = ('timestamp', 'acc_fsr', 'gyr_fsr', 'datarate')
+	_struct = struct.Struct('<IHHHH')
+	_dtype_spec = {'names': ['timestamp', 'acc_fsr', 'gyr_fsr', 'datarate'], 'formats': [[('seconds', '<I'), ('ms', '<H')], '<H', '<H', '<H'], 'itemsize': 12}
 
 	def reset(self):
 		self.timestamp = None
 		self.acc_fsr = 0
 		self.gyr_fsr = 0
 		self.datarate = 0
-		pass
 
-	def encode(self):
-		ostream = _Ostream()
-		self.encode_internal(ostream)
-		return ostream.buf
+	def length(self):
+		return self._struct.size
 
 	def encode_internal(self, ostream):
-		self.encode_timestamp(ostream)
-		self.encode_acc_fsr(ostream)
-		self.encode_gyr_fsr(ostream)
-		self.encode_datarate(ostream)
-		pass
+		ostream.pack(self._struct, self.timestamp.seconds, self.timestamp.ms, self.acc_fsr, self.gyr_fsr, self.datarate)
 
 	def encode_timestamp(self, ostream):
 		self.timestamp.encode_internal(ostream)
@@ -445,20 +441,9 @@ class StartImuRequest:
 	def encode_datarate(self, ostream):
 		ostream.write(struct.pack('<H', self.datarate))
 
-
-	@classmethod
-	def decode(cls, buf):
-		obj = cls()
-		obj.decode_internal(_Istream(buf))
-		return obj
-
 	def decode_internal(self, istream):
-		self.reset()
-		self.decode_timestamp(istream)
-		self.decode_acc_fsr(istream)
-		self.decode_gyr_fsr(istream)
-		self.decode_datarate(istream)
-		pass
+		timestamp_seconds, timestamp_ms, self.acc_fsr, self.gyr_fsr, self.datarate = istream.unpack(self._struct)
+		self.timestamp = Timestamp._from_fields(timestamp_seconds, timestamp_ms)
 
 	def decode_timestamp(self, istream):
 		self.timestamp = Timestamp()
@@ -471,313 +456,105 @@ class StartImuRequest:
 		self.gyr_fsr = struct.unpack('<H', istream.read(2))[0]
 
 	def decode_datarate(self, istream):
-		self.datarate= struct.unpack('<H', istream.read(2))[0]
+		self.datarate = struct.unpack('<H', istream.read(2))[0]
 
+	@classmethod
+	def _from_fields(cls, timestamp, acc_fsr, gyr_fsr, datarate):
+		obj = cls.__new__(cls)
+		obj.timestamp = timestamp
+		obj.acc_fsr = acc_fsr
+		obj.gyr_fsr = gyr_fsr
+		obj.datarate = datarate
+		return obj
 
-class StopImuRequest:
 
-	def __init__(self):
-		self.reset()
+class StopImuRequest(_Message):
 
-	def __repr__(self):
-		return str(self.__dict__)
+	__slots__ = ()
 
 	def reset(self):
 		pass
 
-	def encode(self):
-		ostream = _Ostream()
-		self.encode_internal(ostream)
-		return ostream.buf
+	def length(self):
+		return 0
 
 	def encode_internal(self, ostream):
 		pass
 
-
-	@classmethod
-	def decode(cls, buf):
-		obj = cls()
-		obj.decode_internal(_Istream(buf))
-		return obj
-
 	def decode_internal(self, istream):
-		self.reset()
 		pass
 
 
+class IdentifyRequest(_Message):
 
-class IdentifyRequest:
-
-	def __init__(self):
-		self.reset()
-
-	def __repr__(self):
-		return str(self.__dict__)
+	__slots__ = ('timeout',)
+	_struct = struct.Struct('<H')
+	_dtype_spec = {'names': ['timeout'], 'formats': ['<H'], 'itemsize': 2}
 
 	def reset(self):
 		self.timeout = 0
-		pass
 
-	def encode(self):
-		ostream = _Ostream()
-		self.encode_internal(ostream)
-		return ostream.buf
+	def length(self):
+		return self._struct.size
 
 	def encode_internal(self, ostream):
-		self.encode_timeout(ostream)
-		pass
+		ostream.pack(self._struct, self.timeout)
 
 	def encode_timeout(self, ostream):
 		ostream.write(struct.pack('<H', self.timeout))
 
-
-	@classmethod
-	def decode(cls, buf):
-		obj = cls()
-		obj.decode_internal(_Istream(buf))
-		return obj
-
 	def decode_internal(self, istream):
-		self.reset()
-		self.decode_timeout(istream)
-		pass
+		self.timeout, = istream.unpack(self._struct)
 
 	def decode_timeout(self, istream):
-		self.timeout= struct.unpack('<H', istream.read(2))[0]
-
+		self.timeout = struct.unpack('<H', istream.read(2))[0]
 
+	@classmethod
+	def _from_fields(cls, timeout):
+		obj = cls.__new__(cls)
+		obj.timeout = timeout
+		return obj
 
-class RestartRequest:
 
-	def __init__(self):
-		self.reset()
+class RestartRequest(_Message):
 
-	def __repr__(self):
-		return str(self.__dict__)
+	__slots__ = ()
 
 	def reset(self):
 		pass
 
-	def encode(self):
-		ostream = _Ostream()
-		self.encode_internal(ostream)
-		return ostream.buf
+	def length(self):
+		return 0
 
 	def encode_internal(self, ostream):
 		pass
 
-
-	@classmethod
-	def decode(cls, buf):
-		obj = cls()
-		obj.decode_internal(_Istream(buf))
-		return obj
-
 	def decode_internal(self, istream):
-		self.reset()
 		pass
 
 
-class FreeSDCSpaceRequest:
-
-	def __init__(self):
-		self.reset()
+class FreeSDCSpaceRequest(_Message):
 
-	def __repr__(self):
-		return str(self.__dict__)
+	__slots__ = ()
 
 	def reset(self):
 		pass
 
-	def encode(self):
-		ostream = _Ostream()
-		self.encode_internal(ostream)
-		return ostream.buf
+	def length(self):
+		return 0
 
 	def encode_internal(self, ostream):
 		pass
 
-
-	@classmethod
-	def decode(cls, buf):
-		obj = cls()
-		obj.decode_internal(_Istream(buf))
-		return obj
-
 	def decode_internal(self, istream):
-		self.reset()
 		pass
 
 
-class Request:
-
-	def __init__(self):
-		self.reset()
+class StatusResponse(_Message):
 
-	def __repr__(self):
-		return str(self.__dict__)
-
-	def reset(self):
-		self.type = self._type()
-		pass
-
-	def encode(self):
-		ostream = _Ostream()
-		self.encode_internal(ostream)
-		return ostream.buf
-
-	def encode_internal(self, ostream):
-		self.type.encode_internal(ostream)
-		pass
-
-
-	@classmethod
-	def decode(cls, buf):
-		obj = cls()
-		obj.decode_internal(_Istream(buf))
-		return obj
-
-	def decode_internal(self, istream):
-		self.reset()
-		self.type.decode_internal(istream)
-		pass
-
-	class _type:
-
-		def __init__(self):
-			self.reset()
-
-		def __repr__(self):
-			return str(self.__dict__)
-
-		def reset(self):
-			self.which = 0
-			self.status_request = None
-			self.start_microphone_request = None
-			self.stop_microphone_request = None
-			self.start_scan_request = None
-			self.stop_scan_request = None
-			self.start_imu_request = None
-			self.stop_imu_request = None
-			self.identify_request = None
-			self.restart_request = None
-			self.free_sdc_space_request = None
-			pass
-
-		def encode_internal(self, ostream):
-			ostream.write(struct.pack('<B', self.which))
-			options = {
-				1: self.encode_status_request,
-				2: self.encode_start_microphone_request,
-				3: self.encode_stop_microphone_request,
-				4: self.encode_start_scan_request,
-				5: self.encode_stop_scan_request,
-				6: self.encode_start_imu_request,
-				7: self.encode_stop_imu_request,
-				27: self.encode_identify_request,
-				29: self.encode_restart_request,
-				30: self.encode_free_sdc_space_request,
-			}
-			options[self.which](ostream)
-			pass
-
-		def encode_status_request(self, ostream):
-			self.status_request.encode_internal(ostream)
-
-		def encode_start_microphone_request(self, ostream):
-			self.start_microphone_request.encode_internal(ostream)
-
-		def encode_stop_microphone_request(self, ostream):
-			self.stop_microphone_request.encode_internal(ostream)
-
-		def encode_start_scan_request(self, ostream):
-			self.start_scan_request.encode_internal(ostream)
-
-		def encode_stop_scan_request(self, ostream):
-			self.stop_scan_request.encode_internal(ostream)
-
-		def encode_start_imu_request(self, ostream):
-			self.start_imu_request.encode_internal(ostream)
-
-		def encode_stop_imu_request(self, ostream):
-			self.stop_imu_request.encode_internal(ostream)
-
-		def encode_identify_request(self, ostream):
-			self.identify_request.encode_internal(ostream)
-
-		def encode_restart_request(self, ostream):
-			self.restart_request.encode_internal(ostream)
-
-		def encode_free_sdc_space_request(self, ostream):
-			self.free_sdc_space_request.encode_internal(ostream)
-
-
-		def decode_internal(self, istream):
-			self.reset()
-			self.which= struct.unpack('<B', istream.read(1))[0]
-			options = {
-				1: self.decode_status_request,
-				2: self.decode_start_microphone_request,
-				3: self.decode_stop_microphone_request,
-				4: self.decode_start_scan_request,
-				5: self.decode_stop_scan_request,
-				6: self.decode_start_imu_request,
-				7: self.decode_stop_imu_request,
-				27: self.decode_identify_request,
-				29: self.decode_restart_request,
-				30: self.decode_free_sdc_space_request,
-			}
-			options[self.which](istream)
-			pass
-
-		def decode_status_request(self, istream):
-			self.status_request = StatusRequest()
-			self.status_request.decode_internal(istream)
-
-		def decode_start_microphone_request(self, istream):
-			self.start_microphone_request = StartMicrophoneRequest()
-			self.start_microphone_request.decode_internal(istream)
-
-		def decode_stop_microphone_request(self, istream):
-			self.stop_microphone_request = StopMicrophoneRequest()
-			self.stop_microphone_request.decode_internal(istream)
-
-		def decode_start_scan_request(self, istream):
-			self.start_scan_request = StartScanRequest()
-			self.start_scan_request.decode_internal(istream)
-
-		def decode_stop_scan_request(self, istream):
-			self.stop_scan_request = StopScanRequest()
-			self.stop_scan_request.decode_internal(istream)
-
-		def decode_start_imu_request(self, istream):
-			self.start_imu_request = StartImuRequest()
-			self.start_imu_request.decode_internal(istream)
-
-		def decode_stop_imu_request(self, istream):
-			self.stop_imu_request = StopImuRequest()
-			self.stop_imu_request.decode_internal(istream)
-
-		def decode_identify_request(self, istream):
-			self.identify_request = IdentifyRequest()
-			self.identify_request.decode_internal(istream)
-
-		def decode_restart_request(self, istream):
-			self.restart_request = RestartRequest()
-			self.restart_request.decode_internal(istream)
-
-		def decode_free_sdc_space_request(self, istream):
-			self.free_sdc_space_request = FreeSDCSpaceRequest()
-			self.free_sdc_space_request.decode_internal(istream)
-
-
-class StatusResponse:
-
-	def __init__(self):
-		self.reset()
-
-	def __repr__(self):
-		return str(self.__dict__)
+	__slots__ = ('clock_status', 'microphone_status', 'scan_status', 'imu_status', 'time_delta', 'timestamp')
+	_struct = struct.Struct('<BBBBiIH')
+	_dtype_spec = {'names': ['clock_status', 'microphone_status', 'scan_status', 'imu_status', 'time_delta', 'timestamp'], 'formats': ['<B', '<B', '<B', '<B', '<i', [('seconds', '<I'), ('ms', '<H')]], 'itemsize': 14}
 
 	def reset(self):
 		self.clock_status = 0
@@ -786,21 +563,12 @@ class StatusResponse:
 		self.imu_status = 0
 		self.time_delta = 0
 		self.timestamp = None
-		pass
 
-	def encode(self):
-		ostream = _Ostream()
-		self.encode_internal(ostream)
-		return ostream.buf
+	def length(self):
+		return self._struct.size
 
 	def encode_internal(self, ostream):
-		self.encode_clock_status(ostream)
-		self.encode_microphone_status(ostream)
-		self.encode_scan_status(ostream)
-		self.encode_imu_status(ostream)
-		self.encode_timestamp(ostream)
-		self.encode_time_delta(ostream)
-		pass
+		ostream.pack(self._struct, self.clock_status, self.microphone_status, self.scan_status, self.imu_status, self.time_delta, self.timestamp.seconds, self.timestamp.ms)
 
 	def encode_clock_status(self, ostream):
 		ostream.write(struct.pack('<B', self.clock_status))
@@ -820,191 +588,156 @@ class StatusResponse:
 	def encode_timestamp(self, ostream):
 		self.timestamp.encode_internal(ostream)
 
-
-
-	@classmethod
-	def decode(cls, buf):
-		obj = cls()
-		obj.decode_internal(_Istream(buf))
-		return obj
-
 	def decode_internal(self, istream):
-		self.reset()
-		self.decode_clock_status(istream)
-		self.decode_microphone_status(istream)
-		self.decode_scan_status(istream)
-		self.decode_imu_status(istream)
-		self.decode_time_delta(istream)
-		self.decode_timestamp(istream)
-		pass
+		self.clock_status, self.microphone_status, self.scan_status, self.imu_status, self.time_delta, timestamp_seconds, timestamp_ms = istream.unpack(self._struct)
+		self.timestamp = Timestamp._from_fields(timestamp_seconds, timestamp_ms)
 
 	def decode_clock_status(self, istream):
-		self.clock_status= struct.unpack('<B', istream.read(1))[0]
+		self.clock_status = struct.unpack('<B', istream.read(1))[0]
 
 	def decode_microphone_status(self, istream):
-		self.microphone_status= struct.unpack('<B', istream.read(1))[0]
+		self.microphone_status = struct.unpack('<B', istream.read(1))[0]
 
 	def decode_scan_status(self, istream):
-		self.scan_status= struct.unpack('<B', istream.read(1))[0]
+		self.scan_status = struct.unpack('<B', istream.read(1))[0]
 
 	def decode_imu_status(self, istream):
-		self.imu_status= struct.unpack('<B', istream.read(1))[0]
+		self.imu_status = struct.unpack('<B', istream.read(1))[0]
 
 	def decode_time_delta(self, istream):
-		self.time_delta= struct.unpack('<i', istream.read(4))[0]
+		self.time_delta = struct.unpack('<i', istream.read(4))[0]
 
 	def decode_timestamp(self, istream):
 		self.timestamp = Timestamp()
 		self.timestamp.decode_internal(istream)
 
+	@classmethod
+	def _from_fields(cls, clock_status, microphone_status, scan_status, imu_status, time_delta, timestamp):
+		obj = cls.__new__(cls)
+		obj.clock_status = clock_status
+		obj.microphone_status = microphone_status
+		obj.scan_status = scan_status
+		obj.imu_status = imu_status
+		obj.time_delta = time_delta
+		obj.timestamp = timestamp
+		return obj
 
 
-class StartMicrophoneResponse:
-
-	def __init__(self):
-		self.reset()
+class StartMicrophoneResponse(_Message):
 
-	def __repr__(self):
-		return str(self.__dict__)
+	__slots__ = ('timestamp',)
+	_struct = struct.Struct('<IH')
+	_dtype_spec = {'names': ['timestamp'], 'formats': [[('seconds', '<I'), ('ms', '<H')]], 'itemsize': 6}
 
 	def reset(self):
 		self.timestamp = None
-		pass
 
-	def encode(self):
-		ostream = _Ostream()
-		self.encode_internal(ostream)
-		return ostream.buf
+	def length(self):
+		return self._struct.size
 
 	def encode_internal(self, ostream):
-		self.encode_timestamp(ostream)
-		pass
+		ostream.pack(self._struct, self.timestamp.seconds, self.timestamp.ms)
 
 	def encode_timestamp(self, ostream):
 		self.timestamp.encode_internal(ostream)
 
-
-	@classmethod
-	def decode(cls, buf):
-		obj = cls()
-		obj.decode_internal(_Istream(buf))
-		return obj
-
 	def decode_internal(self, istream):
-		self.reset()
-		self.decode_timestamp(istream)
-		pass
+		timestamp_seconds, timestamp_ms = istream.unpack(self._struct)
+		self.timestamp = Timestamp._from_fields(timestamp_seconds, timestamp_ms)
 
 	def decode_timestamp(self, istream):
 		self.timestamp = Timestamp()
 		self.timestamp.decode_internal(istream)
 
+	@classmethod
+	def _from_fields(cls, timestamp):
+		obj = cls.__new__(cls)
+		obj.timestamp = timestamp
+		return obj
 
-class StartScanResponse:
 
-	def __init__(self):
-		self.reset()
+class StartScanResponse(_Message):
 
-	def __repr__(self):
-		return str(self.__dict__)
+	__slots__ = ('timestamp',)
+	_struct = struct.Struct('<IH')
+	_dtype_spec = {'names': ['timestamp'], 'formats': [[('seconds', '<I'), ('ms', '<H')]], 'itemsize': 6}
 
 	def reset(self):
 		self.timestamp = None
-		pass
 
-	def encode(self):
-		ostream = _Ostream()
-		self.encode_internal(ostream)
-		return ostream.buf
+	def length(self):
+		return self._struct.size
 
 	def encode_internal(self, ostream):
-		self.encode_timestamp(ostream)
-		pass
+		ostream.pack(self._struct, self.timestamp.seconds, self.timestamp.ms)
 
 	def encode_timestamp(self, ostream):
 		self.timestamp.encode_internal(ostream)
 
-
-	@classmethod
-	def decode(cls, buf):
-		obj = cls()
-		obj.decode_internal(_Istream(buf))
-		return obj
-
 	def decode_internal(self, istream):
-		self.reset()
-		self.decode_timestamp(istream)
-		pass
+		timestamp_seconds, timestamp_ms = istream.unpack(self._struct)
+		self.timestamp = Timestamp._from_fields(timestamp_seconds, timestamp_ms)
 
 	def decode_timestamp(self, istream):
 		self.timestamp = Timestamp()
 		self.timestamp.decode_internal(istream)
 
+	@classmethod
+	def _from_fields(cls, timestamp):
+		obj = cls.__new__(cls)
+		obj.timestamp = timestamp
+		return obj
 
-class StartImuResponse:
 
-	def __init__(self):
-		self.reset()
+class StartImuResponse(_Message):
 
-	def __repr__(self):
-		return str(self.__dict__)
+	__slots__ = ('timestamp',)
+	_struct = struct.Struct('<IH')
+	_dtype_spec = {'names': ['timestamp'], 'formats': [[('seconds', '<I'), ('ms', '<H')]], 'itemsize': 6}
 
 	def reset(self):
 		self.timestamp = None
-		pass
 
-	def encode(self):
-		ostream = _Ostream()
-		self.encode_internal(ostream)
-		return ostream.buf
+	def length(self):
+		return self._struct.size
 
 	def encode_internal(self, ostream):
-		self.encode_timestamp(ostream)
-		pass
+		ostream.pack(self._struct, self.timestamp.seconds, self.timestamp.ms)
 
 	def encode_timestamp(self, ostream):
 		self.timestamp.encode_internal(ostream)
 
-
-	@classmethod
-	def decode(cls, buf):
-		obj = cls()
-		obj.decode_internal(_Istream(buf))
-		return obj
-
 	def decode_internal(self, istream):
-		self.reset()
-		self.decode_timestamp(istream)
-		pass
+		timestamp_seconds, timestamp_ms = istream.unpack(self._struct)
+		self.timestamp = Timestamp._from_fields(timestamp_seconds, timestamp_ms)
 
 	def decode_timestamp(self, istream):
 		self.timestamp = Timestamp()
 		self.timestamp.decode_internal(istream)
 
-class FreeSDCSpaceResponse:
+	@classmethod
+	def _from_fields(cls, timestamp):
+		obj = cls.__new__(cls)
+		obj.timestamp = timestamp
+		return obj
 
-	def __init__(self):
-		self.reset()
 
-	def __repr__(self):
-		return str(self.__dict__)
+class FreeSDCSpaceResponse(_Message):
+
+	__slots__ = ('total_space', 'free_space', 'timestamp')
+	_struct = struct.Struct('<IIIH')
+	_dtype_spec = {'names': ['total_space', 'free_space', 'timestamp'], 'formats': ['<I', '<I', [('seconds', '<I'), ('ms', '<H')]], 'itemsize': 14}
 
 	def reset(self):
 		self.total_space = 0
 		self.free_space = 0
 		self.timestamp = None
-		pass
 
-	def encode(self):
-		ostream = _Ostream()
-		self.encode_internal(ostream)
-		return ostream.buf
+	def length(self):
+		return self._struct.size
 
 	def encode_internal(self, ostream):
-		self.encode_total_space(ostream)
-		self.encode_free_space(ostream)
-		self.encode_timestamp(ostream)
-		pass
+		ostream.pack(self._struct, self.total_space, self.free_space, self.timestamp.seconds, self.timestamp.ms)
 
 	def encode_total_space(self, ostream):
 		ostream.write(struct.pack('<I', self.total_space))
@@ -1015,93 +748,280 @@ class FreeSDCSpaceResponse:
 	def encode_timestamp(self, ostream):
 		self.timestamp.encode_internal(ostream)
 
-
-	@classmethod
-	def decode(cls, buf):
-		obj = cls()
-		obj.decode_internal(_Istream(buf))
-		return obj
-
 	def decode_internal(self, istream):
-		self.reset()
-		self.decode_total_space(istream)
-		self.decode_free_space(istream)
-		self.decode_timestamp(istream)
-		pass
+		self.total_space, self.free_space, timestamp_seconds, timestamp_ms = istream.unpack(self._struct)
+		self.timestamp = Timestamp._from_fields(timestamp_seconds, timestamp_ms)
 
 	def decode_total_space(self, istream):
-		self.total_space= struct.unpack('<I', istream.read(4))[0]
+		self.total_space = struct.unpack('<I', istream.read(4))[0]
 
 	def decode_free_space(self, istream):
-		self.free_space= struct.unpack('<I', istream.read(4))[0]
+		self.free_space = struct.unpack('<I', istream.read(4))[0]
 
 	def decode_timestamp(self, istream):
 		self.timestamp = Timestamp()
 		self.timestamp.decode_internal(istream)
 
+	@classmethod
+	def _from_fields(cls, total_space, free_space, timestamp):
+		obj = cls.__new__(cls)
+		obj.total_space = total_space
+		obj.free_space = free_space
+		obj.timestamp = timestamp
+		return obj
 
 
-class Response:
+class ScanReport(_Message):
 
-	def __init__(self):
-		self.reset()
+	__slots__ = ('timestamp', 'badge_assignement', 'rssi')
+	_struct = struct.Struct('<QHBb4x')
+	_dtype_spec = {'names': ['timestamp', 'badge_assignement', 'rssi'], 'formats': ['<Q', [('ID', '<H'), ('group', '<B')], '<b'], 'itemsize': 16}
+
+	def reset(self):
+		self.timestamp = 0
+		self.badge_assignement = None
+		self.rssi = 0
+
+	def length(self):
+		return self._struct.size
+
+	def encode_internal(self, ostream):
+		ostream.pack(self._struct, self.timestamp, self.badge_assignement.ID, self.badge_assignement.group, self.rssi)
+
+	def encode_timestamp(self, ostream):
+		ostream.write(struct.pack('<Q', self.timestamp))
+
+	def encode_badge_assignement(self, ostream):
+		self.badge_assignement.encode_internal(ostream)
+
+	def encode_rssi(self, ostream):
+		ostream.write(struct.pack('<b', self.rssi))
+
+	def decode_internal(self, istream):
+		self.timestamp, badge_assignement_ID, badge_assignement_group, self.rssi = istream.unpack(self._struct)
+		self.badge_assignement = BadgeAssignement._from_fields(badge_assignement_ID, badge_assignement_group)
+
+	def decode_timestamp(self, istream):
+		self.timestamp = struct.unpack('<Q', istream.read(8))[0]
+
+	def decode_badge_assignement(self, istream):
+		self.badge_assignement = BadgeAssignement()
+		self.badge_assignement.decode_internal(istream)
+
+	def decode_rssi(self, istream):
+		self.rssi = struct.unpack('<b', istream.read(1))[0]
+
+	@classmethod
+	def _from_fields(cls, timestamp, badge_assignement, rssi):
+		obj = cls.__new__(cls)
+		obj.timestamp = timestamp
+		obj.badge_assignement = badge_assignement
+		obj.rssi = rssi
+		return obj
 
-	def __repr__(self):
-		return str(self.__dict__)
+
+class Request(_Message):
+
+	__slots__ = ('type',)
 
 	def reset(self):
 		self.type = self._type()
-		pass
 
-	def encode(self):
-		ostream = _Ostream()
-		self.encode_internal(ostream)
-		return ostream.buf
+	def length(self):
+		return self.type.length()
 
 	def encode_internal(self, ostream):
 		self.type.encode_internal(ostream)
-		pass
 
+	def decode_internal(self, istream):
+		self.type.decode_internal(istream)
 
-	@classmethod
-	def decode(cls, buf):
-		obj = cls()
-		obj.decode_internal(_Istream(buf))
-		return obj
+	class _type:
+
+		__slots__ = ('which', '_value')
+
+		_options = {
+			1: StatusRequest,
+			2: StartMicrophoneRequest,
+			3: StopMicrophoneRequest,
+			4: StartScanRequest,
+			5: StopScanRequest,
+			6: StartImuRequest,
+			7: StopImuRequest,
+			27: IdentifyRequest,
+			29: RestartRequest,
+			30: FreeSDCSpaceRequest,
+		}
+
+		_names = {
+			1: 'status_request',
+			2: 'start_microphone_request',
+			3: 'stop_microphone_request',
+			4: 'start_scan_request',
+			5: 'stop_scan_request',
+			6: 'start_imu_request',
+			7: 'stop_imu_request',
+			27: 'identify_request',
+			29: 'restart_request',
+			30: 'free_sdc_space_request',
+		}
+
+		def __init__(self):
+			self.reset()
+
+		def __repr__(self):
+			return str({'which': self.which, self._names.get(self.which, 'value'): self._value})
+
+		def reset(self):
+			self.which = 0
+			self._value = None
+
+		def length(self):
+			return _which_struct.size + self._value.length()
+
+		def encode_internal(self, ostream):
+			ostream.pack(_which_struct, self.which)
+			self._value.encode_internal(ostream)
+
+		def encode_status_request(self, ostream):
+			self.status_request.encode_internal(ostream)
+
+		def encode_start_microphone_request(self, ostream):
+			self.start_microphone_request.encode_internal(ostream)
+
+		def encode_stop_microphone_request(self, ostream):
+			self.stop_microphone_request.encode_internal(ostream)
+
+		def encode_start_scan_request(self, ostream):
+			self.start_scan_request.encode_internal(ostream)
+
+		def encode_stop_scan_request(self, ostream):
+			self.stop_scan_request.encode_internal(ostream)
+
+		def encode_start_imu_request(self, ostream):
+			self.start_imu_request.encode_internal(ostream)
+
+		def encode_stop_imu_request(self, ostream):
+			self.stop_imu_request.encode_internal(ostream)
+
+		def encode_identify_request(self, ostream):
+			self.identify_request.encode_internal(ostream)
+
+		def encode_restart_request(self, ostream):
+			self.restart_request.encode_internal(ostream)
+
+		def encode_free_sdc_space_request(self, ostream):
+			self.free_sdc_space_request.encode_internal(ostream)
+
+		def decode_internal(self, istream):
+			self.which, = istream.unpack(_which_struct)
+			self._value = self._options[self.which]()
+			self._value.decode_internal(istream)
+
+		def decode_status_request(self, istream):
+			self.status_request = StatusRequest()
+			self.status_request.decode_internal(istream)
+
+		def decode_start_microphone_request(self, istream):
+			self.start_microphone_request = StartMicrophoneRequest()
+			self.start_microphone_request.decode_internal(istream)
+
+		def decode_stop_microphone_request(self, istream):
+			self.stop_microphone_request = StopMicrophoneRequest()
+			self.stop_microphone_request.decode_internal(istream)
+
+		def decode_start_scan_request(self, istream):
+			self.start_scan_request = StartScanRequest()
+			self.start_scan_request.decode_internal(istream)
+
+		def decode_stop_scan_request(self, istream):
+			self.stop_scan_request = StopScanRequest()
+			self.stop_scan_request.decode_internal(istream)
+
+		def decode_start_imu_request(self, istream):
+			self.start_imu_request = StartImuRequest()
+			self.start_imu_request.decode_internal(istream)
+
+		def decode_stop_imu_request(self, istream):
+			self.stop_imu_request = StopImuRequest()
+			self.stop_imu_request.decode_internal(istream)
+
+		def decode_identify_request(self, istream):
+			self.identify_request = IdentifyRequest()
+			self.identify_request.decode_internal(istream)
+
+		def decode_restart_request(self, istream):
+			self.restart_request = RestartRequest()
+			self.restart_request.decode_internal(istream)
+
+		def decode_free_sdc_space_request(self, istream):
+			self.free_sdc_space_request = FreeSDCSpaceRequest()
+			self.free_sdc_space_request.decode_internal(istream)
+
+		status_request = _union_option(1)
+		start_microphone_request = _union_option(2)
+		stop_microphone_request = _union_option(3)
+		start_scan_request = _union_option(4)
+		stop_scan_request = _union_option(5)
+		start_imu_request = _union_option(6)
+		stop_imu_request = _union_option(7)
+		identify_request = _union_option(27)
+		restart_request = _union_option(29)
+		free_sdc_space_request = _union_option(30)
+
+
+class Response(_Message):
+
+	__slots__ = ('type',)
+
+	def reset(self):
+		self.type = self._type()
+
+	def length(self):
+		return self.type.length()
+
+	def encode_internal(self, ostream):
+		self.type.encode_internal(ostream)
 
 	def decode_internal(self, istream):
-		self.reset()
 		self.type.decode_internal(istream)
-		pass
 
 	class _type:
 
+		__slots__ = ('which', '_value')
+
+		_options = {
+			1: StatusResponse,
+			2: StartMicrophoneResponse,
+			3: StartScanResponse,
+			4: StartImuResponse,
+			5: FreeSDCSpaceResponse,
+		}
+
+		_names = {
+			1: 'status_response',
+			2: 'start_microphone_response',
+			3: 'start_scan_response',
+			4: 'start_imu_response',
+			5: 'free_sdc_space_response',
+		}
+
 		def __init__(self):
 			self.reset()
 
 		def __repr__(self):
-			return str(self.__dict__)
+			return str({'which': self.which, self._names.get(self.which, 'value'): self._value})
 
 		def reset(self):
 			self.which = 0
-			self.status_response = None
-			self.start_microphone_response = None
-			self.start_scan_response = None
-			self.start_imu_response = None
-			self.free_sdc_space_response = None
-			pass
+			self._value = None
+
+		def length(self):
+			return _which_struct.size + self._value.length()
 
 		def encode_internal(self, ostream):
-			ostream.write(struct.pack('<B', self.which))
-			options = {
-				1: self.encode_status_response,
-				2: self.encode_start_microphone_response,
-				3: self.encode_start_scan_response,
-				4: self.encode_start_imu_response,
-				5: self.encode_free_sdc_space_response,
-			}
-			options[self.which](ostream)
-			pass
+			ostream.pack(_which_struct, self.which)
+			self._value.encode_internal(ostream)
 
 		def encode_status_response(self, ostream):
 			self.status_response.encode_internal(ostream)
@@ -1118,19 +1038,10 @@ class Response:
 		def encode_free_sdc_space_response(self, ostream):
 			self.free_sdc_space_response.encode_internal(ostream)
 
-
 		def decode_internal(self, istream):
-			self.reset()
-			self.which= struct.unpack('<B', istream.read(1))[0]
-			options = {
-				1: self.decode_status_response,
-				2: self.decode_start_microphone_response,
-				3: self.decode_start_scan_response,
-				4: self.decode_start_imu_response,
-				5: self.decode_free_sdc_space_response,
-			}
-			options[self.which](istream)
-			pass
+			self.which, = istream.unpack(_which_struct)
+			self._value = self._options[self.which]()
+			self._value.decode_internal(istream)
 
 		def decode_status_response(self, istream):
 			self.status_response = StatusResponse()
@@ -1151,3 +1062,9 @@ class Response:
 		def decode_free_sdc_space_response(self, istream):
 			self.free_sdc_space_response = FreeSDCSpaceResponse()
 			self.free_sdc_space_response.decode_internal(istream)
+
+		status_response = _union_option(1)
+		start_microphone_response = _union_option(2)
+		start_scan_response = _union_option(3)
+		start_imu_response = _union_option(4)
+		free_sdc_space_response = _union_option(5)
@@ -0,0 +1,141 @@
+from typing import Final, NamedTuple
+
+
+# Declarative description of the hub <-> midge protocol, mirroring
+# rythmbadge/protocol_messages.h. badge_protocol.py is generated from this
+# file by generate_badge_protocol.py; edit the schema, not the generated module.
+
+
+# Scalar field types and their little-endian struct format characters.
+SCALAR_FORMATS: Final[dict] = {
+    "uint8": "B",
+    "int8": "b",
+    "uint16": "H",
+    "int16": "h",
+    "uint32": "I",
+    "int32": "i",
+    "uint64": "Q",
+}
+
+
+class Field(NamedTuple):
+    name: str
+    # Either a key of SCALAR_FORMATS or the name of another Message.
+    type: str
+    # Optional fields are preceded by a uint8 has_<name> flag on the wire
+    # and must be the last field of their message.
+    optional: bool = False
+
+
+class Message(NamedTuple):
+    name: str
+    fields: list
+    # Trailing alignment bytes, for records that mirror unpacked firmware structs.
+    padding: int = 0
+
+
+class Option(NamedTuple):
+    tag: int
+    name: str
+    message: str
+
+
+class Union(NamedTuple):
+    name: str
+    options: list
+
+
+MESSAGES: Final[list] = [
+    Message("Timestamp", [
+        Field("seconds", "uint32"),
+        Field("ms", "uint16"),
+    ]),
+    Message("BadgeAssignement", [
+        Field("ID", "uint16"),
+        Field("group", "uint8"),
+    ]),
+    Message("ScanDevice", [
+        Field("ID", "uint16"),
+        Field("rssi", "int8"),
+    ]),
+    Message("StatusRequest", [
+        Field("timestamp", "Timestamp"),
+        Field("badge_assignement", "BadgeAssignement", optional=True),
+    ]),
+    Message("StartMicrophoneRequest", [
+        Field("timestamp", "Timestamp"),
+        Field("mode", "uint8"),
+    ]),
+    Message("StopMicrophoneRequest", []),
+    Message("StartScanRequest", [
+        Field("timestamp", "Timestamp"),
+        Field("window", "uint16"),
+        Field("interval", "uint16"),
+    ]),
+    Message("StopScanRequest", []),
+    Message("StartImuRequest", [
+        Field("timestamp", "Timestamp"),
+        Field("acc_fsr", "uint16"),
+        Field("gyr_fsr", "uint16"),
+        Field("datarate", "uint16"),
+    ]),
+    Message("StopImuRequest", []),
+    Message("IdentifyRequest", [
+        Field("timeout", "uint16"),
+    ]),
+    Message("RestartRequest", []),
+    Message("FreeSDCSpaceRequest", []),
+    Message("StatusResponse", [
+        Field("clock_status", "uint8"),
+        Field("microphone_status", "uint8"),
+        Field("scan_status", "uint8"),
+        Field("imu_status", "uint8"),
+        Field("time_delta", "int32"),
+        Field("timestamp", "Timestamp"),
+    ]),
+    Message("StartMicrophoneResponse", [
+        Field("timestamp", "Timestamp"),
+    ]),
+    Message("StartScanResponse", [
+        Field("timestamp", "Timestamp"),
+    ]),
+    Message("StartImuResponse", [
+        Field("timestamp", "Timestamp"),
+    ]),
+    Message("FreeSDCSpaceResponse", [
+        Field("total_space", "uint32"),
+        Field("free_space", "uint32"),
+        Field("timestamp", "Timestamp"),
+    ]),
+    # scanner_scan_report_t from rythmbadge/scanner_lib.h, as stored on the SD card.
+    # Not sent over BLE; the uint64 timestamp (ms) aligns the record to 16 bytes.
+    Message("ScanReport", [
+        Field("timestamp", "uint64"),
+        Field("badge_assignement", "BadgeAssignement"),
+        Field("rssi", "int8"),
+    ], padding=4),
+]
+
+
+# Tagged unions: a uint8 tag followed by the selected message.
+UNIONS: Final[list] = [
+    Union("Request", [
+        Option(1, "status_request", "StatusRequest"),
+        Option(2, "start_microphone_request", "StartMicrophoneRequest"),
+        Option(3, "stop_microphone_request", "StopMicrophoneRequest"),
+        Option(4, "start_scan_request", "StartScanRequest"),
+        Option(5, "stop_scan_request", "StopScanRequest"),
+        Option(6, "start_imu_request", "StartImuRequest"),
+        Option(7, "stop_imu_request", "StopImuRequest"),
+        Option(27, "identify_request", "IdentifyRequest"),
+        Option(29, "restart_request", "RestartRequest"),
+        Option(30, "free_sdc_space_request", "FreeSDCSpaceRequest"),
+    ]),
+    Union("Response", [
+        Option(1, "status_response", "StatusResponse"),
+        Option(2, "start_microphone_response", "StartMicrophoneResponse"),
+        Option(3, "start_scan_response", "StartScanResponse"),
+        Option(4, "start_imu_response", "StartImuResponse"),
+        Option(5, "free_sdc_space_response", "FreeSDCSpaceResponse"),
+    ]),
+]
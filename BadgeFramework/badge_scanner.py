@@ -0,0 +1,356 @@
+from __future__ import annotations
+import contextlib
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from badge_advertisement import (
+    MANUFACTURER_DATA_AD_TYPE,
+    BadgeAdvertisement,
+    parse_manufacturer_data,
+)
+
+logger = logging.getLogger(__name__)
+
+# Name the midges advertise (ADVERTISING_DEVICE_NAME in rythmbadge/advertiser_lib.h).
+DEVICE_NAME = "HDBDG"
+# Seconds of scanning before a fleet operation. Midges advertise every 200 ms, so this
+#   hears each badge in range about ten times.
+DEFAULT_SCAN_SECONDS = 2.0
+# AD type of the complete local name (bluepy's ScanEntry.COMPLETE_LOCAL_NAME).
+COMPLETE_LOCAL_NAME = 0x09
+
+# Seconds after which FleetMonitor forgets the state of a midge not heard since, e.g. one
+#   that went out of range or is connected (a connected midge stops advertising).
+DEFAULT_STALE_SECONDS = 10.0
+# Seconds one continuous scan lasts before it is restarted, since controllers report a
+#   device only once per scan when filtering duplicates, and seconds between checks for a
+#   stop or pause request.
+SCAN_CYCLE_SECONDS = 5.0
+SCAN_POLL_SECONDS = 0.5
+# Seconds before listening again on an adapter whose scan failed.
+SCAN_RETRY_SECONDS = 5.0
+
+
+# Raised for a badge that was not heard advertising, instead of trying to connect to it.
+class BadgeNotSeenError(ConnectionError):
+    pass
+
+
+# Raised by a scan that could not listen at all, e.g. because scanning needs privileges
+#   (CAP_NET_ADMIN) that connecting does not, or because every adapter was busy.
+class ScanFailedError(OSError):
+    pass
+
+
+# A badge heard advertising: its MAC address (lower case), and the strongest RSSI (dBm) it
+#   was heard at and the adapter (hciN) that heard it.
+class SeenBadge(NamedTuple):
+    address: str
+    rssi: int
+    iface: int
+    # RSSI heard by every adapter that heard the badge, {iface: rssi}.
+    rssi_by_iface: Dict[int, int]
+
+
+# Returns the badges named `name` heard on adapter hci`iface` during a passive scan of
+#   `seconds`, as {address: rssi}.
+def scan_adapter(seconds: float, iface: int = 0, name: str = DEVICE_NAME) -> Dict[str, int]:
+    from bluepy.btle import Scanner
+
+    heard = {}
+    for device in Scanner(iface).scan(seconds, passive=True):
+        if device.getValueText(COMPLETE_LOCAL_NAME) == name:
+            heard[device.addr.lower()] = device.rssi
+    return heard
+
+
+# Scans on all adapters in `ifaces` at the same time and returns the midges heard, as
+#   {address: SeenBadge}. An adapter whose scan fails only loses its own results; raises
+#   ScanFailedError if no adapter could scan.
+def scan_for_badges(
+    seconds: float = DEFAULT_SCAN_SECONDS,
+    ifaces: Sequence[int] = (0,),
+    name: str = DEVICE_NAME,
+) -> Dict[str, SeenBadge]:
+    heard_by_iface = {}
+    errors = []
+
+    def scan(iface):
+        try:
+            heard_by_iface[iface] = scan_adapter(seconds, iface, name)
+        except Exception as err:
+            logger.warning("Scan on hci{} failed: {}".format(iface, err))
+            errors.append(err)
+
+    threads = [threading.Thread(target=scan, args=(iface,)) for iface in ifaces]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors and not heard_by_iface:
+        raise ScanFailedError("No adapter could scan: {}".format(errors[0])) from errors[0]
+    return merge_scans(heard_by_iface)
+
+
+# Combines per-adapter scan results {iface: {address: rssi}} into {address: SeenBadge}.
+def merge_scans(heard_by_iface: Dict[int, Dict[str, int]]) -> Dict[str, SeenBadge]:
+    rssi_by_address = {}
+    for iface, heard in heard_by_iface.items():
+        for address, rssi in heard.items():
+            rssi_by_address.setdefault(address.lower(), {})[iface] = rssi
+    seen = {}
+    for address, rssi_by_iface in rssi_by_address.items():
+        iface = max(rssi_by_iface, key=rssi_by_iface.get)
+        seen[address] = SeenBadge(address, rssi_by_iface[iface], iface, rssi_by_iface)
+    return seen
+
+
+# Splits (participant, address) pairs into the badges in `seen`, strongest RSSI first, and
+#   the ones missing from it, in their original order.
+def split_by_scan(
+    badges: Iterable[Tuple[Any, str]], seen: Dict[str, SeenBadge]
+) -> Tuple[List[Tuple[Any, str]], List[Tuple[Any, str]]]:
+    present = []
+    missing = []
+    for badge in badges:
+        if badge[1].lower() in seen:
+            present.append(badge)
+        else:
+            missing.append(badge)
+    present.sort(key=lambda badge: seen[badge[1].lower()].rssi, reverse=True)
+    return present, missing
+
+
+# Listens on adapter hci`iface` until should_stop() returns True, calling
+#   report(iface, address, rssi, manufacturer_data) for every advertisement of a midge named
+#   `name`; FleetMonitor's default listener.
+def listen_adapter(
+    iface: int,
+    report: Callable[[int, str, int, Optional[bytes]], None],
+    should_stop: Callable[[], bool],
+    name: str = DEVICE_NAME,
+):
+    from bluepy.btle import DefaultDelegate, Scanner
+
+    class ReportDelegate(DefaultDelegate):
+        def handleDiscovery(self, device, is_new_device, is_new_data):
+            if device.getValueText(COMPLETE_LOCAL_NAME) == name:
+                report(iface, device.addr, device.rssi, device.getValue(MANUFACTURER_DATA_AD_TYPE))
+
+    scanner = Scanner(iface).withDelegate(ReportDelegate())
+    while not should_stop():
+        scanner.clear()
+        scanner.start(passive=True)
+        try:
+            cycle_end = time.monotonic() + SCAN_CYCLE_SECONDS
+            while not should_stop() and time.monotonic() < cycle_end:
+                scanner.process(SCAN_POLL_SECONDS)
+        finally:
+            scanner.stop()
+
+
+# The last state advertised by one midge, when it was last heard, and the RSSI (dBm) each
+#   adapter heard it at.
+class MonitoredBadge(object):
+    __slots__ = ("address", "advertisement", "rssi_by_iface", "last_seen", "reports")
+
+    def __init__(self, address):
+        self.address = address
+        self.advertisement = None
+        self.rssi_by_iface = {}
+        self.last_seen = 0.0
+        self.reports = 0
+
+    @property
+    def iface(self):
+        return max(self.rssi_by_iface, key=self.rssi_by_iface.get)
+
+    @property
+    def rssi(self):
+        return self.rssi_by_iface[self.iface]
+
+
+# FleetMonitor keeps a live status table of the fleet from advertisements alone: every
+#   adapter in `ifaces` scans passively in its own thread, and each advertisement of a midge
+#   updates its MonitoredBadge, so checking on the fleet needs no connection.
+# Advertisements are received by listener(iface, report, should_stop) (listen_adapter()
+#   for real adapters). Since scanning can disturb connection setup on the same adapter,
+#   rounds of connections should run inside paused(). Times are taken from `clock`.
+class FleetMonitor(object):
+    def __init__(
+        self,
+        ifaces: Sequence[int] = (0,),
+        stale_after: float = DEFAULT_STALE_SECONDS,
+        listener: Callable[..., None] = listen_adapter,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.ifaces = list(ifaces)
+        self.stale_after = stale_after
+        self.listener = listener
+        self.clock = clock
+        # address -> MonitoredBadge
+        self.table = {}
+        self.threads = []
+        self.stopping = False
+        self.pauses = 0
+        self.listening = 0
+        # iface -> clock() time the listen window running on the adapter started at.
+        self.listening_since = {}
+        # iface -> clock() time the last listen window of at least DEFAULT_SCAN_SECONDS on
+        #   the adapter ended at, without failing.
+        self.listened_until = {}
+        self.condition = threading.Condition()
+
+    @property
+    def running(self):
+        return bool(self.threads)
+
+    # Whether the table can be trusted to hold every midge in range: every adapter has been
+    #   listening for DEFAULT_SCAN_SECONDS, or did so in a window that ended (e.g. for a
+    #   pause) less than stale_after seconds ago. An adapter whose listener keeps failing
+    #   keeps the monitor from being ready.
+    @property
+    def ready(self):
+        if not self.running:
+            return False
+        now = self.clock()
+        with self.condition:
+            return all(self._has_listened(iface, now) for iface in self.ifaces)
+
+    def _has_listened(self, iface, now):
+        since = self.listening_since.get(iface)
+        if since is not None and now - since >= DEFAULT_SCAN_SECONDS:
+            return True
+        until = self.listened_until.get(iface)
+        return until is not None and now - until <= self.stale_after
+
+    def start(self):
+        if self.threads:
+            return
+        self.stopping = False
+        self.listening_since.clear()
+        self.listened_until.clear()
+        self.threads = [
+            threading.Thread(
+                target=self._listen, args=(iface,), name="monitor-hci{}".format(iface), daemon=True
+            )
+            for iface in self.ifaces
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def _should_stop(self):
+        return self.stopping or self.pauses > 0
+
+    def _listen(self, iface):
+        while True:
+            with self.condition:
+                while self.pauses and not self.stopping:
+                    self.condition.wait()
+                if self.stopping:
+                    return
+                self.listening += 1
+                started = self.listening_since[iface] = self.clock()
+            failed = False
+            try:
+                self.listener(iface, self.handle_report, self._should_stop)
+            except Exception as err:
+                logger.warning("Monitoring on hci{} failed: {}".format(iface, err))
+                failed = True
+            finally:
+                with self.condition:
+                    self.listening -= 1
+                    del self.listening_since[iface]
+                    now = self.clock()
+                    if not failed and now - started >= DEFAULT_SCAN_SECONDS:
+                        self.listened_until[iface] = now
+                    self.condition.notify_all()
+            if failed:
+                with self.condition:
+                    self.condition.wait_for(self._should_stop, SCAN_RETRY_SECONDS)
+
+    # Context manager stopping all scans for the duration of its block.
+    @contextlib.contextmanager
+    def paused(self):
+        with self.condition:
+            self.pauses += 1
+            self.condition.wait_for(lambda: self.listening == 0)
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.pauses -= 1
+                self.condition.notify_all()
+
+    # Records one advertisement heard on adapter hci`iface`; ignores data not from a midge.
+    def handle_report(
+        self, iface: int, address: str, rssi: int, data: Optional[bytes], now: Optional[float] = None
+    ):
+        advertisement = parse_manufacturer_data(data)
+        if advertisement is None:
+            return
+        if now is None:
+            now = self.clock()
+        address = address.lower()
+        with self.condition:
+            badge = self.table.get(address)
+            if badge is None:
+                badge = self.table[address] = MonitoredBadge(address)
+            if now - badge.last_seen > self.stale_after:
+                badge.rssi_by_iface.clear()
+            badge.advertisement = advertisement
+            badge.rssi_by_iface[iface] = rssi
+            badge.last_seen = now
+            badge.reports += 1
+
+    # Returns the MonitoredBadge of the midge at `address`, or None if it was not heard
+    #   within stale_after seconds.
+    def status(self, address: str, now: Optional[float] = None) -> Optional[MonitoredBadge]:
+        if now is None:
+            now = self.clock()
+        with self.condition:
+            badge = self.table.get(address.lower())
+            if badge is None or now - badge.last_seen > self.stale_after:
+                return None
+            return badge
+
+    # Returns {address: BadgeAdvertisement} for the midges heard within stale_after seconds.
+    def advertisements(self, now: Optional[float] = None) -> Dict[str, BadgeAdvertisement]:
+        if now is None:
+            now = self.clock()
+        with self.condition:
+            return {
+                address: badge.advertisement
+                for address, badge in self.table.items()
+                if now - badge.last_seen <= self.stale_after
+            }
+
+    # The midges heard within stale_after seconds, like scan_for_badges() but immediately
+    #   and without scanning; fits AdapterScheduler.scan_and_run's scanner. Raises
+    #   ScanFailedError if no midge was heard, which more likely means the listeners failed
+    #   than that the whole fleet is gone.
+    def scan(
+        self, seconds: float = 0.0, ifaces: Optional[Sequence[int]] = None, name: str = DEVICE_NAME
+    ) -> Dict[str, SeenBadge]:
+        now = self.clock()
+        heard_by_iface = {}
+        with self.condition:
+            for address, badge in self.table.items():
+                if now - badge.last_seen > self.stale_after:
+                    continue
+                for iface, rssi in badge.rssi_by_iface.items():
+                    if ifaces is None or iface in ifaces:
+                        heard_by_iface.setdefault(iface, {})[address] = rssi
+        if not heard_by_iface:
+            raise ScanFailedError("The monitor heard no midge advertising")
+        return merge_scans(heard_by_iface)
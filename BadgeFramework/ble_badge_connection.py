@@ -1,18 +1,21 @@
 from __future__ import absolute_import, division, print_function
 
+import contextlib
 import logging
-import queue
 import struct
 import sys
+import threading
 import time
 import uuid
 
 from bluepy import *
 from bluepy import btle
-from bluepy.btle import (UUID, AssignedNumbers, BTLEException, DefaultDelegate,
-                         Peripheral, Scanner)
+from bluepy.btle import (UUID, AssignedNumbers, BTLEDisconnectError, BTLEException,
+                         DefaultDelegate, Peripheral, Scanner)
 
 from badge_connection import *
+from badge_metrics import default_recorder
+from gatt_handle_cache import GattHandleCache, GattHandles
 
 logger = logging.getLogger(__name__)
 
@@ -23,6 +26,33 @@ logger = logging.getLogger(__name__)
 UART_SERVICE_UUID = uuid.UUID("6E400001-B5A3-F393-E0A9-E50E24DCCA9E")
 TX_CHAR_UUID = uuid.UUID("6E400002-B5A3-F393-E0A9-E50E24DCCA9E")
 RX_CHAR_UUID = uuid.UUID("6E400003-B5A3-F393-E0A9-E50E24DCCA9E")
+# Client characteristic configuration descriptor, and its handle on the midge firmware.
+CCCD_UUID = 0x2902
+DEFAULT_CCCD_HANDLE = 0x0013
+
+# ATT MTU before any exchange, the MTU asked for on connect, and the ATT write header size
+#   (the payload of one write is MTU - header). The midge firmware currently accepts 23.
+ATT_DEFAULT_MTU = 23
+REQUESTED_MTU = 247
+ATT_WRITE_HEADER_SIZE = 3
+
+# Default deadline, in seconds, for send() and await_data() to receive the expected bytes.
+DEFAULT_TIMEOUT_SECONDS = 10.0
+
+
+# Context manager raising the bluepy errors of a link that went down, or of a request the
+#   helper gave up on, as the BadgeDisconnectedError and BadgeTimeoutError of the
+#   BadgeConnection interface, so that callers need not know about bluepy.
+@contextlib.contextmanager
+def _badge_errors(address):
+    try:
+        yield
+    except BTLEDisconnectError as err:
+        raise BadgeDisconnectedError("Lost the link to {}: {}".format(address, err)) from err
+    except BTLEException as err:
+        if "timed out" not in str(err).lower():
+            raise
+        raise BadgeTimeoutError("Timed out talking to {}: {}".format(address, err)) from err
 
 
 class SimpleDelegate(DefaultDelegate):
@@ -63,27 +93,50 @@ class Peripheral2(Peripheral):
 #   that can be used to retrieve an instance of this class that represents a connection to a badge with
 #   the given ID. This class method should be the main way clients instantiate new BLEBadgeConnections.
 class BLEBadgeConnection(BadgeConnection):
-    def __init__(self, ble_device):
+    peripheral_class = Peripheral2
+
+    # Handles discovered by every connection, shared unless a connection is given its own
+    #   `handle_cache` (pass None to always run discovery).
+    default_handle_cache = GattHandleCache()
+
+    def __init__(
+        self,
+        ble_device,
+        timeout=DEFAULT_TIMEOUT_SECONDS,
+        handle_cache=default_handle_cache,
+        requested_mtu=REQUESTED_MTU,
+        metrics=default_recorder,
+        iface=None,
+    ):
         self.ble_device = ble_device
-
-        # We will set these on connection to be the correct objects from the
-        #   Adafruit library.
-        self.uart = None
-        self.rx = None
-        self.tx = None
+        # Number N of the hciN adapter to connect through, None for the default adapter.
+        self.iface = iface
+        # Kept after disconnect(), which clears ble_device; labels the recorded `metrics`.
+        self.address = ble_device
+        self.metrics = metrics
+        self.timeout = timeout
+        self.requested_mtu = requested_mtu
+        self.mtu = ATT_DEFAULT_MTU
+
+        # Set on connection: the bluepy peripheral and the GattHandles of the UART service.
         self.conn = None
+        self.handles = None
+        self.handle_cache = handle_cache
 
         # Contains the bytes recieved from the device. Held here until an entire message is recieved.
-        self.rx_queue = queue.Queue()
+        #   Notifications are appended as a whole and complete reads are cut from the front
+        #   (which CPython does without moving the rest of the buffer), guarded by one lock.
+        self.rx_buffer = bytearray()
+        self.rx_lock = threading.Lock()
 
         BadgeConnection.__init__(self)
 
     # Returns a BLEBadgeConnection() to the first badge it sees, or none if a badge
     #   could not be found in timeout_seconds seconds. (Default is 10)
     @classmethod
-    def get_connection_to_badge(cls, device_addr: str, timeout_seconds:float=10.0):
+    def get_connection_to_badge(cls, device_addr: str, timeout_seconds:float=10.0, iface=None):
 
-        return cls(device_addr)
+        return cls(device_addr, iface=iface)
 
     # Function to receive RX characteristic changes.  Note that this will
     # be called on a different thread so be careful to make sure state that
@@ -93,39 +146,152 @@ class BLEBadgeConnection(BadgeConnection):
     def received(self, data):
         logger.debug("Recieved {}".format(data.hex()))
 
-        for b in data:
-            self.rx_queue.put(b)
+        with self.rx_lock:
+            self.rx_buffer += data
+
+    # Removes and returns the first data_len received bytes, or None if fewer have arrived.
+    def take_received(self, data_len):
+        with self.rx_lock:
+            if len(self.rx_buffer) < data_len:
+                return None
+            data = bytes(self.rx_buffer[:data_len])
+            del self.rx_buffer[:data_len]
+            return data
+
+    # Removes and returns all the received bytes, or None if nothing has arrived.
+    def take_all_received(self):
+        with self.rx_lock:
+            if not self.rx_buffer:
+                return None
+            data = bytes(self.rx_buffer)
+            self.rx_buffer.clear()
+            return data
+
+    # Drops any received bytes that were not read, e.g. the rest of an abandoned response.
+    def clear_received(self):
+        with self.rx_lock:
+            self.rx_buffer.clear()
+
+    # Blocks until data_len bytes have been received and returns them, or throws a
+    #   BadgeTimeoutError once `timeout` seconds have passed. bluepy only delivers
+    #   notifications while waitForNotifications() runs, so the waiting thread pumps them.
+    #   With data_len None, returns all the bytes received as soon as there are any.
+    def _receive(self, data_len, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        deadline = time.monotonic() + timeout
+        while True:
+            if data_len is None:
+                data = self.take_all_received()
+            else:
+                data = self.take_received(data_len)
+            if data is not None:
+                return data
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise BadgeTimeoutError(
+                    "Timed out after {:.1f}s waiting for {} bytes from {}".format(
+                        timeout, data_len or "any", self.ble_device
+                    )
+                )
+            with _badge_errors(self.address):
+                self.conn.waitForNotifications(remaining)
+
+    # Finds the UART characteristics and the RX CCCD by service and descriptor discovery.
+    def _discover_handles(self):
+        uart = self.conn.getServiceByUUID(UART_SERVICE_UUID)
+        rx = uart.getCharacteristics(RX_CHAR_UUID)[0]
+        tx = uart.getCharacteristics(TX_CHAR_UUID)[0]
+        cccds = rx.getDescriptors(forUUID=CCCD_UUID)
+        cccd = cccds[0].handle if cccds else DEFAULT_CCCD_HANDLE
+        return GattHandles(tx=tx.getHandle(), rx=rx.getHandle(), cccd=cccd)
+
+    # Turns on notification of RX characteristic changes.
+    def _subscribe(self, handles):
+        logger.debug("Subscribing to RX characteristic changes...")
+        self.conn.writeCharacteristic(
+            handle=handles.cccd, val=struct.pack("<bb", 0x01, 0x00), withResponse=True
+        )
+
+    # Context manager timing a connection phase in self.metrics.
+    def _timed(self, phase):
+        if self.metrics is None:
+            return contextlib.nullcontext()
+        return self.metrics.time(phase, self.address)
+
+    # Exchanges the ATT MTU and returns the negotiated value. bluepy allows one exchange
+    #   per connection; on failure the default MTU stays in effect.
+    def _negotiate_mtu(self):
+        try:
+            response = self.conn.setMTU(self.requested_mtu)
+            return response["mtu"][0]
+        except BTLEDisconnectError:
+            raise
+        except (BTLEException, KeyError, IndexError) as err:
+            logger.debug("MTU exchange failed: {}".format(err))
+            return ATT_DEFAULT_MTU
 
     # Implements BadgeConnection's connect() spec.
+    #   Handles cached for this badge are used directly; discovery only runs for unknown
+    #   badges or when subscribing through the cached handles fails. The MTU exchange is
+    #   skipped for badges known to only support the default MTU.
+    #   If setting up the link fails, it is closed before the error is raised, so that the
+    #   badge does not stay connected (and silent) with nobody using the link.
     def connect(self):
         logger.debug("Connecting...")
-        self.conn = Peripheral2(self.ble_device, btle.ADDR_TYPE_RANDOM)
+        with self._timed("connect"):
+            self.conn = self.peripheral_class(self.ble_device, btle.ADDR_TYPE_RANDOM, self.iface)
+        try:
+            self._set_up()
+        except BaseException:
+            conn, self.conn = self.conn, None
+            try:
+                conn.disconnect()
+            except Exception as err:
+                logger.debug("Error while disconnecting from {}: {}".format(self.address, err))
+            raise
+
+    # Subscribes to the RX characteristic and exchanges the MTU on a new link.
+    def _set_up(self):
+        self.conn.setDelegate(SimpleDelegate(bleconn=self))
 
         logger.debug("Connected.")
 
-        # Find the UART service and its characteristics.
-        self.uart = self.conn.getServiceByUUID(UART_SERVICE_UUID)
-        self.rx = self.uart.getCharacteristics(RX_CHAR_UUID)[0]
-        self.tx = self.uart.getCharacteristics(TX_CHAR_UUID)[0]
-
-        # Turn on notification of RX characteristics
-        logger.debug("Subscribing to RX characteristic changes...")
-        CONFIG_HANDLE = 0x0013
-        # was wrong 0x000c
-        self.conn.writeCharacteristic(
-            handle=CONFIG_HANDLE, val=struct.pack("<bb", 0x01, 0x00)
-        )
-        self.conn.setDelegate(SimpleDelegate(bleconn=self))
+        handles = None
+        if self.handle_cache is not None:
+            handles = self.handle_cache.get(self.ble_device)
+        if handles is not None:
+            try:
+                with self._timed("cccd"):
+                    self._subscribe(handles)
+            except BTLEDisconnectError:
+                raise
+            except BTLEException as err:
+                logger.debug("Cached handles {} failed: {}".format(handles, err))
+                self.handle_cache.invalidate(self.ble_device)
+                handles = None
+        if handles is None:
+            with self._timed("discovery"):
+                handles = self._discover_handles()
+            with self._timed("cccd"):
+                self._subscribe(handles)
+
+        self.mtu = ATT_DEFAULT_MTU
+        if handles.mtu != ATT_DEFAULT_MTU and self.requested_mtu > ATT_DEFAULT_MTU:
+            with self._timed("mtu"):
+                self.mtu = self._negotiate_mtu()
+            handles = handles._replace(mtu=self.mtu)
+        logger.debug("Using ATT MTU {}".format(self.mtu))
+        if self.handle_cache is not None:
+            self.handle_cache.put(self.ble_device, handles)
+        self.handles = handles
 
     # Implements BadgeConnections's disconnect() spec.
     def disconnect(self):
 
-        self.uart = None
-        self.tx = None
-        self.rx = None
+        self.handles = None
 
-        with self.rx_queue.mutex:
-            self.rx_queue.queue.clear()
+        self.clear_received()
 
         # self.ble_device.disconnect()
         self.conn.disconnect()
@@ -139,38 +305,50 @@ class BLEBadgeConnection(BadgeConnection):
         else:
             return True
 
+    # Returns whether the BLE link is still up, asking the bluepy helper for its state.
+    def is_alive(self):
+        if not self.is_connected() or self.conn is None:
+            return False
+        try:
+            return self.conn.getState() == "conn"
+        except BTLEException:
+            return False
+
     # Implements BadgeConnection's await_data() spec.
-    def await_data(self, data_len):
+    def await_data(self, data_len, timeout=None):
         if not self.is_connected():
             raise RuntimeError("BLEBadgeConnection not connected before await_data()!")
 
-        rx_message = b""
-        rx_bytes_expected = data_len
+        if data_len > 0:
+            return self._receive(data_len, timeout)
 
-        if rx_bytes_expected > 0:
-            while True:
-                while not self.rx_queue.empty():
-                    rx_message += self.rx_queue.get().to_bytes(1, byteorder="big")
-                    if len(rx_message) == rx_bytes_expected:
-                        return rx_message
+    # Implements BadgeConnection's receive_available() spec: returns the notifications
+    #   received so far as one chunk.
+    def receive_available(self, timeout=None):
+        if not self.is_connected():
+            raise RuntimeError("BLEBadgeConnection not connected before receive_available()!")
 
-                self.conn.waitForNotifications(5.0)
+        return self._receive(None, timeout)
 
     # Implements BadgeConnection's send() spec.
-    def send(self, message, response_len=0):
+    #   The message is split into writes of at most MTU - 3 bytes, which the firmware
+    #   reassembles in its receive FIFO.
+    def send(self, message, response_len=0, timeout=None, acknowledged=True):
         if not self.is_connected():
             raise RuntimeError("BLEBadgeConnection not connected before send()!")
 
-        rx_message = b""
-        rx_bytes_expected = response_len
-
-        self.tx.write(message, withResponse=True)
-
-        if rx_bytes_expected > 0:
-            while True:
-                while not self.rx_queue.empty():
-                    rx_message += self.rx_queue.get().to_bytes(1, byteorder="big")
-                    if len(rx_message) == rx_bytes_expected:
-                        return rx_message
-
-                self.conn.waitForNotifications(5.0)
+        payload_size = self.mtu - ATT_WRITE_HEADER_SIZE
+        with _badge_errors(self.address):
+            if len(message) <= payload_size:
+                self.conn.writeCharacteristic(self.handles.tx, message, withResponse=acknowledged)
+            else:
+                view = memoryview(message)
+                for offset in range(0, len(view), payload_size):
+                    self.conn.writeCharacteristic(
+                        self.handles.tx,
+                        view[offset : offset + payload_size],
+                        withResponse=acknowledged,
+                    )
+
+        if response_len > 0:
+            return self._receive(response_len, timeout)
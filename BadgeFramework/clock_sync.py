@@ -0,0 +1,212 @@
+from __future__ import annotations
+import json
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, NamedTuple, Optional
+
+from badge import OpenBadge, timestamps_to_time
+from badge_metrics import write_atomically
+
+logger = logging.getLogger(__name__)
+
+# Status exchanges of one clock sync. Each sets the badge clock, and the best one (the
+#   shortest round trip) gives the latency the later ones compensate for.
+DEFAULT_SYNC_EXCHANGES = 4
+# An exchange whose round trip is at most this many times the best one sets the clock about
+#   as well; a sync whose last exchange was slower goes on, for up to as many exchanges again.
+ACCEPTABLE_RTT_RATIO = 1.25
+# Seconds between two syncs below which their time_delta is too coarse (whole milliseconds)
+#   to estimate the drift from, and the weight of the newest estimate in the running average.
+MIN_DRIFT_SECONDS = 60.0
+DRIFT_SMOOTHING = 0.5
+# Badges truncate timestamps to whole milliseconds; adding half of one rounds them instead.
+HALF_MILLISECOND = 0.0005
+
+
+# One status exchange: the host time the request was sent at, its round trip, the offset of
+#   the badge clock (badge minus host) it measured before setting the clock, the offset it
+#   left the clock with, all in seconds, and the response.
+class ClockSample(NamedTuple):
+    sent: float
+    rtt: float
+    offset_before: float
+    offset_after: float
+    status: Any
+
+
+# What is known about the clock of one badge after its last sync: the offset it was left
+#   with and its uncertainty (half the round trip of the exchange that set it), the best
+#   round trip of the sync, the drift (ppm, positive when the badge runs fast), and the host
+#   time of the sync. `status` is the StatusResponse of the last exchange.
+class ClockEstimate(object):
+    __slots__ = (
+        "address", "offset", "uncertainty", "rtt", "drift_ppm", "synced_at", "syncs", "status"
+    )
+
+    def __init__(self, address):
+        self.address = address
+        self.offset = 0.0
+        self.uncertainty = 0.0
+        self.rtt = None
+        self.drift_ppm = None
+        self.synced_at = None
+        self.syncs = 0
+        self.status = None
+
+    # One-way latency to compensate for, estimated as half the best round trip.
+    @property
+    def latency(self):
+        return self.rtt / 2 if self.rtt is not None else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "offset_ms": round(self.offset * 1000, 3),
+            "uncertainty_ms": round(self.uncertainty * 1000, 3),
+            "rtt_ms": round(self.rtt * 1000, 3) if self.rtt is not None else None,
+            "drift_ppm": round(self.drift_ppm, 2) if self.drift_ppm is not None else None,
+            "synced_at": self.synced_at,
+            "syncs": self.syncs,
+        }
+
+
+# Sends a status request setting the badge clock to the host time plus `latency`, the
+#   expected time for the request to reach the badge, and returns the ClockSample. The host
+#   time is taken right before the request is written, so the wait for the reader thread to
+#   write it counts neither in the timestamp nor in the round trip.
+# The response carries the badge clock when the request was received, before it was set
+#   (request_handler_lib.c), which the host reached half a round trip after sending,
+#   assuming both directions take as long.
+def exchange(
+    badge: OpenBadge,
+    latency: float = 0.0,
+    clock: Callable[[], float] = time.time,
+    **status_options,
+) -> ClockSample:
+    written = []
+
+    def stamp():
+        written.append((time.perf_counter(), clock()))
+        return written[-1][1] + latency + HALF_MILLISECOND
+
+    status = badge.get_status(t=stamp, **status_options)
+    start, sent = written[-1]
+    rtt = time.perf_counter() - start
+    received = sent + rtt / 2
+    badge_time = timestamps_to_time(status.timestamp.seconds, status.timestamp.ms)
+    return ClockSample(
+        sent, rtt, badge_time + HALF_MILLISECOND - received, sent + latency - received, status
+    )
+
+
+# ClockSynchroniser sets badge clocks like NTP sets a computer's: synchronise() runs a few
+#   status exchanges, each compensating for the one-way latency of the best round trip seen
+#   so far (starting from the best of the badge's last sync), and keeps going while the last
+#   exchange was much slower than the best, since the last exchange is the one that leaves
+#   the badge clock set.
+# The offset the first exchange measures is where the badge clock strayed to since the last
+#   sync; over more than MIN_DRIFT_SECONDS it gives the drift of the badge. Estimates are
+#   kept per MAC address in `estimates`.
+class ClockSynchroniser(object):
+    def __init__(
+        self,
+        exchanges: int = DEFAULT_SYNC_EXCHANGES,
+        clock: Callable[[], float] = time.time,
+    ):
+        if exchanges < 1:
+            raise ValueError("ClockSynchroniser needs at least one exchange")
+        self.exchanges = exchanges
+        self.clock = clock
+        # address -> ClockEstimate
+        self.estimates = {}
+        self.lock = threading.Lock()
+
+    def estimate(self, address: str) -> Optional[ClockEstimate]:
+        with self.lock:
+            return self.estimates.get(address.lower())
+
+    # Syncs the clock of `badge` (and sets its ID and group with `new_id` and
+    #   `new_group_number`, see OpenBadge.get_status) and returns its updated ClockEstimate.
+    def synchronise(
+        self,
+        badge: OpenBadge,
+        new_id: Optional[int] = None,
+        new_group_number: Optional[int] = None,
+        timeout: Optional[float] = None,
+    ) -> ClockEstimate:
+        address = (badge.address or "").lower()
+        with self.lock:
+            estimate = self.estimates.get(address)
+            if estimate is None:
+                estimate = self.estimates[address] = ClockEstimate(address)
+            best_rtt = estimate.rtt
+        first = best = last = None
+        for count in range(1, 2 * self.exchanges + 1):
+            latency = best_rtt / 2 if best_rtt is not None else 0.0
+            last = exchange(
+                badge,
+                latency,
+                self.clock,
+                new_id=new_id,
+                new_group_number=new_group_number,
+                timeout=timeout,
+            )
+            if first is None:
+                first = last
+            if best is None or last.rtt < best.rtt:
+                best = last
+            best_rtt = best.rtt
+            if count >= self.exchanges and last.rtt <= ACCEPTABLE_RTT_RATIO * best.rtt:
+                break
+
+        with self.lock:
+            self._update_drift(estimate, first)
+            estimate.offset = last.offset_after
+            estimate.uncertainty = last.rtt / 2
+            estimate.rtt = best.rtt
+            estimate.synced_at = last.sent
+            estimate.syncs += 1
+            estimate.status = last.status
+        logger.debug(
+            "Synced {} in {} exchanges: offset {:+.1f} ms (+-{:.1f} ms), drift {}.".format(
+                address,
+                count,
+                estimate.offset * 1000,
+                estimate.uncertainty * 1000,
+                "unknown" if estimate.drift_ppm is None
+                else "{:+.1f} ppm".format(estimate.drift_ppm),
+            )
+        )
+        return estimate
+
+    # A time_delta of 0 means the badge clock was not set since the badge booted (or, rarely,
+    #   that it kept within a millisecond), so its offset says nothing about the drift.
+    def _update_drift(self, estimate, first):
+        if estimate.synced_at is None or not first.status.time_delta:
+            return
+        elapsed = first.sent - estimate.synced_at
+        if elapsed < MIN_DRIFT_SECONDS:
+            return
+        strayed = first.offset_before - estimate.offset
+        drift_ppm = strayed / elapsed * 1e6
+        if estimate.drift_ppm is not None:
+            drift_ppm = estimate.drift_ppm + DRIFT_SMOOTHING * (drift_ppm - estimate.drift_ppm)
+        estimate.drift_ppm = drift_ppm
+
+    # Notes that the clock of `address` was set outside synchronise(), e.g. by start
+    #   requests, so that the next sync does not take the jump for drift.
+    def clock_was_set(self, address: str):
+        with self.lock:
+            estimate = self.estimates.get(address.lower())
+            if estimate is not None:
+                estimate.synced_at = None
+
+    def to_dict(self) -> Dict[str, Dict[str, Any]]:
+        with self.lock:
+            return {
+                address: estimate.to_dict()
+                for address, estimate in sorted(self.estimates.items())
+            }
+
+    def write_json(self, path):
+        write_atomically(path, json.dumps(self.to_dict(), indent=1))
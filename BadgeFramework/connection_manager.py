@@ -0,0 +1,206 @@
+from __future__ import annotations
+import collections
+import logging
+import threading
+import time
+from typing import Callable, Iterable, Optional
+
+from badge_connection import BadgeConnection, BadgeTimeoutError
+
+logger = logging.getLogger(__name__)
+
+# Default number of idle links kept open, and seconds after which an idle link is closed.
+DEFAULT_MAX_CONNECTIONS = 16
+DEFAULT_IDLE_TIMEOUT = 60.0
+
+
+# Opens a BLE connection to the badge at `address`, through adapter hci`iface` if given.
+def connect_to_badge(address: str, iface: Optional[int] = None) -> BadgeConnection:
+    from ble_badge_connection import BLEBadgeConnection
+
+    connection = BLEBadgeConnection.get_connection_to_badge(address, iface=iface)
+    connection.connect()
+    return connection
+
+
+# Default health check: the link is connected and, if the connection can tell, still up.
+def check_connection(connection: BadgeConnection) -> bool:
+    if not connection.is_connected():
+        return False
+    is_alive = getattr(connection, "is_alive", None)
+    return is_alive is None or is_alive()
+
+
+# Raised by acquire() for a badge whose pooled link is held by another caller.
+class ConnectionInUseError(ConnectionError):
+    pass
+
+
+class _PooledConnection(object):
+    __slots__ = ("connection", "in_use", "last_used")
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.in_use = 0
+        self.last_used = time.monotonic()
+
+
+# ConnectionManager keeps live badge connections keyed by MAC address, so repeated rounds
+#   over the same badges reuse their links instead of connecting and discovering services
+#   every time.
+# acquire() returns the pooled link after a health check, or opens a new one; release()
+#   hands it back. At most `max_connections` links are kept: when more are open, the least
+#   recently used idle links are closed, as are links idle for more than `idle_timeout`
+#   seconds. Links in use are never closed, so the pool may briefly exceed its bound.
+# A link is handed to one caller at a time: acquire() raises ConnectionInUseError while it
+#   is held, since bluepy peripherals are not thread safe.
+# Call discard() instead of release() after a failed command, since the link may be broken.
+#   Discarding a link someone still holds (e.g. a worker given up on) only removes it from
+#   the pool; it is closed when its holder hands it back.
+#   A connect attempt given up on passes a `deadline` to acquire(), so that a link it opens
+#   too late is closed instead of pooled, and discards only its own connection.
+class ConnectionManager(object):
+    def __init__(
+        self,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+        connection_factory: Callable[[str], BadgeConnection] = connect_to_badge,
+        health_check: Callable[[BadgeConnection], bool] = check_connection,
+    ):
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.connection_factory = connection_factory
+        self.health_check = health_check
+
+        # address -> _PooledConnection, least recently used first.
+        self.pool = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.pool)
+
+    def __contains__(self, address):
+        with self.lock:
+            return address in self.pool
+
+    # Returns the number of pooled links currently acquired.
+    def in_use(self) -> int:
+        with self.lock:
+            return sum(1 for pooled in self.pool.values() if pooled.in_use)
+
+    # Returns a connected BadgeConnection to the badge at `address`. Raises BadgeTimeoutError
+    #   if a new link is only open after `deadline` (a time.monotonic() time), and
+    #   ConnectionInUseError if the pooled link is held by another caller.
+    def acquire(self, address: str, deadline: Optional[float] = None) -> BadgeConnection:
+        with self.lock:
+            pooled = self.pool.get(address)
+            if pooled is not None:
+                if pooled.in_use:
+                    raise ConnectionInUseError(
+                        "Connection to {} is in use".format(address)
+                    )
+                pooled.in_use = 1
+                self.pool.move_to_end(address)
+        self.prune()
+
+        if pooled is not None:
+            try:
+                healthy = self.health_check(pooled.connection)
+            except Exception as err:
+                logger.debug("Health check for {} failed: {}".format(address, err))
+                healthy = False
+            if healthy:
+                logger.debug("Reusing connection to {}".format(address))
+                return pooled.connection
+            logger.info("Connection to {} is down, reconnecting.".format(address))
+            self.discard(address, pooled.connection)
+
+        connection = self.connection_factory(address)
+        if deadline is not None and time.monotonic() > deadline:
+            self._close(address, connection)
+            raise BadgeTimeoutError("Connecting to {} took too long".format(address))
+        pooled = _PooledConnection(connection)
+        pooled.in_use = 1
+        with self.lock:
+            replaced = self.pool.pop(address, None)
+            self.pool[address] = pooled
+        if replaced is not None and not replaced.in_use:
+            self._close(address, replaced.connection)
+        self.prune()
+        return connection
+
+    # Hands the connection to `address` back to the pool. With `connection`, only that
+    #   connection is handed back; it is closed if it is no longer the pooled one.
+    def release(self, address: str, connection: Optional[BadgeConnection] = None):
+        with self.lock:
+            pooled = self.pool.get(address)
+            if connection is not None and pooled is not None:
+                if pooled.connection is not connection:
+                    pooled = None
+            if pooled is not None:
+                pooled.in_use = 0
+                pooled.last_used = time.monotonic()
+        if pooled is None:
+            if connection is not None:
+                self._close(address, connection)
+            return
+        # Bytes left over from an abandoned command would corrupt the next response.
+        clear_received = getattr(pooled.connection, "clear_received", None)
+        if clear_received is not None:
+            clear_received()
+        self.prune()
+
+    # Removes the connection to `address` from the pool and closes it, unless it is in use:
+    #   its holder closes it by handing it back. With `connection`, only that connection is
+    #   closed, and removed from the pool if it is the pooled one.
+    def discard(self, address: str, connection: Optional[BadgeConnection] = None):
+        with self.lock:
+            pooled = self.pool.get(address)
+            if pooled is not None and (connection is None or pooled.connection is connection):
+                del self.pool[address]
+            else:
+                pooled = None
+        if connection is not None:
+            self._close(address, connection)
+        elif pooled is not None and not pooled.in_use:
+            self._close(address, pooled.connection)
+        elif pooled is not None:
+            logger.debug("Dropped connection to {} from the pool while in use".format(address))
+
+    # Closes the links idle for longer than idle_timeout, then the least recently used
+    #   idle links until at most max_connections remain.
+    def prune(self):
+        now = time.monotonic()
+        closing = []
+        with self.lock:
+            for address, pooled in list(self.pool.items()):
+                if pooled.in_use == 0 and now - pooled.last_used > self.idle_timeout:
+                    closing.append((address, self.pool.pop(address).connection))
+            excess = len(self.pool) - self.max_connections
+            for address, pooled in list(self.pool.items()):
+                if excess <= 0:
+                    break
+                if pooled.in_use == 0:
+                    closing.append((address, self.pool.pop(address).connection))
+                    excess -= 1
+        for address, connection in closing:
+            self._close(address, connection)
+
+    # Closes every pooled link except those to the addresses in `keep`.
+    def close_all(self, keep: Iterable[str] = ()):
+        keep = set(keep)
+        with self.lock:
+            closing = [item for item in self.pool.items() if item[0] not in keep]
+            for address, _ in closing:
+                del self.pool[address]
+        for address, pooled in closing:
+            self._close(address, pooled.connection)
+
+    def _close(self, address, connection):
+        logger.debug("Closing connection to {}".format(address))
+        try:
+            if connection.is_connected():
+                connection.disconnect()
+        except Exception as err:
+            logger.debug("Error while disconnecting from {}: {}".format(address, err))
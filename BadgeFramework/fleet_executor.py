@@ -0,0 +1,208 @@
+from __future__ import annotations
+import collections
+import logging
+import threading
+import time
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+
+from badge_connection import BadgeTimeoutError
+
+logger = logging.getLogger(__name__)
+
+# Default number of badges handled at the same time, and seconds one badge may take.
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_BADGE_TIMEOUT = 60.0
+
+
+# Outcome of an operation on one badge: its return value, or the exception it raised.
+class BadgeResult(object):
+    __slots__ = ("participant", "address", "value", "error", "seconds")
+
+    def __init__(self, participant, address, value=None, error=None, seconds=0.0):
+        self.participant = participant
+        self.address = address
+        self.value = value
+        self.error = error
+        self.seconds = seconds
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def timed_out(self):
+        return isinstance(self.error, TimeoutError)
+
+    def __repr__(self):
+        outcome = "ok" if self.ok else repr(self.error)
+        return "BadgeResult({}, {}, {}, {:.3f}s)".format(
+            self.participant, self.address, outcome, self.seconds
+        )
+
+
+# Aggregated results of one operation run over a fleet, in the order the badges were given.
+class FleetReport(object):
+    def __init__(self, name: str, results: List[BadgeResult], seconds: float):
+        self.name = name
+        self.results = results
+        self.seconds = seconds
+
+    @property
+    def succeeded(self):
+        return [result for result in self.results if result.ok]
+
+    @property
+    def failed(self):
+        return [result for result in self.results if not result.ok]
+
+    @property
+    def timed_out(self):
+        return [result for result in self.results if result.timed_out]
+
+    def summary(self):
+        failed = self.failed
+        timed_out = len(self.timed_out)
+        lines = [
+            "{}: {} of {} midges succeeded in {:.1f}s ({} failed, {} timed out).".format(
+                self.name,
+                len(self.results) - len(failed),
+                len(self.results),
+                self.seconds,
+                len(failed) - timed_out,
+                timed_out,
+            )
+        ]
+        for result in failed:
+            lines.append(
+                "  midge {} ({}): {}".format(result.participant, result.address, result.error)
+            )
+        return "\n".join(lines)
+
+
+# One run of run_on_fleet(). Workers take badges from `todo` until it is empty. A badge
+#   running for longer than `timeout` is reported as timed out and its worker abandoned:
+#   the blocking call cannot be interrupted, so a new worker takes its place and the
+#   abandoned one exits once the call returns, dropping its late result.
+class _FleetRun(object):
+    def __init__(self, badges, operation, max_workers, timeout, on_timeout):
+        self.operation = operation
+        self.on_timeout = on_timeout
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.badges = badges
+        self.todo = collections.deque(enumerate(badges))
+        self.results = [None] * len(badges)
+        self.remaining = len(badges)
+        # index of each running badge -> time.monotonic() when it was started.
+        self.running = {}
+        self.condition = threading.Condition()
+
+    def _start_worker(self):
+        threading.Thread(target=self._work, name="fleet-worker", daemon=True).start()
+
+    def _next(self):
+        with self.condition:
+            if not self.todo:
+                return None
+            index, badge = self.todo.popleft()
+            self.running[index] = time.monotonic()
+            # run() waits without a deadline while no badge is running.
+            self.condition.notify()
+            return index, badge
+
+    def _work(self):
+        claimed = self._next()
+        while claimed is not None:
+            index, (participant, address) = claimed
+            start = time.monotonic()
+            value = error = None
+            try:
+                value = self.operation(participant, address)
+            except Exception as err:
+                error = err
+            seconds = time.monotonic() - start
+            with self.condition:
+                if self.running.pop(index, None) is None:
+                    # Timed out: a replacement worker took over.
+                    logger.debug("Dropping late result for {}".format(address))
+                    return
+                self.results[index] = BadgeResult(participant, address, value, error, seconds)
+                self.remaining -= 1
+                self.condition.notify()
+            claimed = self._next()
+
+    # Reports the badges running for longer than the timeout as timed out and returns their
+    #   (participant, address) pairs. Called with the condition held.
+    def _expire(self, now):
+        expired = []
+        for index, start in list(self.running.items()):
+            if now - start < self.timeout:
+                continue
+            del self.running[index]
+            participant, address = self.badges[index]
+            self.results[index] = BadgeResult(
+                participant,
+                address,
+                error=BadgeTimeoutError(
+                    "No result from {} within {:.1f}s".format(address, self.timeout)
+                ),
+                seconds=now - start,
+            )
+            self.remaining -= 1
+            expired.append((participant, address))
+            if self.todo:
+                self._start_worker()
+        return expired
+
+    # on_timeout() runs without the condition held, so that a slow cleanup (e.g. closing a
+    #   link) does not hold up the workers reporting their results.
+    def _clean_up(self, participant, address):
+        try:
+            self.on_timeout(participant, address)
+        except Exception as err:
+            logger.debug("Cleanup after timeout of {} failed: {}".format(address, err))
+
+    def run(self):
+        with self.condition:
+            for _ in range(min(self.max_workers, len(self.todo))):
+                self._start_worker()
+        while True:
+            expired = []
+            with self.condition:
+                if not self.remaining:
+                    break
+                if self.timeout is not None:
+                    expired = self._expire(time.monotonic())
+                if not expired and self.remaining:
+                    wait = None
+                    if self.timeout is not None and self.running:
+                        wait = max(
+                            0.0, min(self.running.values()) + self.timeout - time.monotonic()
+                        )
+                    self.condition.wait(wait)
+            if self.on_timeout is not None:
+                for participant, address in expired:
+                    self._clean_up(participant, address)
+        return self.results
+
+
+# Runs operation(participant, address) for every (participant, address) pair in `badges`,
+#   on at most `max_workers` badges at a time, and returns a FleetReport.
+# An operation raising an exception fails only its own badge. An operation still running
+#   after `timeout` seconds (None for no limit) is reported as timed out and left behind,
+#   so the remaining badges do not wait for it; the operation itself should still give up
+#   eventually, e.g. through the connection timeouts. on_timeout(participant, address) is
+#   then called, e.g. to drop the link the abandoned operation holds from its pool.
+def run_on_fleet(
+    badges: Iterable[Tuple[Any, str]],
+    operation: Callable[[Any, str], Any],
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    timeout: Optional[float] = DEFAULT_BADGE_TIMEOUT,
+    name: str = "fleet operation",
+    on_timeout: Optional[Callable[[Any, str], None]] = None,
+) -> FleetReport:
+    if max_workers < 1:
+        raise ValueError("max_workers must be at least 1")
+    start = time.monotonic()
+    results = _FleetRun(list(badges), operation, max_workers, timeout, on_timeout).run()
+    return FleetReport(name, results, time.monotonic() - start)
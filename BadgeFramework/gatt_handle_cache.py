@@ -0,0 +1,82 @@
+from __future__ import annotations
+import json
+import logging
+import os
+import threading
+from typing import NamedTuple, Optional
+
+from badge_metrics import write_atomically
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = os.path.join(
+    os.path.expanduser("~"), ".cache", "midge", "gatt_handles.json"
+)
+
+
+# ATT handles of the UART service of one badge: the TX and RX characteristic values and
+#   the RX client characteristic configuration descriptor (CCCD), together with the ATT MTU
+#   last negotiated with it (0 until the first exchange).
+class GattHandles(NamedTuple):
+    tx: int
+    rx: int
+    cccd: int
+    mtu: int = 0
+
+
+# GattHandleCache remembers the handles discovered for each MAC address, in memory and in
+#   a JSON file at `path` (None keeps them in memory only), so reconnecting to a known badge
+#   does not need service and descriptor discovery.
+# The file is read on first use and rewritten atomically on every change; a missing or
+#   corrupt file is treated as empty.
+class GattHandleCache(object):
+    def __init__(self, path: Optional[str] = DEFAULT_CACHE_PATH):
+        self.path = path
+        self.handles = None
+        self.lock = threading.Lock()
+
+    def _load(self):
+        if self.handles is not None:
+            return
+        self.handles = {}
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                stored = json.load(f)
+            for address, handles in stored.items():
+                self.handles[address.lower()] = GattHandles(**handles)
+        except (OSError, ValueError, TypeError) as err:
+            logger.warning("Ignoring GATT handle cache {}: {}".format(self.path, err))
+            self.handles = {}
+
+    def _save(self):
+        if self.path is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            write_atomically(
+                self.path,
+                json.dumps({a: h._asdict() for a, h in self.handles.items()}, indent=1),
+            )
+        except OSError as err:
+            logger.warning("Could not write GATT handle cache {}: {}".format(self.path, err))
+
+    def get(self, address: str) -> Optional[GattHandles]:
+        with self.lock:
+            self._load()
+            return self.handles.get(address.lower())
+
+    def put(self, address: str, handles: GattHandles):
+        with self.lock:
+            self._load()
+            if self.handles.get(address.lower()) == handles:
+                return
+            self.handles[address.lower()] = handles
+            self._save()
+
+    def invalidate(self, address: str):
+        with self.lock:
+            self._load()
+            if self.handles.pop(address.lower(), None) is not None:
+                self._save()
@@ -0,0 +1,448 @@
+#! /usr/bin/python3
+import argparse
+import os
+import struct
+
+from badge_protocol_schema import MESSAGES, SCALAR_FORMATS, UNIONS
+
+# Rebuilds badge_protocol.py from the declarative schema in badge_protocol_schema.py.
+#
+#   python generate_badge_protocol.py                 (overwrites badge_protocol.py)
+#   python generate_badge_protocol.py -o other.py     (e.g. to benchmark against the current module)
+#
+# Every message becomes a __slots__ class. Fixed-layout messages get one precompiled
+# struct.Struct covering all (nested) fields and a NumPy dtype for decoding arrays of
+# records; unions keep a single active-value slot. The per-field encode_<field> and
+# decode_<field> methods of the original hand-written module are kept for code that
+# (de)serialises one field at a time.
+
+HEADER = """\
+# Generated by generate_badge_protocol.py from badge_protocol_schema.py.
+# Do not edit by hand: change the schema and regenerate.
+import struct
+
+"""
+
+RUNTIME = """\
+_which_struct = struct.Struct('<B')
+
+class _Ostream:
+	__slots__ = ('buf', 'offset')
+	def __init__(self, buf, offset=0):
+		self.buf = buf
+		self.offset = offset
+	def write(self, data):
+		end = self.offset + len(data)
+		if(end > len(self.buf)):
+			raise Exception("Not enough space in Ostream to write")
+		self.buf[self.offset:end] = data
+		self.offset = end
+	def pack(self, s, *values):
+		end = self.offset + s.size
+		if(end > len(self.buf)):
+			raise Exception("Not enough space in Ostream to write")
+		s.pack_into(self.buf, self.offset, *values)
+		self.offset = end
+
+class _Istream:
+	__slots__ = ('buf', 'offset')
+	def __init__(self, buf, offset=0):
+		self.buf = memoryview(buf)
+		self.offset = offset
+	def read(self, l):
+		end = self.offset + l
+		if(end > len(self.buf)):
+			raise Exception("Not enough bytes in Istream to read")
+		ret = self.buf[self.offset:end]
+		self.offset = end
+		return ret
+	def unpack(self, s):
+		end = self.offset + s.size
+		if(end > len(self.buf)):
+			raise Exception("Not enough bytes in Istream to read")
+		ret = s.unpack_from(self.buf, self.offset)
+		self.offset = end
+		return ret
+
+def _union_option(tag):
+	def fget(self):
+		return self._value if self.which == tag else None
+	def fset(self, value):
+		self.which = tag
+		self._value = value
+	return property(fget, fset)
+
+class _Message:
+	__slots__ = ()
+
+	# numpy.dtype spec of fixed-layout messages, materialised by numpy_dtype().
+	_dtype_spec = None
+	_dtype = None
+
+	def __init__(self):
+		self.reset()
+
+	def __repr__(self):
+		return str({name: getattr(self, name) for name in self.__slots__})
+
+	def encode(self):
+		buf = bytearray(self.length())
+		self.encode_into(buf)
+		return bytes(buf)
+
+	def encode_into(self, buf, offset=0):
+		ostream = _Ostream(buf, offset)
+		self.encode_internal(ostream)
+		return ostream.offset
+
+	@classmethod
+	def decode(cls, buf):
+		obj = cls()
+		obj.decode_internal(_Istream(buf))
+		return obj
+
+	@classmethod
+	def decode_from(cls, buf, offset=0):
+		obj = cls()
+		obj.decode_internal(_Istream(buf, offset))
+		return obj
+
+	# Structured NumPy dtype matching the wire layout of a fixed-layout message.
+	@classmethod
+	def numpy_dtype(cls):
+		if cls._dtype is None:
+			if cls._dtype_spec is None:
+				raise TypeError(cls.__name__ + " has no fixed layout")
+			import numpy
+			cls._dtype = numpy.dtype(cls._dtype_spec)
+		return cls._dtype
+
+	# Decodes `count` consecutive records (all complete records if -1) starting at `offset`
+	# into a structured array in a single numpy.frombuffer call, without copying `buf`.
+	# Fields are available as columns, e.g. decode_array(buf)['rssi'].
+	@classmethod
+	def decode_array(cls, buf, offset=0, count=-1):
+		import numpy
+		dtype = cls.numpy_dtype()
+		if count == -1:
+			count = (len(memoryview(buf).cast('B')) - offset) // dtype.itemsize
+		return numpy.frombuffer(buf, dtype=dtype, count=count, offset=offset)
+
+"""
+
+
+class Generator:
+    def __init__(self, messages, unions):
+        self.messages = {m.name: m for m in messages}
+        self.message_order = [m.name for m in messages]
+        self.unions = unions
+
+    def is_scalar(self, field):
+        return field.type in SCALAR_FORMATS
+
+    def is_fixed(self, message):
+        return all(
+            not f.optional and (self.is_scalar(f) or self.is_fixed(self.messages[f.type]))
+            for f in message.fields
+        )
+
+    # Struct format (without byte-order prefix) of the fixed fields of a message,
+    # with nested messages flattened in.
+    def flat_format(self, fields):
+        fmt = ""
+        for f in fields:
+            if self.is_scalar(f):
+                fmt += SCALAR_FORMATS[f.type]
+            else:
+                fmt += self.flat_format(self.messages[f.type].fields)
+        return fmt
+
+    # Expressions reading every leaf value of `fields` off `owner`, in wire order.
+    def flat_values(self, fields, owner):
+        values = []
+        for f in fields:
+            if self.is_scalar(f):
+                values.append(f"{owner}.{f.name}")
+            else:
+                values += self.flat_values(self.messages[f.type].fields, f"{owner}.{f.name}")
+        return values
+
+    # Temporary names receiving the leaf values of a nested field when unpacking.
+    def flat_targets(self, fields, prefix):
+        targets = []
+        for f in fields:
+            if self.is_scalar(f):
+                targets.append(prefix + f.name)
+            else:
+                targets += self.flat_targets(self.messages[f.type].fields, prefix + f.name + "_")
+        return targets
+
+    # Expression rebuilding a nested message from the temporaries of flat_targets().
+    def construct(self, message, prefix):
+        args = []
+        for f in message.fields:
+            if self.is_scalar(f):
+                args.append(prefix + f.name)
+            else:
+                args.append(self.construct(self.messages[f.type], prefix + f.name + "_"))
+        return f"{message.name}._from_fields({', '.join(args)})"
+
+    # numpy.dtype spec of the fixed fields of a message, nested messages as sub-dtypes.
+    def dtype_fields(self, fields):
+        spec = []
+        for f in fields:
+            if self.is_scalar(f):
+                spec.append((f.name, "<" + SCALAR_FORMATS[f.type]))
+            else:
+                spec.append((f.name, self.dtype_fields(self.messages[f.type].fields)))
+        return spec
+
+    def split_fields(self, message):
+        fixed = [f for f in message.fields if not f.optional]
+        optional = [f for f in message.fields if f.optional]
+        if optional:
+            assert message.fields[-len(optional):] == optional, (
+                f"{message.name}: optional fields must come last"
+            )
+            assert len(optional) == 1, f"{message.name}: only one optional field is supported"
+            assert not self.is_scalar(optional[0]), f"{message.name}: optional fields must be messages"
+        return fixed, optional
+
+    def gen_message(self, message):
+        fixed, optional = self.split_fields(message)
+        out = [f"class {message.name}(_Message):\n\n"]
+
+        slots = []
+        for f in message.fields:
+            if f.optional:
+                slots.append(f"has_{f.name}")
+            slots.append(f.name)
+        slots_tuple = ", ".join(repr(s) for s in slots) + ("," if len(slots) == 1 else "")
+        out.append(f"\t__slots__ = ({slots_tuple})\n")
+
+        fmt = self.flat_format(fixed) + ("B" if optional else "")
+        if fmt:
+            padding = f"{message.padding}x" if message.padding else ""
+            out.append(f"\t_struct = struct.Struct('<{fmt}{padding}')\n")
+        if fmt and self.is_fixed(message):
+            spec = self.dtype_fields(message.fields)
+            names = [name for name, _ in spec]
+            formats = [field_format for _, field_format in spec]
+            out.append(
+                f"\t_dtype_spec = {{'names': {names!r}, 'formats': {formats!r}, "
+                f"'itemsize': {struct.calcsize('<' + fmt) + message.padding}}}\n"
+            )
+        out.append("\n")
+
+        # reset
+        out.append("\tdef reset(self):\n")
+        for f in message.fields:
+            if f.optional:
+                out.append(f"\t\tself.has_{f.name} = 0\n")
+            default = "0" if self.is_scalar(f) else "None"
+            out.append(f"\t\tself.{f.name} = {default}\n")
+        if not message.fields:
+            out.append("\t\tpass\n")
+        out.append("\n")
+
+        # length
+        out.append("\tdef length(self):\n")
+        if not fmt:
+            out.append("\t\treturn 0\n\n")
+        elif optional:
+            opt = optional[0]
+            out.append(
+                f"\t\treturn self._struct.size + (self.{opt.name}.length() if self.has_{opt.name} else 0)\n\n"
+            )
+        else:
+            out.append("\t\treturn self._struct.size\n\n")
+
+        # encode_internal
+        out.append("\tdef encode_internal(self, ostream):\n")
+        if fmt:
+            values = self.flat_values(fixed, "self")
+            if optional:
+                values.append(f"self.has_{optional[0].name}")
+            out.append(f"\t\tostream.pack(self._struct, {', '.join(values)})\n")
+            if optional:
+                opt = optional[0]
+                out.append(f"\t\tif self.has_{opt.name}:\n")
+                out.append(f"\t\t\tself.{opt.name}.encode_internal(ostream)\n")
+        else:
+            out.append("\t\tpass\n")
+        out.append("\n")
+
+        # encode_<field>
+        for f in message.fields:
+            out.append(f"\tdef encode_{f.name}(self, ostream):\n")
+            if self.is_scalar(f):
+                out.append(
+                    f"\t\tostream.write(struct.pack('<{SCALAR_FORMATS[f.type]}', self.{f.name}))\n\n"
+                )
+            elif f.optional:
+                out.append(f"\t\tostream.write(struct.pack('<B', self.has_{f.name}))\n")
+                out.append(f"\t\tif self.has_{f.name}:\n")
+                out.append(f"\t\t\tself.{f.name}.encode_internal(ostream)\n\n")
+            else:
+                out.append(f"\t\tself.{f.name}.encode_internal(ostream)\n\n")
+
+        # decode_internal
+        out.append("\tdef decode_internal(self, istream):\n")
+        if fmt:
+            targets = []
+            post = []
+            for f in fixed:
+                if self.is_scalar(f):
+                    targets.append(f"self.{f.name}")
+                else:
+                    targets += self.flat_targets(self.messages[f.type].fields, f.name + "_")
+                    post.append(f"\t\tself.{f.name} = {self.construct(self.messages[f.type], f.name + '_')}\n")
+            if optional:
+                targets.append(f"self.has_{optional[0].name}")
+            if len(targets) == 1:
+                out.append(f"\t\t{targets[0]}, = istream.unpack(self._struct)\n")
+            else:
+                out.append(f"\t\t{', '.join(targets)} = istream.unpack(self._struct)\n")
+            out += post
+            if optional:
+                opt = optional[0]
+                out.append(f"\t\tif self.has_{opt.name}:\n")
+                out.append(f"\t\t\tself.{opt.name} = {opt.type}()\n")
+                out.append(f"\t\t\tself.{opt.name}.decode_internal(istream)\n")
+                out.append("\t\telse:\n")
+                out.append(f"\t\t\tself.{opt.name} = None\n")
+        else:
+            out.append("\t\tpass\n")
+        out.append("\n")
+
+        # decode_<field>
+        for f in message.fields:
+            out.append(f"\tdef decode_{f.name}(self, istream):\n")
+            if self.is_scalar(f):
+                size = struct.calcsize("<" + SCALAR_FORMATS[f.type])
+                out.append(
+                    f"\t\tself.{f.name} = struct.unpack('<{SCALAR_FORMATS[f.type]}', istream.read({size}))[0]\n\n"
+                )
+                continue
+            indent = "\t\t"
+            if f.optional:
+                out.append(f"\t\tself.has_{f.name} = struct.unpack('<B', istream.read(1))[0]\n")
+                out.append(f"\t\tself.{f.name} = None\n")
+                out.append(f"\t\tif self.has_{f.name}:\n")
+                indent = "\t\t\t"
+            out.append(f"{indent}self.{f.name} = {f.type}()\n")
+            out.append(f"{indent}self.{f.name}.decode_internal(istream)\n\n")
+
+        # _from_fields, used to rebuild nested fixed-layout messages without __init__
+        if fmt and self.is_fixed(message):
+            names = [f.name for f in message.fields]
+            out.append("\t@classmethod\n")
+            out.append(f"\tdef _from_fields(cls, {', '.join(names)}):\n")
+            out.append("\t\tobj = cls.__new__(cls)\n")
+            for n in names:
+                out.append(f"\t\tobj.{n} = {n}\n")
+            out.append("\t\treturn obj\n\n")
+
+        out.append("\n")
+        return "".join(out)
+
+    def gen_union(self, union):
+        options = "".join(f"\t\t\t{o.tag}: {o.message},\n" for o in union.options)
+        names = "".join(f"\t\t\t{o.tag}: '{o.name}',\n" for o in union.options)
+        props = "".join(f"\t\t{o.name} = _union_option({o.tag})\n" for o in union.options)
+        encoders = "".join(
+            f"\t\tdef encode_{o.name}(self, ostream):\n"
+            f"\t\t\tself.{o.name}.encode_internal(ostream)\n\n"
+            for o in union.options
+        )
+        decoders = "".join(
+            f"\t\tdef decode_{o.name}(self, istream):\n"
+            f"\t\t\tself.{o.name} = {o.message}()\n"
+            f"\t\t\tself.{o.name}.decode_internal(istream)\n\n"
+            for o in union.options
+        )
+        return f"""\
+class {union.name}(_Message):
+
+	__slots__ = ('type',)
+
+	def reset(self):
+		self.type = self._type()
+
+	def length(self):
+		return self.type.length()
+
+	def encode_internal(self, ostream):
+		self.type.encode_internal(ostream)
+
+	def decode_internal(self, istream):
+		self.type.decode_internal(istream)
+
+	class _type:
+
+		__slots__ = ('which', '_value')
+
+		_options = {{
+{options}\
+		}}
+
+		_names = {{
+{names}\
+		}}
+
+		def __init__(self):
+			self.reset()
+
+		def __repr__(self):
+			return str({{'which': self.which, self._names.get(self.which, 'value'): self._value}})
+
+		def reset(self):
+			self.which = 0
+			self._value = None
+
+		def length(self):
+			return _which_struct.size + self._value.length()
+
+		def encode_internal(self, ostream):
+			ostream.pack(_which_struct, self.which)
+			self._value.encode_internal(ostream)
+
+{encoders}\
+		def decode_internal(self, istream):
+			self.which, = istream.unpack(_which_struct)
+			self._value = self._options[self.which]()
+			self._value.decode_internal(istream)
+
+{decoders}\
+{props}
+
+"""
+
+    def generate(self):
+        out = [HEADER]
+        for union in self.unions:
+            for o in union.options:
+                out.append(f"{union.name}_{o.name}_tag = {o.tag}\n")
+            out.append("\n")
+        out.append(RUNTIME)
+        for name in self.message_order:
+            out.append(self.gen_message(self.messages[name]))
+        for union in self.unions:
+            out.append(self.gen_union(union))
+        return "".join(out).rstrip("\n") + "\n"
+
+
+def main():
+    default_output = os.path.join(os.path.dirname(os.path.abspath(__file__)), "badge_protocol.py")
+    parser = argparse.ArgumentParser(description="Generate badge_protocol.py from the protocol schema.")
+    parser.add_argument("-o", "--output", default=default_output, help="path of the generated module")
+    args = parser.parse_args()
+
+    source = Generator(MESSAGES, UNIONS).generate()
+    with open(args.output, "w") as f:
+        f.write(source)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,9 @@ from hub_utilities_V1 import (
     timeout_input,
     choose_function,
     synchronise_and_check_all_devices,
-    get_logger
+    get_logger,
+    scheduler,
+    fleet_monitor
 )
 from hub_connection_V1 import Connection
 
@@ -23,6 +25,9 @@ if __name__ == "__main__":
             logger.info("Connecting to the midges for starting the recordings.")
             start_recording_all_devices(df)
             logger.info("Loop for starting the devices is finished.")
+            # Connected midges do not advertise; the monitor has to hear all of them.
+            scheduler.close_all()
+            fleet_monitor.start()
             while True:
                 ti = timeout_input(poll_period=0.05)
                 s = ti.input(
@@ -47,6 +52,7 @@ if __name__ == "__main__":
                         logger.info("Stopping the recording of all devices.")
                         sys.stdout.flush()
                         stop_recording_all_devices(df)
+                        fleet_monitor.stop()
                         logger.info("Devices are stopped.")
                         sys.stdout.flush()
                         break
@@ -60,7 +66,9 @@ if __name__ == "__main__":
                                     + ' is not found.')
                         continue
                     try:
-                        cur_connection = Connection(int(command), current_mac_addr)
+                        cur_connection = Connection(
+                            int(command), current_mac_addr,
+                            scheduler.manager_for(current_mac_addr))
                     except Exception as error:
                         logger.info("While connecting to midge " + str(command)
                                     + ", following error occurred:" + str(error))
@@ -74,7 +82,7 @@ if __name__ == "__main__":
                         command = sys.stdin.readline()[:-1]
                         command_args = command.split(" ")
                         if command == "exit":
-                            cur_connection.disconnect()
+                            cur_connection.disconnect(discard=True)
                             logger.info("Disconnected from the midge.")
                             break
                         try:
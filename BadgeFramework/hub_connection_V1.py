@@ -1,40 +1,114 @@
 from badge import OpenBadge
-from ble_badge_connection import BLEBadgeConnection
+from clock_sync import ClockSynchroniser
+from badge_connection import BadgeTimeoutError
+from retry_policy import RetryPolicy
+import collections
+import logging
 import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
 
 constant_group_number = 1
 
+# How connecting to a badge is retried: 3 attempts, 0.5s and then 1s apart (up to half of
+#   each delay less, at random), each given up after 15s.
+default_retry_policy = RetryPolicy(attempts=3, base_delay=0.5, attempt_timeout=15.0)
+
+# Keeps the clock offset and drift estimates of the badges synced without a synchroniser of
+#   their own.
+default_clock_synchroniser = ClockSynchroniser()
+
+# One lock per mac address, held while connecting to the badge: an attempt given up on
+#   keeps connecting in the background, and bluepy must not open a second link to the same
+#   badge at the same time.
+_connect_locks = collections.defaultdict(threading.Lock)
+_connect_locks_lock = threading.Lock()
+
 
+def _connect_lock(address):
+    with _connect_locks_lock:
+        return _connect_locks[address.lower()]
+
+
+# Connection to one participant's badge. With a `connection_manager` the BLE link is taken
+#   from (and by disconnect() handed back to) its pool instead of being opened and closed here.
+# With a `connect_timeout`, connecting (all its attempts and the delays between them) gives
+#   up after that many seconds, e.g. to leave the rest of a fleet operation's time to the
+#   requests.
 class Connection:
-    def __init__(self, pid: int, address: str):
+    def __init__(self, pid: int, address: str, connection_manager=None,
+                 retry_policy=None, connect_timeout=None):
+        self.connection_manager = connection_manager
+        self.badge_id = int(pid)
+        self.mac_address = address
+        self.group_number: int = int(constant_group_number)
+        if retry_policy is None:
+            retry_policy = default_retry_policy
+        self.retry_policy = retry_policy
+        self.connect_attempts = 0
+        self.attempts_lock = threading.Lock()
+        self.connect_deadline = None
+        if connect_timeout is not None:
+            self.connect_deadline = time.monotonic() + connect_timeout
         try:
-            for x in range(0, 10):
-                try:
-                    print("START BLUETOOTH CONNECTION")
-                    self.connection = BLEBadgeConnection.get_connection_to_badge(
-                        address
-                    )
-                    self.connection.connect()
-                    self.badge = OpenBadge(self.connection)
-                    self.badge_id = int(pid)
-                    self.mac_address = address
-                    self.group_number: int = int(constant_group_number)
-                    break
-                except Exception as err:
-                    print("GOT EXCEPTION1")
-                    if x == 9:
-                        raise Exception(
-                            "Could not connect to participant "
-                            + str(pid)
-                            + ", error:"
-                            + str(err)
-                        )
-                    break
+            self.connection = retry_policy.call(
+                self._connect,
+                cleanup=self._close_abandoned,
+                description="connecting to participant " + str(pid),
+                deadline=self.connect_deadline,
+            )
         except Exception as err:
-            print("GOT EXCEPTION2")
+            with self.attempts_lock:
+                attempts = self.connect_attempts
+            logger.warning("Giving up on connecting to {} after {} attempts: {}".format(
+                self.mac_address, attempts, err))
             raise Exception(
                 "Could not connect to participant " + str(pid) + ", error:" + str(err)
             )
+        self.badge = OpenBadge(self.connection)
+        self.badge.start_reader()
+
+    # One connect attempt. It waits for an abandoned attempt still connecting to the same
+    #   badge to finish, until its own deadline, rather than connect alongside it.
+    def _connect(self):
+        with self.attempts_lock:
+            self.connect_attempts += 1
+            attempt = self.connect_attempts
+        logger.debug("Connecting to {}, attempt {}".format(self.mac_address, attempt))
+        deadline = self.connect_deadline
+        if self.retry_policy.attempt_timeout is not None:
+            attempt_deadline = time.monotonic() + self.retry_policy.attempt_timeout
+            if deadline is None or attempt_deadline < deadline:
+                deadline = attempt_deadline
+        wait = -1 if deadline is None else max(0.0, deadline - time.monotonic())
+        lock = _connect_lock(self.mac_address)
+        if not lock.acquire(timeout=wait):
+            raise BadgeTimeoutError(
+                "An earlier attempt is still connecting to " + self.mac_address)
+        try:
+            if deadline is not None and time.monotonic() > deadline:
+                raise BadgeTimeoutError(
+                    "An earlier attempt was connecting to " + self.mac_address
+                    + " until this one was given up on")
+            if self.connection_manager is not None:
+                return self.connection_manager.acquire(self.mac_address, deadline)
+            from ble_badge_connection import BLEBadgeConnection
+
+            connection = BLEBadgeConnection.get_connection_to_badge(self.mac_address)
+            connection.connect()
+            return connection
+        finally:
+            lock.release()
+
+    # Closes a connection opened by an attempt that was given up on, leaving alone the link
+    #   a later attempt may have pooled.
+    def _close_abandoned(self, connection):
+        if self.connection_manager is not None:
+            self.connection_manager.discard(self.mac_address, connection)
+        else:
+            connection.disconnect()
 
     def set_id_at_start(self):
         try:
@@ -44,8 +118,31 @@ class Connection:
         except Exception as err:
             raise Exception("Could not set id, error:" + str(err))
 
-    def disconnect(self):
-        self.connection.disconnect()
+    # With a connection manager, keeps the link open for reuse unless `discard` is set
+    #   (e.g. after an error, when the link may be broken).
+    def disconnect(self, discard: bool = False):
+        self.badge.stop_reader()
+        if self.connection_manager is None:
+            self.connection.disconnect()
+        elif discard:
+            self.connection_manager.discard(self.mac_address, self.connection)
+        else:
+            self.connection_manager.release(self.mac_address, self.connection)
+
+    # Syncs the badge clock with round-trip compensated status exchanges and returns its
+    #   ClockEstimate, whose `status` is the badge's last StatusResponse.
+    def synchronise_clock(self, synchroniser=None):
+        if synchroniser is None:
+            synchroniser = default_clock_synchroniser
+        try:
+            return synchroniser.synchronise(self.badge)
+        except Exception as err:
+            raise Exception(
+                "Could not synchronise the clock of participant "
+                + str(self.badge_id)
+                + " , error:"
+                + str(err)
+            )
 
     def handle_status_request(self):
         try:
@@ -166,11 +263,24 @@ class Connection:
                 + str(err)
             )
 
-    def start_recording_all_sensors(self):
-        self.handle_status_request()
-        self.handle_start_scan_request()
-        self.handle_start_microphone_request()
-        self.handle_start_imu_request()
+    # Sends the status and the three start requests back to back and awaits their responses
+    #   together, instead of one round trip after the other.
+    # With `assign_id`, the status request of the pipeline also sets the badge's ID and
+    #   group, saving the round trip of set_id_at_start().
+    def start_recording_all_sensors(self, assign_id: bool = False):
+        try:
+            if assign_id:
+                return self.badge.start_all_sensors(
+                    new_id=self.badge_id, new_group_number=self.group_number
+                )
+            return self.badge.start_all_sensors()
+        except Exception as err:
+            raise Exception(
+                "Could not start all sensors for participant "
+                + str(self.badge_id)
+                + " , error:"
+                + str(err)
+            )
 
     def stop_recording_all_sensors(self):
         self.handle_stop_scan_request()
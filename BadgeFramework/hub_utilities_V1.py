@@ -1,4 +1,11 @@
-from hub_connection_V1 import Connection
+from adapter_scheduler import DEFAULT_WORKERS_PER_ADAPTER, AdapterScheduler
+from badge_metrics import default_recorder
+from badge_advertisement import advertisement_problems
+from badge_scanner import DEFAULT_SCAN_SECONDS, FleetMonitor, scan_for_badges
+from clock_sync import ClockSynchroniser
+from fleet_executor import DEFAULT_BADGE_TIMEOUT
+from retry_policy import CircuitBreaker
+from hub_connection_V1 import Connection, constant_group_number
 import sys
 import tty
 import termios
@@ -22,6 +29,60 @@ def get_logger(name):
 
 
 logger = get_logger("hub_utilities")
+# Reports the midges skipped after the scan on the console as soon as the scan ends.
+get_logger("adapter_scheduler")
+
+# HCI adapters (hciN) the hub talks to the midges through; add one per extra USB dongle.
+hci_interfaces = [0]
+
+# Number of midges the loops below talk to at the same time on each adapter, and seconds
+#   after which they give up on one midge.
+max_concurrent_midges = DEFAULT_WORKERS_PER_ADAPTER
+midge_timeout = DEFAULT_BADGE_TIMEOUT
+# Seconds the loops below spend connecting to a midge at most, retries included, so that
+#   the requests keep the rest of midge_timeout.
+connect_timeout = midge_timeout / 2
+
+# Seconds the loops below scan for advertising midges before connecting, so that midges
+#   out of range or with a dead battery are skipped at once; 0 connects to every midge.
+scan_seconds = DEFAULT_SCAN_SECONDS
+
+# Spreads the midges over the adapters, keeps the BLE links to them open between rounds of
+#   the loops below, and skips the midges that failed the last rounds (retrying them less
+#   and less often).
+scheduler = AdapterScheduler(hci_interfaces, max_concurrent_midges,
+                             circuit_breaker=CircuitBreaker())
+
+# Follows the state the midges advertise while recording, so that synchronise_and_check_
+#   all_devices() only connects to the midges with a problem or due for a clock sync. While
+#   it runs, only the links to midges whose last check found a problem are kept open between
+#   rounds, since connected midges do not advertise and those need connecting again anyway.
+fleet_monitor = FleetMonitor(hci_interfaces)
+# Mac addresses of the midges whose last check found a sensor or its clock not running.
+midges_with_problems = set()
+# Seconds between two clock syncs of a midge, and the battery percentage warned about.
+clock_sync_interval = 300.0
+low_battery_percent = 20
+# Mac address -> time.monotonic() of the last clock sync of the midge.
+last_synced = {}
+# Syncs the midge clocks compensating for the BLE latency, and keeps the offset and drift
+#   estimated for every midge.
+clock_synchroniser = ClockSynchroniser()
+
+# Files the latency histograms of the badge operations are written to after every round.
+metrics_json_path = "badge_metrics.json"
+metrics_prometheus_path = "badge_metrics.prom"
+# File the clock offset and drift estimates of the midges are written to after every round.
+clock_estimates_path = "badge_clocks.json"
+
+
+def export_metrics():
+    try:
+        default_recorder.write_json(metrics_json_path)
+        default_recorder.write_prometheus(metrics_prometheus_path)
+        clock_synchroniser.write_json(clock_estimates_path)
+    except OSError as error:
+        logger.debug("Could not export the badge metrics: " + str(error))
 
 
 def choose_function(connection:Connection, input):
@@ -50,71 +111,175 @@ def choose_function(connection:Connection, input):
         return
 
 
-def start_recording_all_devices(df):
-    for _, row in df.iterrows():
-        current_participant:int = row["Participant Id"]
-        current_mac:str = row["Mac Address"]
-        try:
-            cur_connection = Connection(current_participant, current_mac)
-            cur_connection.set_id_at_start()
-            cur_connection.start_recording_all_sensors()
-            cur_connection.disconnect()
-        except Exception as error:
-            logger.info("Sensors for midge " + str(current_participant)
-                        + " are not started with the following error: " + str(error))
-            continue
+def _midges(df):
+    return [(row["Participant Id"], row["Mac Address"]) for _, row in df.iterrows()]
 
 
-def stop_recording_all_devices(df):
-    for _, row in df.iterrows():
-        current_participant = row["Participant Id"]
-        current_mac = row["Mac Address"]
-        try:
-            cur_connection = Connection(current_participant, current_mac)
-            cur_connection.stop_recording_all_sensors()
-            cur_connection.disconnect()
-        except Exception as error:
-            logger.info("Sensors for midge " + str(current_participant)
-                        + " are not stopped with the following error: " + str(error))
-            continue
+def _run_on_all_devices(midges, operation, name, max_workers, timeout):
+    # The monitor already knows which midges advertise, no need to scan again.
+    scanner = fleet_monitor.scan if fleet_monitor.ready else scan_for_badges
+    with fleet_monitor.paused():
+        report = scheduler.scan_and_run(midges, operation, scan_seconds, scanner,
+                                        name=name, timeout=timeout,
+                                        workers_per_adapter=max_workers)
+        # A connected midge does not advertise, so pooled links would hide healthy midges
+        #   from the monitor and get them reconnected every round.
+        if fleet_monitor.running:
+            scheduler.close_all(keep=midges_with_problems)
+    logger.info(report.summary())
+    sys.stdout.flush()
+    export_metrics()
+    return report
 
 
-def synchronise_and_check_all_devices(df):
-    for _, row in df.iterrows():
-        current_participant = row["Participant Id"]
-        current_mac = row["Mac Address"]
-        try:
-            cur_connection = Connection(current_participant, current_mac)
-        except Exception as error:
-            logger.info(str(error) + ", cannot synchronise.")
-            sys.stdout.flush()
-            continue
-        try:
-            out = cur_connection.handle_status_request()
-            logger.info("Status received for the following midge:"
+def _start_recording(current_participant: int, current_mac: str, connection_manager):
+    try:
+        cur_connection = Connection(current_participant, current_mac,
+                                    connection_manager,
+                                    connect_timeout=connect_timeout)
+    except Exception as error:
+        logger.info("Sensors for midge " + str(current_participant)
+                    + " are not started with the following error: " + str(error))
+        raise
+    try:
+        cur_connection.start_recording_all_sensors(assign_id=True)
+        # The start requests set the clock without latency compensation; sync it last.
+        clock_synchroniser.clock_was_set(current_mac)
+        cur_connection.synchronise_clock(clock_synchroniser)
+        last_synced[current_mac] = time.monotonic()
+        cur_connection.disconnect()
+    except Exception as error:
+        cur_connection.disconnect(discard=True)
+        logger.info("Sensors for midge " + str(current_participant)
+                    + " are not started with the following error: " + str(error))
+        raise
+
+
+def _stop_recording(current_participant, current_mac, connection_manager):
+    try:
+        cur_connection = Connection(current_participant, current_mac,
+                                    connection_manager,
+                                    connect_timeout=connect_timeout)
+    except Exception as error:
+        logger.info("Sensors for midge " + str(current_participant)
+                    + " are not stopped with the following error: " + str(error))
+        raise
+    try:
+        cur_connection.stop_recording_all_sensors()
+        cur_connection.disconnect(discard=True)
+    except Exception as error:
+        cur_connection.disconnect(discard=True)
+        logger.info("Sensors for midge " + str(current_participant)
+                    + " are not stopped with the following error: " + str(error))
+        raise
+
+
+def _synchronise_and_check(current_participant, current_mac, connection_manager):
+    try:
+        cur_connection = Connection(current_participant, current_mac,
+                                    connection_manager,
+                                    connect_timeout=connect_timeout)
+    except Exception as error:
+        logger.info(str(error) + ", cannot synchronise.")
+        sys.stdout.flush()
+        raise
+    try:
+        estimate = cur_connection.synchronise_clock(clock_synchroniser)
+        out = estimate.status
+        last_synced[current_mac] = time.monotonic()
+        logger.info("Status received for the following midge:"
+                    + str(current_participant) + ".")
+        logger.debug("Clock of midge " + str(current_participant) + " synced, offset "
+                     + "{:+.1f} ms (+-{:.1f} ms)".format(estimate.offset * 1000,
+                                                         estimate.uncertainty * 1000)
+                     + (", drift {:+.1f} ppm.".format(estimate.drift_ppm)
+                        if estimate.drift_ppm is not None else "."))
+        if out.imu_status == 0:
+            logger.info("IMU is not recording for participant "
                         + str(current_participant) + ".")
-            # TODO This is not actually the timestamp before, find how to get it.
-            logger.debug("Device timestamp before sync - seconds:"
-                         + str(out.timestamp.seconds) + ", ms:"
-                         + str(out.timestamp.ms) + ".")
-            if out.imu_status == 0:
-                logger.info("IMU is not recording for participant "
-                            + str(current_participant) + ".")
-            if out.microphone_status == 0:
-                logger.info("Mic is not recording for participant "
-                            + str(current_participant) + ".")
-            if out.scan_status == 0:
-                logger.info("Scan is not recording for participant "
-                            + str(current_participant) + ".")
-            if out.clock_status == 0:
-                logger.info("Cant synch for participant "
-                            + str(current_participant) + ".")
-            sys.stdout.flush()
-            cur_connection.disconnect()
-        except Exception as error:
-            logger.info("Status check for participant " + str(current_participant)
-                        + " returned the following error: " + str(error) + ".")
-            sys.stdout.flush()
+        if out.microphone_status == 0:
+            logger.info("Mic is not recording for participant "
+                        + str(current_participant) + ".")
+        if out.scan_status == 0:
+            logger.info("Scan is not recording for participant "
+                        + str(current_participant) + ".")
+        if out.clock_status == 0:
+            logger.info("Cant synch for participant "
+                        + str(current_participant) + ".")
+        if 0 in (out.imu_status, out.microphone_status, out.scan_status, out.clock_status):
+            midges_with_problems.add(current_mac)
+        else:
+            midges_with_problems.discard(current_mac)
+        sys.stdout.flush()
+        cur_connection.disconnect()
+        return out
+    except Exception as error:
+        cur_connection.disconnect(discard=True)
+        logger.info("Status check for participant " + str(current_participant)
+                    + " returned the following error: " + str(error) + ".")
+        sys.stdout.flush()
+        raise
+
+
+# The loops below handle up to `max_workers` midges at a time on each adapter, give up on
+#   a midge after `timeout` seconds, and return a FleetReport with the outcome for every
+#   midge.
+def start_recording_all_devices(df, max_workers=max_concurrent_midges,
+                                timeout=midge_timeout):
+    return _run_on_all_devices(_midges(df), _start_recording, "Start recording",
+                               max_workers, timeout)
+
+
+def stop_recording_all_devices(df, max_workers=max_concurrent_midges,
+                               timeout=midge_timeout):
+    return _run_on_all_devices(_midges(df), _stop_recording, "Stop recording",
+                               max_workers, timeout)
+
+
+# Returns the midges to connect to for a check: those whose last check found a problem
+#   (their link is kept open, so they do not advertise), those the monitor has not heard
+#   from (they may be connected, or gone), and those whose advertisement shows a problem or
+#   whose clock is due for a sync. The others are checked from their advertisement alone.
+def _midges_needing_connection(midges):
+    now = time.monotonic()
+    needing = []
+    for current_participant, current_mac in midges:
+        if current_mac in midges_with_problems:
+            logger.debug("Checking midge " + str(current_participant) + " again.")
+            needing.append((current_participant, current_mac))
+            continue
+        status = fleet_monitor.status(current_mac, now)
+        if status is None:
+            needing.append((current_participant, current_mac))
+            continue
+        advertisement = status.advertisement
+        if advertisement.battery < low_battery_percent:
+            logger.info("Battery of midge " + str(current_participant) + " is at "
+                        + str(advertisement.battery) + "%.")
+        problems = advertisement_problems(advertisement, int(current_participant),
+                                          constant_group_number)
+        if now - last_synced.get(current_mac, float("-inf")) > clock_sync_interval:
+            problems.append("clock sync due")
+        if problems:
+            logger.info("Checking midge " + str(current_participant) + ": "
+                        + ", ".join(problems) + ".")
+            needing.append((current_participant, current_mac))
+        else:
+            logger.debug("Midge " + str(current_participant)
+                         + " advertises that it is recording.")
+    return needing
+
+
+def synchronise_and_check_all_devices(df, max_workers=max_concurrent_midges,
+                                      timeout=midge_timeout):
+    all_midges = _midges(df)
+    midges = all_midges
+    if fleet_monitor.ready:
+        midges = _midges_needing_connection(all_midges)
+        logger.info(str(len(all_midges) - len(midges))
+                    + " midges checked from their advertisements.")
+    return _run_on_all_devices(midges, _synchronise_and_check, "Synchronisation",
+                               max_workers, timeout)
 
 
 class timeout_input(object):
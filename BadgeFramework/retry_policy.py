@@ -0,0 +1,231 @@
+from __future__ import annotations
+import logging
+import random
+import threading
+import time
+from typing import Any, Callable, Iterator, Optional, Tuple, Type
+
+from badge_connection import BadgeTimeoutError
+
+logger = logging.getLogger(__name__)
+
+# Attempts of an operation, and the backoff between them: the first delay in seconds, the
+#   factor applied after every attempt, the largest delay, and the fraction of each delay
+#   drawn at random.
+DEFAULT_ATTEMPTS = 3
+DEFAULT_BASE_DELAY = 0.5
+DEFAULT_MULTIPLIER = 2.0
+DEFAULT_MAX_DELAY = 8.0
+DEFAULT_JITTER = 0.5
+
+# Consecutive failures after which a badge is skipped, the seconds it is first skipped for,
+#   and the longest it is skipped for after failing its probes.
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_RESET_TIMEOUT = 60.0
+DEFAULT_MAX_RESET_TIMEOUT = 600.0
+
+
+# Raised instead of running an operation on a badge whose circuit is open.
+class CircuitOpenError(ConnectionError):
+    pass
+
+
+# Calls func() in a thread and returns its result, or raises BadgeTimeoutError if it did
+#   not return within `timeout` seconds. A blocking call cannot be interrupted, so the call is
+#   abandoned: if it still returns, cleanup(result) is called with its late result.
+def call_with_deadline(
+    func: Callable[[], Any],
+    timeout: float,
+    cleanup: Optional[Callable[[Any], None]] = None,
+    description: str = "call",
+):
+    lock = threading.Lock()
+    done = threading.Event()
+    outcome = {}
+
+    def run():
+        try:
+            result = func()
+        except BaseException as err:
+            with lock:
+                outcome["error"] = err
+        else:
+            with lock:
+                abandoned = outcome.get("abandoned", False)
+                outcome["result"] = result
+            if abandoned and cleanup is not None:
+                logger.debug("Cleaning up late result of {}".format(description))
+                cleanup(result)
+        done.set()
+
+    threading.Thread(target=run, name="deadline", daemon=True).start()
+    if not done.wait(timeout):
+        with lock:
+            if "result" not in outcome and "error" not in outcome:
+                outcome["abandoned"] = True
+                raise BadgeTimeoutError(
+                    "{} did not finish within {:.1f}s".format(description, timeout)
+                )
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["result"]
+
+
+# RetryPolicy runs an operation up to `attempts` times, waiting between attempts with an
+#   exponential backoff: base_delay, then `multiplier` times longer after every attempt, at
+#   most max_delay. `jitter` is the fraction of each delay drawn at random, so badges failing
+#   together do not retry in lockstep. With an `attempt_timeout`, an attempt running longer
+#   is abandoned (see call_with_deadline()) and counts as failed.
+class RetryPolicy(object):
+    def __init__(
+        self,
+        attempts: int = DEFAULT_ATTEMPTS,
+        base_delay: float = DEFAULT_BASE_DELAY,
+        multiplier: float = DEFAULT_MULTIPLIER,
+        max_delay: float = DEFAULT_MAX_DELAY,
+        jitter: float = DEFAULT_JITTER,
+        attempt_timeout: Optional[float] = None,
+        retry_on: Tuple[Type[BaseException], ...] = (Exception,),
+        rng: Optional[random.Random] = None,
+    ):
+        if attempts < 1:
+            raise ValueError("RetryPolicy needs at least one attempt")
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.multiplier = multiplier
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.attempt_timeout = attempt_timeout
+        self.retry_on = retry_on
+        self.rng = rng if rng is not None else random.Random()
+
+    # Yields the delays before the second, third, ... attempt.
+    def delays(self) -> Iterator[float]:
+        delay = self.base_delay
+        for _ in range(self.attempts - 1):
+            capped = min(delay, self.max_delay)
+            yield capped * (1.0 - self.jitter * self.rng.random())
+            delay *= self.multiplier
+
+    # Returns func(), retrying on the `retry_on` exceptions; raises the last one once all
+    #   attempts failed. `cleanup` disposes of the late result of an abandoned attempt.
+    #   With a `deadline` (a time.monotonic() time), no attempt runs past it: the last one is
+    #   cut short to end by then, and no retry starts that could not.
+    def call(
+        self,
+        func: Callable[[], Any],
+        cleanup: Optional[Callable[[Any], None]] = None,
+        description: str = "operation",
+        deadline: Optional[float] = None,
+    ):
+        delays = self.delays()
+        attempt = 1
+        while True:
+            timeout = self.attempt_timeout
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if timeout is None or remaining < timeout:
+                    timeout = remaining
+            try:
+                if timeout is None:
+                    return func()
+                if timeout <= 0:
+                    raise BadgeTimeoutError(
+                        "No time left for attempt {} of {}".format(attempt, description)
+                    )
+                return call_with_deadline(func, timeout, cleanup, description)
+            except self.retry_on as err:
+                delay = next(delays, None)
+                if delay is None or (
+                    deadline is not None and time.monotonic() + delay >= deadline
+                ):
+                    raise
+                logger.info(
+                    "Attempt {} of {} failed: {}, retrying in {:.1f}s.".format(
+                        attempt, description, err, delay
+                    )
+                )
+            time.sleep(delay)
+            attempt += 1
+
+
+class _Circuit(object):
+    __slots__ = ("failures", "trips", "open_until", "probing")
+
+    def __init__(self):
+        self.failures = 0
+        self.trips = 0
+        self.open_until = 0.0
+        self.probing = False
+
+
+# CircuitBreaker keeps track of the badges that keep failing, by MAC address, so a round
+#   does not spend its time on them. After `failure_threshold` consecutive failures the
+#   circuit of a badge opens and allow() refuses it for reset_timeout seconds. Then a single
+#   probe is allowed: a success closes the circuit, a failure opens it again for twice as
+#   long as the last time, at most max_reset_timeout seconds.
+class CircuitBreaker(object):
+    def __init__(
+        self,
+        failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+        reset_timeout: float = DEFAULT_RESET_TIMEOUT,
+        max_reset_timeout: float = DEFAULT_MAX_RESET_TIMEOUT,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.circuits = {}
+        self.lock = threading.Lock()
+
+    # Returns whether an operation on `address` may run now. Allowing the probe of an open
+    #   circuit reserves it: other callers are refused until its outcome is recorded.
+    def allow(self, address: str, now: Optional[float] = None) -> bool:
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            circuit = self.circuits.get(address.lower())
+            if circuit is None or circuit.trips == 0:
+                return True
+            if circuit.probing or now < circuit.open_until:
+                return False
+            circuit.probing = True
+            return True
+
+    # Returns whether the circuit of `address` is open, i.e. whether the badge is skipped.
+    def is_open(self, address: str) -> bool:
+        with self.lock:
+            circuit = self.circuits.get(address.lower())
+            return circuit is not None and circuit.trips > 0
+
+    # Seconds until the next probe of `address` is allowed, 0 if it is allowed now.
+    def retry_after(self, address: str, now: Optional[float] = None) -> float:
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            circuit = self.circuits.get(address.lower())
+            if circuit is None or circuit.trips == 0:
+                return 0.0
+            return max(0.0, circuit.open_until - now)
+
+    def record_success(self, address: str):
+        with self.lock:
+            self.circuits.pop(address.lower(), None)
+
+    def record_failure(self, address: str, now: Optional[float] = None):
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            circuit = self.circuits.get(address.lower())
+            if circuit is None:
+                circuit = self.circuits[address.lower()] = _Circuit()
+            circuit.failures += 1
+            circuit.probing = False
+            if circuit.trips == 0 and circuit.failures < self.failure_threshold:
+                return
+            open_for = min(self.reset_timeout * 2 ** circuit.trips, self.max_reset_timeout)
+            circuit.trips += 1
+            circuit.open_until = now + open_for
+            failures = circuit.failures
+        logger.info(
+            "Skipping {} for {:.0f}s after {} failures.".format(address, open_for, failures)
+        )
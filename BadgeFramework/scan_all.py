@@ -1,24 +1,6 @@
-from bluepy.btle import Scanner, DefaultDelegate
+from badge_scanner import scan_for_badges
 
-class ScanDelegate(DefaultDelegate):
-    def __init__(self):
-        DefaultDelegate.__init__(self)
+midges = scan_for_badges(5.0).values()
 
-    # def handleDiscovery(self, dev, isNewDev, isNewData):
-    #     if isNewDev:
-    #         print "Discovered device", dev.addr
-    #     elif isNewData:
-    #         print "Received new data from", dev.addr
-
-scanner = Scanner().withDelegate(ScanDelegate())
-devices = scanner.scan(5.0)
-device_temp_name = 'HDBDG'
-midges = []
-
-for dev in devices:
-    for (adtype, desc, value) in dev.getScanData():
-        if desc == 'Complete Local Name' and value == device_temp_name:
-            midges.append(dev)
-
-for midge in midges:
-    print ("Device %s, RSSI=%d dB" % (midge.addr, midge.rssi))
\ No newline at end of file
+for midge in sorted(midges, key=lambda midge: midge.rssi, reverse=True):
+    print ("Device %s, RSSI=%d dB" % (midge.address, midge.rssi))
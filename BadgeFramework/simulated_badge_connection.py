@@ -0,0 +1,615 @@
+from __future__ import annotations
+import collections
+import logging
+import random
+import threading
+import time
+from typing import Dict, Optional
+
+from badge import LENGTH_HEADER
+from badge_connection import BadgeConnection, BadgeDisconnectedError, BadgeTimeoutError
+from badge_advertisement import (
+    CLOCK_SYNCED_FLAG,
+    IMU_FLAG,
+    MANUFACTURER_DATA_AD_TYPE,
+    MICROPHONE_FLAG,
+    SCAN_FLAG,
+    BadgeAdvertisement,
+    encode_manufacturer_data,
+    manufacturer_data,
+)
+from badge_scanner import (
+    COMPLETE_LOCAL_NAME,
+    DEFAULT_SCAN_SECONDS,
+    DEVICE_NAME,
+    SeenBadge,
+    merge_scans,
+)
+from badge_protocol import (
+    FreeSDCSpaceResponse,
+    Request,
+    Request_free_sdc_space_request_tag,
+    Request_identify_request_tag,
+    Request_restart_request_tag,
+    Request_start_imu_request_tag,
+    Request_start_microphone_request_tag,
+    Request_start_scan_request_tag,
+    Request_status_request_tag,
+    Request_stop_imu_request_tag,
+    Request_stop_microphone_request_tag,
+    Request_stop_scan_request_tag,
+    Response,
+    StartImuResponse,
+    StartMicrophoneResponse,
+    StartScanResponse,
+    StatusResponse,
+    Timestamp,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOTAL_SPACE = 32 * 1024 * 1024  # kB, as reported by the firmware
+# Seconds a restarted badge stays unreachable.
+DEFAULT_RESTART_SECONDS = 5.0
+# Links one simulated adapter holds at a time, and the range of RSSIs (dBm) it hears
+#   badges at. Badges heard below WEAK_LINK_RSSI lose frames at the adapter's weak_link_loss.
+DEFAULT_ADAPTER_LINKS = 7
+DEFAULT_RSSI_RANGE = (-95, -45)
+WEAK_LINK_RSSI = -85
+UNKNOWN_ADAPTER_RSSI = -70
+# Seconds between two advertisements of a badge (ADVERTISING_INTERVAL_MS in the firmware).
+ADVERTISING_INTERVAL = 0.2
+
+
+# Host time as seen by the simulator: the real monotonic clock.
+class SystemClock(object):
+    @staticmethod
+    def monotonic() -> float:
+        return time.monotonic()
+
+    @staticmethod
+    def sleep(seconds: float):
+        time.sleep(seconds)
+
+
+# Host time that only moves when someone sleeps on it, so a simulated exchange takes no
+#   real time and its timing is exactly reproducible. Meant for a single thread: a sleep
+#   returns at once, with the clock advanced.
+class ManualClock(object):
+    def __init__(self, start: float = 0.0):
+        self.now = start
+        self.lock = threading.Lock()
+
+    def monotonic(self) -> float:
+        with self.lock:
+            return self.now
+
+    def sleep(self, seconds: float):
+        self.advance(seconds)
+
+    def advance(self, seconds: float):
+        with self.lock:
+            self.now += max(0.0, seconds)
+
+
+SYSTEM_CLOCK = SystemClock()
+
+
+# SimulatedBadge emulates the request handler of the midge firmware
+#   (rythmbadge/request_handler_lib.c): the badge assignment, the clock and its sync status,
+#   the microphone/scan/IMU sampling flags and the SD card space.
+# Its clock runs `drift_ppm` parts per million fast (negative: slow) against the host's, and
+#   starts at 0 ms on every boot until a request sets it. Host time comes from `clock`.
+class SimulatedBadge(object):
+    def __init__(
+        self,
+        address: str,
+        badge_id: int = 0,
+        group: int = 0,
+        drift_ppm: float = 0.0,
+        total_space: int = DEFAULT_TOTAL_SPACE,
+        free_space: Optional[int] = None,
+        recording_kb_per_second: float = 0.0,
+        restart_seconds: float = DEFAULT_RESTART_SECONDS,
+        battery: int = 100,
+        clock=SYSTEM_CLOCK,
+    ):
+        self.address = address
+        self.clock = clock
+        self.badge_id = badge_id
+        self.group = group
+        self.drift_ppm = drift_ppm
+        self.total_space = total_space
+        self.free_space = total_space if free_space is None else free_space
+        self.recording_kb_per_second = recording_kb_per_second
+        self.restart_seconds = restart_seconds
+        self.battery = battery
+        # False for a badge out of range or with a dead battery: it neither advertises nor
+        #   accepts connections.
+        self.in_range = True
+        # Number of links currently up; a connected badge stops advertising.
+        self.links = 0
+        self.lock = threading.Lock()
+        self.boot(clock.monotonic())
+
+    # Resets the state a restart loses; the badge answers again from `now`.
+    def boot(self, now: float):
+        self.boot_time = now
+        self.available_at = now
+        self.busy_until = now
+        self.clock_synced = False
+        self.millis_offset = 0
+        self.ticks_at_offset = 0.0
+        self.microphone_mode = None
+        self.scan_settings = None
+        self.imu_settings = None
+        self.space_updated_at = now
+        self.last_free_space_response = (0, 0)
+
+    # Milliseconds elapsed on the badge's own oscillator since boot.
+    def _ticks(self, now: float) -> float:
+        return (now - self.boot_time) * 1000.0 * (1.0 + self.drift_ppm * 1e-6)
+
+    # Returns whether a scan at `now` hears the badge.
+    def advertising(self, now: float) -> bool:
+        return self.in_range and self.links == 0 and now >= self.available_at
+
+    # Returns the advertising packet of the badge, laid out like the firmware's
+    #   (rythmbadge/ble_lib.c): flags, the NUS service UUID, the manufacturer specific data
+    #   (custom_advdata_t from its 12th byte) and the name.
+    def advertising_data(self) -> bytes:
+        with self.lock:
+            status_flags = (
+                (CLOCK_SYNCED_FLAG if self.clock_synced else 0)
+                | (MICROPHONE_FLAG if self.microphone_mode is not None else 0)
+                | (SCAN_FLAG if self.scan_settings is not None else 0)
+                | (IMU_FLAG if self.imu_settings is not None else 0)
+            )
+            advertisement = BadgeAdvertisement(
+                self.address, self.battery, status_flags, self.badge_id, self.group
+            )
+        structures = (
+            (0x01, bytes([0x06])),
+            (0x03, bytes([0x01, 0x00])),
+            (MANUFACTURER_DATA_AD_TYPE, encode_manufacturer_data(advertisement)),
+            (COMPLETE_LOCAL_NAME, DEVICE_NAME.encode()),
+        )
+        return b"".join(bytes([len(data) + 1, ad_type]) + data for ad_type, data in structures)
+
+    def clock_millis(self, now: float) -> int:
+        return int(self._ticks(now) - self.ticks_at_offset) + self.millis_offset
+
+    def is_recording(self) -> bool:
+        return (
+            self.microphone_mode is not None
+            or self.scan_settings is not None
+            or self.imu_settings is not None
+        )
+
+    # Mirrors systick_set_timestamp(): returns the error of the badge clock in ms, 0 on the
+    #   first sync after boot.
+    def _set_clock(self, timestamp: Timestamp, now: float) -> int:
+        millis_sync = timestamp.seconds * 1000 + timestamp.ms
+        error_millis = millis_sync - self.clock_millis(now) if self.clock_synced else 0
+        self.millis_offset = millis_sync
+        self.ticks_at_offset = self._ticks(now)
+        self.clock_synced = True
+        return error_millis
+
+    def _update_space(self, now: float):
+        if self.is_recording():
+            written = int((now - self.space_updated_at) * self.recording_kb_per_second)
+            self.free_space = max(0, self.free_space - written)
+        self.space_updated_at = now
+
+    def _timestamp(self, now: float) -> Timestamp:
+        millis = self.clock_millis(now)
+        timestamp = Timestamp()
+        timestamp.seconds, timestamp.ms = divmod(millis, 1000)
+        return timestamp
+
+    # Processes `request`, received by the badge at host time `now`, and returns the
+    #   Response the firmware sends back, or None for requests without one.
+    def handle_request(self, request: Request, now: float) -> Optional[Response]:
+        with self.lock:
+            self._update_space(now)
+            # Like the firmware, the response carries the clock state at reception.
+            response_timestamp = self._timestamp(now)
+            response_clock_status = int(self.clock_synced)
+            which = request.type.which
+            value = request.type._value
+            response = Response()
+
+            if which == Request_status_request_tag:
+                if value.has_badge_assignement:
+                    self.badge_id = value.badge_assignement.ID
+                    self.group = value.badge_assignement.group
+                status = StatusResponse()
+                status.time_delta = self._set_clock(value.timestamp, now)
+                status.clock_status = response_clock_status
+                status.microphone_status = int(self.microphone_mode is not None)
+                status.scan_status = int(self.scan_settings is not None)
+                status.imu_status = int(self.imu_settings is not None)
+                status.timestamp = response_timestamp
+                response.type.status_response = status
+            elif which == Request_start_microphone_request_tag:
+                self._set_clock(value.timestamp, now)
+                self.microphone_mode = value.mode
+                response.type.start_microphone_response = StartMicrophoneResponse()
+                response.type.start_microphone_response.timestamp = response_timestamp
+            elif which == Request_start_scan_request_tag:
+                self._set_clock(value.timestamp, now)
+                self.scan_settings = (value.window, value.interval)
+                response.type.start_scan_response = StartScanResponse()
+                response.type.start_scan_response.timestamp = response_timestamp
+            elif which == Request_start_imu_request_tag:
+                self._set_clock(value.timestamp, now)
+                self.imu_settings = (value.acc_fsr, value.gyr_fsr, value.datarate)
+                response.type.start_imu_response = StartImuResponse()
+                response.type.start_imu_response.timestamp = response_timestamp
+            elif which == Request_stop_microphone_request_tag:
+                self.microphone_mode = None
+                return None
+            elif which == Request_stop_scan_request_tag:
+                self.scan_settings = None
+                return None
+            elif which == Request_stop_imu_request_tag:
+                self.imu_settings = None
+                return None
+            elif which == Request_identify_request_tag:
+                # The firmware blocks its request handler while the LED is on.
+                self.busy_until = now + value.timeout
+                return None
+            elif which == Request_restart_request_tag:
+                self.boot(now)
+                self.available_at = now + self.restart_seconds
+                return None
+            elif which == Request_free_sdc_space_request_tag:
+                # The firmware only reads the card while not sampling and otherwise
+                #   repeats the values of its previous response.
+                if not self.is_recording():
+                    self.last_free_space_response = (self.total_space, self.free_space)
+                space = FreeSDCSpaceResponse()
+                space.total_space, space.free_space = self.last_free_space_response
+                space.timestamp = response_timestamp
+                response.type.free_sdc_space_response = space
+            else:
+                logger.info("{}: unknown request type {}".format(self.address, which))
+                return None
+            return response
+
+
+# SimulatedBadgeConnection implements the BadgeConnection interface on top of a
+#   SimulatedBadge, so OpenBadge, Connection and the hub utilities can run without midges.
+# Requests are decoded with badge_protocol as they arrive (in any fragmentation) and
+#   answered with framed Responses. Every request and response takes `latency` seconds
+#   (plus up to `jitter`) to travel, is lost with probability `loss`, and every send drops
+#   the link with probability `disconnect_rate`. A restart request also drops the link.
+#   Time passes on the badge's clock (see ManualClock).
+class SimulatedBadgeConnection(BadgeConnection):
+    def __init__(
+        self,
+        badge: SimulatedBadge,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        loss: float = 0.0,
+        disconnect_rate: float = 0.0,
+        timeout: float = 10.0,
+        rng: Optional[random.Random] = None,
+    ):
+        BadgeConnection.__init__(self)
+        self.badge = badge
+        self.address = badge.address
+        self.clock = badge.clock
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.disconnect_rate = disconnect_rate
+        self.timeout = timeout
+        self.rng = rng if rng is not None else random.Random()
+
+        self.connected = False
+        self.tx_buffer = bytearray()
+        self.rx_buffer = bytearray()
+        # (delivery time, frame) of the responses in flight, in delivery order.
+        self.in_flight = collections.deque()
+
+    def _delay(self) -> float:
+        if self.jitter:
+            return self.latency + self.rng.uniform(0.0, self.jitter)
+        return self.latency
+
+    def _lost(self) -> bool:
+        return self.loss > 0.0 and self.rng.random() < self.loss
+
+    def connect(self):
+        if not self.badge.in_range:
+            # Like bluepy, only gives up on an absent device after a connection timeout.
+            self.clock.sleep(self.timeout)
+            raise BadgeDisconnectedError("{} is not in range".format(self.badge.address))
+        now = self.clock.monotonic()
+        if now < self.badge.available_at:
+            raise BadgeDisconnectedError(
+                "{} is restarting".format(self.badge.address)
+            )
+        self.clock.sleep(self._delay())
+        self.connected = True
+        with self.badge.lock:
+            self.badge.links += 1
+
+    def _link_down(self):
+        if self.connected:
+            with self.badge.lock:
+                self.badge.links -= 1
+        self.connected = False
+
+    def disconnect(self):
+        self._link_down()
+        self.tx_buffer.clear()
+        self.rx_buffer.clear()
+        self.in_flight.clear()
+
+    def is_connected(self):
+        return self.connected
+
+    def _check_connected(self, method):
+        if not self.connected:
+            raise RuntimeError(
+                "SimulatedBadgeConnection not connected before {}()!".format(method)
+            )
+
+    def _drop(self, reason):
+        self.disconnect()
+        raise BadgeDisconnectedError("{}: {}".format(self.badge.address, reason))
+
+    # Hands every complete request frame in the transmit buffer to the badge.
+    def _process_requests(self, sent_at: float):
+        while len(self.tx_buffer) >= LENGTH_HEADER.size:
+            length = LENGTH_HEADER.unpack_from(self.tx_buffer)[0]
+            end = LENGTH_HEADER.size + length
+            if len(self.tx_buffer) < end:
+                return
+            payload = bytes(self.tx_buffer[LENGTH_HEADER.size : end])
+            del self.tx_buffer[:end]
+            if self._lost():
+                logger.debug("{}: request lost".format(self.badge.address))
+                continue
+
+            arrival = max(sent_at + self._delay(), self.badge.busy_until)
+            request = Request.decode(payload)
+            response = self.badge.handle_request(request, arrival)
+            if request.type.which == Request_restart_request_tag:
+                self._link_down()
+            if response is None or self._lost():
+                continue
+            serialized_response = response.encode()
+            delivery = arrival + self._delay()
+            if self.in_flight:
+                delivery = max(delivery, self.in_flight[-1][0])
+            self.in_flight.append(
+                (delivery, LENGTH_HEADER.pack(len(serialized_response)) + serialized_response)
+            )
+
+    # Implements BadgeConnection's send() spec.
+    def send(self, message, response_len=0, timeout=None, acknowledged=True):
+        self._check_connected("send")
+        if self.disconnect_rate > 0.0 and self.rng.random() < self.disconnect_rate:
+            self._drop("link lost")
+
+        now = self.clock.monotonic()
+        self.tx_buffer += message
+        self._process_requests(now)
+        if acknowledged:
+            # The write response comes back after a round trip.
+            self.clock.sleep(2 * self._delay())
+
+        if response_len > 0:
+            return self.await_data(response_len, timeout)
+
+    # Implements BadgeConnection's receive_available() spec: returns the responses delivered
+    #   so far as one chunk.
+    def receive_available(self, timeout=None):
+        return self._receive(None, timeout)
+
+    # Implements BadgeConnection's await_data() spec.
+    def await_data(self, data_len, timeout=None):
+        if data_len == 0:
+            return None
+        return self._receive(data_len, timeout)
+
+    # Returns the first data_len received bytes, or all of them (at least one) if data_len
+    #   is None, waiting for them for at most `timeout` seconds.
+    def _receive(self, data_len, timeout):
+        if timeout is None:
+            timeout = self.timeout
+        deadline = self.clock.monotonic() + timeout
+        while True:
+            if not self.connected:
+                self._drop("disconnected while awaiting data")
+            now = self.clock.monotonic()
+            while self.in_flight and self.in_flight[0][0] <= now:
+                self.rx_buffer += self.in_flight.popleft()[1]
+            wanted = (len(self.rx_buffer) or 1) if data_len is None else data_len
+            if len(self.rx_buffer) >= wanted:
+                data = bytes(self.rx_buffer[:wanted])
+                del self.rx_buffer[:wanted]
+                return data
+            if now >= deadline:
+                raise BadgeTimeoutError(
+                    "Timed out after {:.1f}s waiting for {} bytes from {}".format(
+                        timeout, data_len or "any", self.badge.address
+                    )
+                )
+            wake = deadline
+            if self.in_flight:
+                wake = min(wake, self.in_flight[0][0])
+            self.clock.sleep(max(0.0, wake - now))
+
+
+# SimulatedAdapter stands for one HCI adapter of the hub, for the multi-adapter scheduler.
+#   Like a controller it holds at most `max_links` links and sets them up one at a time,
+#   each taking `connect_seconds`. It hears every badge at a fixed RSSI drawn within
+#   `rssi_range`; links to badges heard below WEAK_LINK_RSSI also lose `weak_link_loss` of
+#   their frames. connect(address) fits ConnectionManager's connection_factory.
+class SimulatedAdapter(object):
+    def __init__(
+        self,
+        fleet: SimulatedFleet,
+        iface: int,
+        max_links: int = DEFAULT_ADAPTER_LINKS,
+        connect_seconds: float = 0.0,
+        rssi_range=DEFAULT_RSSI_RANGE,
+        weak_link_loss: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        self.fleet = fleet
+        self.iface = iface
+        self.max_links = max_links
+        self.connect_seconds = connect_seconds
+        self.rssi_range = rssi_range
+        self.weak_link_loss = weak_link_loss
+        self.rng = random.Random(seed)
+        self.rssis = {}
+        self.links = []
+        self.lock = threading.Lock()
+
+    def rssi(self, address: str) -> int:
+        with self.lock:
+            rssi = self.rssis.get(address)
+            if rssi is None:
+                rssi = self.rssis[address] = self.rng.randint(*self.rssi_range)
+            return rssi
+
+    # Number of links currently up on this adapter.
+    def link_count(self) -> int:
+        with self.lock:
+            self.links = [link for link in self.links if link.connected]
+            return len(self.links)
+
+    def connect(self, address: str) -> SimulatedBadgeConnection:
+        rssi = self.rssi(address)
+        connection = self.fleet.connection(address)
+        if rssi < WEAK_LINK_RSSI:
+            connection.loss = max(connection.loss, self.weak_link_loss)
+        with self.lock:
+            self.links = [link for link in self.links if link.connected]
+            if len(self.links) >= self.max_links:
+                raise BadgeDisconnectedError(
+                    "hci{}: no free link for {}".format(self.iface, address)
+                )
+            self.fleet.clock.sleep(self.connect_seconds)
+            connection.connect()
+            self.links.append(connection)
+        return connection
+
+
+# A fleet of simulated badges with persistent state, keyed by MAC address.
+#   connect() opens a new SimulatedBadgeConnection to a badge, creating the badge on first
+#   use, and fits ConnectionManager's connection_factory. Badge and connection parameters
+#   apply to every badge; clock drifts are drawn uniformly within +-max_drift_ppm.
+#   adapters() puts simulated HCI adapters in front of the fleet, reached through
+#   connect_through(). Every badge, link and scan runs on the host `clock`.
+class SimulatedFleet(object):
+    def __init__(
+        self,
+        count: int = 0,
+        max_drift_ppm: float = 0.0,
+        seed: Optional[int] = None,
+        badge_options: Optional[dict] = None,
+        clock=SYSTEM_CLOCK,
+        **connection_options,
+    ):
+        self.rng = random.Random(seed)
+        self.clock = clock
+        self.max_drift_ppm = max_drift_ppm
+        self.badge_options = badge_options or {}
+        self.connection_options = connection_options
+        self.badges = collections.OrderedDict()
+        # iface -> SimulatedAdapter, filled by adapters().
+        self.simulated_adapters = {}
+        self.lock = threading.Lock()
+        for i in range(count):
+            self.badge(self.address_of(i))
+
+    # Deterministic MAC address of the i-th badge of a fleet.
+    @staticmethod
+    def address_of(i: int) -> str:
+        return "c0:de:00:{:02x}:{:02x}:{:02x}".format(
+            (i >> 16) & 0xFF, (i >> 8) & 0xFF, i & 0xFF
+        )
+
+    def addresses(self):
+        return list(self.badges)
+
+    def badge(self, address: str) -> SimulatedBadge:
+        with self.lock:
+            badge = self.badges.get(address)
+            if badge is None:
+                drift_ppm = self.rng.uniform(-self.max_drift_ppm, self.max_drift_ppm)
+                badge = SimulatedBadge(
+                    address, drift_ppm=drift_ppm, clock=self.clock, **self.badge_options
+                )
+                self.badges[address] = badge
+            return badge
+
+    def connection(self, address: str) -> SimulatedBadgeConnection:
+        with self.lock:
+            rng = random.Random(self.rng.random())
+        return SimulatedBadgeConnection(
+            self.badge(address), rng=rng, **self.connection_options
+        )
+
+    def connect(self, address: str) -> SimulatedBadgeConnection:
+        connection = self.connection(address)
+        connection.connect()
+        return connection
+
+    # Returns `count` SimulatedAdapters hci0..hci`count - 1` in front of this fleet.
+    def adapters(self, count: int, **adapter_options):
+        with self.lock:
+            seeds = [self.rng.random() for _ in range(count)]
+        adapters = [
+            SimulatedAdapter(self, iface, seed=seed, **adapter_options)
+            for iface, seed in enumerate(seeds)
+        ]
+        self.simulated_adapters = {adapter.iface: adapter for adapter in adapters}
+        return adapters
+
+    # Connects through the simulated adapter hci`iface`; fits AdapterScheduler's
+    #   connection_factory.
+    def connect_through(self, address: str, iface: int) -> SimulatedBadgeConnection:
+        return self.simulated_adapters[iface].connect(address)
+
+    # Passive scan of `seconds` on the simulated adapters `ifaces`; fits
+    #   AdapterScheduler.scan_and_run's scanner. Adapters not created by adapters() hear
+    #   every badge at UNKNOWN_ADAPTER_RSSI.
+    def scan(
+        self, seconds: float = DEFAULT_SCAN_SECONDS, ifaces=(0,), name: str = DEVICE_NAME
+    ) -> Dict[str, SeenBadge]:
+        self.clock.sleep(seconds)
+        now = self.clock.monotonic()
+        with self.lock:
+            badges = list(self.badges.values())
+        heard_by_iface = {}
+        for iface in ifaces:
+            adapter = self.simulated_adapters.get(iface)
+            heard_by_iface[iface] = {
+                badge.address: adapter.rssi(badge.address) if adapter else UNKNOWN_ADAPTER_RSSI
+                for badge in badges
+                if badge.advertising(now)
+            }
+        return merge_scans(heard_by_iface)
+
+    # Reports the advertisements of the badges heard on simulated adapter hci`iface` every
+    #   ADVERTISING_INTERVAL until should_stop() returns True; fits FleetMonitor's listener.
+    def listen(self, iface: int, report, should_stop, name: str = DEVICE_NAME):
+        adapter = self.simulated_adapters.get(iface)
+        while not should_stop():
+            now = self.clock.monotonic()
+            with self.lock:
+                badges = list(self.badges.values())
+            for badge in badges:
+                if badge.advertising(now):
+                    rssi = adapter.rssi(badge.address) if adapter else UNKNOWN_ADAPTER_RSSI
+                    report(iface, badge.address, rssi, manufacturer_data(badge.advertising_data()))
+            self.clock.sleep(ADVERTISING_INTERVAL)
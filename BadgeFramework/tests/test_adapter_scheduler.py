@@ -0,0 +1,143 @@
+import pytest
+
+import badge_scanner
+from adapter_scheduler import RSSI_SMOOTHING, AdapterScheduler
+from badge_scanner import BadgeNotSeenError, FleetMonitor, ScanFailedError, scan_for_badges
+from retry_policy import CircuitBreaker
+from simulated_badge_connection import ManualClock, SimulatedFleet
+
+
+@pytest.fixture
+def fleet():
+    fleet = SimulatedFleet(3, clock=ManualClock())
+    fleet.adapters(2)
+    return fleet
+
+
+@pytest.fixture
+def scheduler(fleet):
+    scheduler = AdapterScheduler((0, 1), connection_factory=fleet.connect_through)
+    yield scheduler
+    scheduler.close_all()
+
+
+def badges_of(fleet):
+    return [(i, address) for i, address in enumerate(fleet.addresses())]
+
+
+def connect(participant, address, manager):
+    connection = manager.acquire(address)
+    manager.release(address, connection)
+    return participant
+
+
+def failing_scanner(seconds, ifaces):
+    raise ScanFailedError("No adapter could scan: Operation not permitted")
+
+
+def placement(queues):
+    return {badge[1]: iface for iface, queue in queues.items() for _, badge in queue}
+
+
+def test_badges_are_spread_evenly_without_history(fleet, scheduler):
+    queues = scheduler.assign(badges_of(fleet) + [("x", "c0:de:00:00:00:ff")])
+    assert [len(queue) for queue in queues.values()] == [2, 2]
+
+
+def test_weak_link_and_failures_steer_badges_to_the_other_adapter(fleet, scheduler):
+    weak, failing, _ = fleet.addresses()
+    scheduler.record_rssi(0, weak, -90)
+    scheduler.record_rssi(1, weak, -55)
+    scheduler.record_result(1, failing, False)
+
+    placed = placement(scheduler.assign([("w", weak), ("f", failing)]))
+
+    assert placed == {weak: 1, failing: 0}
+
+
+def test_badge_stays_on_the_adapter_holding_its_link(fleet, scheduler):
+    address = fleet.addresses()[0]
+    # A somewhat weaker link is not worth reconnecting through the other adapter.
+    scheduler.record_rssi(1, address, -70)
+    manager = scheduler.manager(1)
+    manager.release(address, manager.acquire(address))
+
+    assert scheduler.adapter_for(address) == 1
+    assert placement(scheduler.assign([("a", address)])) == {address: 1}
+
+
+def test_rssi_is_a_running_average(scheduler):
+    scheduler.record_rssi(0, "c0:de:00:00:00:00", -60)
+    scheduler.record_rssi(0, "c0:de:00:00:00:00", -90)
+    assert scheduler.adapters[0].rssi["c0:de:00:00:00:00"] == -60 - 30 * RSSI_SMOOTHING
+
+
+def test_scan_skips_the_badges_not_heard(fleet, scheduler):
+    badges = badges_of(fleet)
+    fleet.badges[badges[1][1]].in_range = False
+
+    report = scheduler.scan_and_run(badges, connect, scanner=fleet.scan)
+
+    assert [result.ok for result in report.results] == [True, False, True]
+    assert isinstance(report.results[1].error, BadgeNotSeenError)
+
+
+def test_badges_sharing_an_address_keep_their_own_results(fleet, scheduler):
+    addresses = fleet.addresses()
+    fleet.badges[addresses[1]].in_range = False
+    badges = [("a", addresses[0]), ("b", addresses[1]), ("c", addresses[0]), ("d", addresses[1])]
+
+    # One worker per adapter, so the two users of a link do not hold it at the same time.
+    report = scheduler.scan_and_run(badges, connect, scanner=fleet.scan, workers_per_adapter=1)
+
+    assert [result.participant for result in report.results] == ["a", "b", "c", "d"]
+    assert [result.ok for result in report.results] == [True, False, True, False]
+
+
+def test_badges_not_heard_count_as_failures(fleet):
+    breaker = CircuitBreaker(failure_threshold=1)
+    scheduler = AdapterScheduler(
+        (0, 1), connection_factory=fleet.connect_through, circuit_breaker=breaker
+    )
+    badges = badges_of(fleet)
+    missing = badges[1][1]
+    fleet.badges[missing].in_range = False
+
+    scheduler.scan_and_run(badges, connect, scanner=fleet.scan)
+
+    assert breaker.is_open(missing)
+    assert not breaker.is_open(badges[0][1])
+    for iface in (0, 1):
+        assert scheduler.adapters[iface].outcomes[missing] == (0, 1)
+    scheduler.close_all()
+
+
+def test_failed_scan_runs_on_every_badge(fleet, scheduler):
+    badges = badges_of(fleet)
+
+    report = scheduler.scan_and_run(badges, connect, scanner=failing_scanner)
+
+    assert [result.value for result in report.results] == [0, 1, 2]
+
+
+def test_scan_fails_only_when_no_adapter_could_scan(monkeypatch):
+    def scan_adapter(seconds, iface, name):
+        if iface == 0:
+            raise OSError("Operation not permitted")
+        return {"c0:de:00:00:00:00": -50}
+
+    monkeypatch.setattr(badge_scanner, "scan_adapter", scan_adapter)
+    assert list(scan_for_badges(1.0, (0, 1))) == ["c0:de:00:00:00:00"]
+    with pytest.raises(ScanFailedError):
+        scan_for_badges(1.0, (0,))
+
+
+def test_monitor_that_heard_nothing_does_not_skip_the_fleet(fleet, scheduler):
+    badges = badges_of(fleet)
+    monitor = FleetMonitor((0, 1))
+
+    with pytest.raises(ScanFailedError):
+        monitor.scan()
+    report = scheduler.scan_and_run(badges, connect, scanner=monitor.scan)
+
+    assert all(result.ok for result in report.results)
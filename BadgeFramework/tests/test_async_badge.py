@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from async_badge import AsyncOpenBadge, ExecutorBadgeConnection
+from badge_connection import BadgeTimeoutError
+from simulated_badge_connection import ManualClock, SimulatedFleet
+
+ADDRESS = SimulatedFleet.address_of(0)
+
+
+@pytest.fixture
+def fleet():
+    return SimulatedFleet(1, clock=ManualClock())
+
+
+def run_with_badge(fleet, commands):
+    async def run():
+        connection = ExecutorBadgeConnection(fleet.connection(ADDRESS))
+        await connection.connect()
+        badge = AsyncOpenBadge(connection, metrics=None)
+        try:
+            return await commands(badge)
+        finally:
+            await connection.disconnect()
+
+    return asyncio.run(run())
+
+
+def test_status_round_trip(fleet):
+    async def commands(badge):
+        return await badge.get_status(t=1700000000.25)
+
+    status = run_with_badge(fleet, commands)
+
+    assert status.clock_status == 0
+    assert fleet.badges[ADDRESS].clock_synced
+
+
+def test_start_commands_take_positional_settings_like_open_badge(fleet):
+    async def commands(badge):
+        await badge.start_scan(None, 100, 500)
+        await badge.start_imu(None, 8, 500, 25)
+        await badge.start_microphone(None, 0)
+
+    run_with_badge(fleet, commands)
+
+    badge = fleet.badges[ADDRESS]
+    assert badge.scan_settings == (100, 500)
+    assert badge.imu_settings == (8, 500, 25)
+    assert badge.microphone_mode == 0
+
+
+def test_late_response_is_dropped_as_stale(fleet):
+    async def commands(badge):
+        # The firmware does not answer while the identify LED is on.
+        await badge.identify(5)
+        with pytest.raises(BadgeTimeoutError):
+            await badge.get_status(timeout=1.0)
+        status = await badge.get_status(timeout=10.0)
+        return badge, status
+
+    badge, status = run_with_badge(fleet, commands)
+
+    assert status is not None
+    assert badge.requests.stale_responses == 1
+    assert badge.requests.unexpected_responses == 0
@@ -0,0 +1,230 @@
+import threading
+
+import pytest
+
+import badge as badge_module
+from badge import (
+    LENGTH_HEADER,
+    STOP_SCAN_REQUEST_TEMPLATE,
+    OpenBadge,
+    identify_request_frame,
+    start_scan_request_frame,
+    status_request_frame,
+)
+from badge_connection import BadgeConnection, BadgeDisconnectedError, BadgeTimeoutError
+from badge_protocol import (
+    BadgeAssignement,
+    IdentifyRequest,
+    Request,
+    Response_status_response_tag,
+    StartScanRequest,
+    StatusRequest,
+    StopScanRequest,
+    Timestamp,
+)
+from simulated_badge_connection import SimulatedFleet
+
+
+# Sends a status request as an unacknowledged write, so a link latency only delays the
+#   response, and waits at most `timeout` seconds for it.
+def request_status(badge, timeout, t=None):
+    pending = badge.expect_response(Response_status_response_tag)
+    badge.send_frame(status_request_frame(t), acknowledged=False)
+    return badge.await_response(pending, timeout)
+
+
+# Returns the frame of a request built and encoded as a Request object.
+def encoded_frame(option, message):
+    request = Request()
+    setattr(request.type, option, message)
+    payload = request.encode()
+    return LENGTH_HEADER.pack(len(payload)) + payload
+
+
+def timestamp():
+    stamp = Timestamp()
+    stamp.seconds = 1700000000
+    stamp.ms = 250
+    return stamp
+
+
+@pytest.fixture
+def connection():
+    fleet = SimulatedFleet(1)
+    connection = fleet.connect(fleet.addresses()[0])
+    yield connection
+    connection.disconnect()
+
+
+def test_request_templates_match_the_encoded_requests():
+    t = 1700000000.25
+    status = StatusRequest()
+    status.timestamp = timestamp()
+    assert bytes(status_request_frame(t)) == encoded_frame("status_request", status)
+
+    status.has_badge_assignement = 1
+    status.badge_assignement = BadgeAssignement()
+    status.badge_assignement.ID = 7
+    status.badge_assignement.group = 3
+    assert bytes(status_request_frame(t, 7, 3)) == encoded_frame("status_request", status)
+
+    scan = StartScanRequest()
+    scan.timestamp = timestamp()
+    scan.window = 100
+    scan.interval = 300
+    assert bytes(start_scan_request_frame(t, 100, 300)) == encoded_frame(
+        "start_scan_request", scan
+    )
+
+    identify = IdentifyRequest()
+    identify.timeout = 5
+    assert bytes(identify_request_frame(5)) == encoded_frame("identify_request", identify)
+    assert STOP_SCAN_REQUEST_TEMPLATE.render() == encoded_frame(
+        "stop_scan_request", StopScanRequest()
+    )
+
+
+def test_response_to_timed_out_request_is_counted_as_stale(connection):
+    badge = OpenBadge(connection, metrics=None)
+    connection.latency = 0.1
+    with pytest.raises(BadgeTimeoutError):
+        request_status(badge, timeout=0.05)
+
+    badge.receive_response(timeout=1.0)
+
+    assert badge.stale_responses == 1
+    assert badge.unexpected_responses == 0
+
+
+def test_response_nobody_asked_for_is_counted_as_unexpected(connection):
+    badge = OpenBadge(connection, metrics=None)
+    connection.send(status_request_frame())
+
+    badge.receive_response(timeout=1.0)
+
+    assert badge.unexpected_responses == 1
+    assert badge.stale_responses == 0
+
+
+# The first status request after boot is answered with clock_status 0, later ones with 1.
+def test_stale_response_does_not_complete_the_next_request(connection):
+    badge = OpenBadge(connection, metrics=None)
+    connection.latency = 0.1
+    with pytest.raises(BadgeTimeoutError):
+        request_status(badge, timeout=0.05)
+
+    connection.latency = 0.0
+    status = request_status(badge, timeout=1.0)
+
+    assert badge.stale_responses == 1
+    assert status.clock_status == 1
+
+
+def test_reader_counts_stale_responses(connection):
+    badge = OpenBadge(connection, metrics=None)
+    dispatched = threading.Event()
+    dispatch_response = badge.dispatch_response
+
+    def dispatch_and_signal(response_message):
+        dispatch_response(response_message)
+        dispatched.set()
+
+    badge.dispatch_response = dispatch_and_signal
+    badge.start_reader()
+    try:
+        connection.latency = 0.1
+        with pytest.raises(BadgeTimeoutError):
+            request_status(badge, timeout=0.05)
+        assert dispatched.wait(1.0)
+        assert badge.stale_responses == 1
+        assert not badge.awaiting_response()
+    finally:
+        badge.stop_reader()
+
+
+def test_reader_fails_pending_requests_when_the_link_drops(connection):
+    badge = OpenBadge(connection, metrics=None)
+    badge.start_reader()
+    try:
+        connection.latency = 0.2
+        pending = badge.expect_response(Response_status_response_tag)
+        badge.send_frame(status_request_frame(), acknowledged=False)
+        connection.disconnect()
+        with pytest.raises(BadgeDisconnectedError):
+            badge.await_response(pending, timeout=1.0)
+        assert not badge.awaiting_response()
+    finally:
+        badge.stop_reader()
+
+
+def test_pipelined_responses_are_returned_in_request_order(connection):
+    badge = OpenBadge(connection, metrics=None)
+    badge.start_reader()
+    try:
+        status, scan, microphone, imu = badge.start_all_sensors(timeout=1.0)
+    finally:
+        badge.stop_reader()
+    assert type(status).__name__ == "StatusResponse"
+    assert type(scan).__name__ == "StartScanResponse"
+    assert type(microphone).__name__ == "StartMicrophoneResponse"
+    assert type(imu).__name__ == "StartImuResponse"
+    assert connection.badge.is_recording()
+
+
+def test_pipelined_start_assigns_the_badge_id(connection):
+    badge = OpenBadge(connection, metrics=None)
+
+    badge.start_all_sensors(timeout=1.0, new_id=42, new_group_number=3)
+
+    assert (connection.badge.badge_id, connection.badge.group) == (42, 3)
+    assert connection.badge.is_recording()
+
+
+def test_request_after_a_lost_response_gets_its_own_response(connection, monkeypatch):
+    monkeypatch.setattr(badge_module, "STALE_RESPONSE_WINDOW", 0.0)
+    badge = OpenBadge(connection, metrics=None)
+    connection.loss = 1.0
+    with pytest.raises(BadgeTimeoutError):
+        request_status(badge, timeout=0.05)
+
+    connection.loss = 0.0
+    status = request_status(badge, timeout=1.0)
+
+    assert status.clock_status == 0
+    assert badge.stale_responses == 0
+    assert not badge.awaiting_response()
+
+
+# Connection whose writes block until `unblock` is set, wedging the reader thread.
+class WedgedConnection(BadgeConnection):
+    def __init__(self):
+        BadgeConnection.__init__(self)
+        self.unblock = threading.Event()
+        self.sent = []
+
+    def is_connected(self):
+        return True
+
+    def send(self, message, response_len=0, timeout=None, acknowledged=True):
+        self.unblock.wait()
+        self.sent.append(bytes(message))
+
+    def receive_available(self, timeout=None):
+        raise BadgeTimeoutError("nothing to receive")
+
+
+def test_write_through_a_wedged_reader_times_out():
+    connection = WedgedConnection()
+    badge = OpenBadge(connection, timeout=0.01, metrics=None)
+    badge.start_reader()
+    try:
+        # The reader blocks writing the first request, and never gets to the second.
+        with pytest.raises(BadgeTimeoutError):
+            badge.identify(1)
+        with pytest.raises(BadgeTimeoutError):
+            badge.identify(2)
+    finally:
+        connection.unblock.set()
+        badge.stop_reader()
+    # The write that was not started is dropped once the reader recovers.
+    assert connection.sent == [identify_request_frame(1)]
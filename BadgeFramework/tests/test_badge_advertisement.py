@@ -0,0 +1,57 @@
+from badge_advertisement import (
+    CLOCK_SYNCED_FLAG,
+    IMU_FLAG,
+    MANUFACTURER_DATA_AD_TYPE,
+    RESET_GROUP,
+    RESET_ID,
+    BadgeAdvertisement,
+    advertisement_problems,
+    encode_manufacturer_data,
+    parse_advertising_data,
+    parse_manufacturer_data,
+)
+
+ADVERTISEMENT = BadgeAdvertisement("c0:de:00:00:00:01", 80, CLOCK_SYNCED_FLAG | IMU_FLAG, 7, 3)
+
+
+def ad_structure(ad_type, data):
+    return bytes([len(data) + 1, ad_type]) + data
+
+
+def test_manufacturer_data_round_trips():
+    data = encode_manufacturer_data(ADVERTISEMENT)
+    assert data[:2] == b"\x00\xff"
+    assert data[-6:] == bytes.fromhex("c0de00000001")
+    assert parse_manufacturer_data(data) == ADVERTISEMENT
+
+
+def test_advertising_packet_is_parsed_past_other_structures():
+    packet = (
+        ad_structure(0x01, b"\x06")
+        + ad_structure(0x09, b"HDBDG")
+        + ad_structure(MANUFACTURER_DATA_AD_TYPE, encode_manufacturer_data(ADVERTISEMENT))
+    )
+    assert parse_advertising_data(packet) == ADVERTISEMENT
+    # A truncated structure ends the packet.
+    assert parse_advertising_data(packet[:-1]) is None
+
+
+def test_data_that_is_not_a_midges_is_ignored():
+    data = encode_manufacturer_data(ADVERTISEMENT)
+    assert parse_manufacturer_data(None) is None
+    assert parse_manufacturer_data(data[:-1]) is None
+    assert parse_manufacturer_data(b"\x4c\x00" + data[2:]) is None
+
+
+def test_status_flags_and_problems():
+    assert (ADVERTISEMENT.clock_status, ADVERTISEMENT.microphone_status) == (1, 0)
+    assert (ADVERTISEMENT.scan_status, ADVERTISEMENT.imu_status) == (0, 1)
+    assert ADVERTISEMENT.is_assigned
+    assert not ADVERTISEMENT._replace(badge_id=RESET_ID, group=RESET_GROUP).is_assigned
+
+    assert advertisement_problems(ADVERTISEMENT, expected_id=8) == [
+        "microphone not recording",
+        "scan not recording",
+        "ID 7 instead of 8",
+    ]
+    assert advertisement_problems(ADVERTISEMENT, 7, 3, expect_recording=False) == []
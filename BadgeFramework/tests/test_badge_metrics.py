@@ -0,0 +1,24 @@
+import pytest
+
+from badge_metrics import write_atomically
+
+
+def test_write_atomically_replaces_the_file(tmp_path):
+    path = tmp_path / "metrics.json"
+    path.write_text("old")
+
+    write_atomically(str(path), "new")
+
+    assert path.read_text() == "new"
+    assert [p.name for p in tmp_path.iterdir()] == ["metrics.json"]
+
+
+def test_failed_write_leaves_no_temporary_file(tmp_path):
+    path = tmp_path / "metrics.json"
+    path.write_text("old")
+
+    with pytest.raises(TypeError):
+        write_atomically(str(path), b"not text")
+
+    assert path.read_text() == "old"
+    assert [p.name for p in tmp_path.iterdir()] == ["metrics.json"]
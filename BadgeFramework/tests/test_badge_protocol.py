@@ -0,0 +1,163 @@
+import struct
+
+import pytest
+
+import badge_protocol
+from badge_protocol import (
+    BadgeAssignement,
+    Request,
+    ScanDevice,
+    ScanReport,
+    StatusRequest,
+    StatusResponse,
+    Timestamp,
+    _Istream,
+    _Ostream,
+)
+from generate_badge_protocol import MESSAGES, UNIONS, Generator
+
+
+def timestamp(seconds=1700000000, ms=250):
+    stamp = Timestamp()
+    stamp.seconds = seconds
+    stamp.ms = ms
+    return stamp
+
+
+def status_request(badge_id=None):
+    request = StatusRequest()
+    request.timestamp = timestamp()
+    if badge_id is not None:
+        request.has_badge_assignement = 1
+        request.badge_assignement = BadgeAssignement()
+        request.badge_assignement.ID = badge_id
+        request.badge_assignement.group = 3
+    return request
+
+
+# Encodes `message` one field at a time, like the original hand-written module did.
+def encode_by_field(message, fields):
+    buf = bytearray(message.length())
+    ostream = _Ostream(buf)
+    for field in fields:
+        getattr(message, "encode_" + field)(ostream)
+    return bytes(buf)
+
+
+def test_field_encoders_match_the_packed_layout():
+    for request in (status_request(), status_request(badge_id=7)):
+        assert encode_by_field(request, ["timestamp", "badge_assignement"]) == request.encode()
+
+    response = StatusResponse()
+    response.clock_status = 1
+    response.imu_status = 1
+    response.time_delta = -12
+    response.timestamp = timestamp()
+    fields = [
+        "clock_status", "microphone_status", "scan_status", "imu_status", "time_delta", "timestamp"
+    ]
+    assert encode_by_field(response, fields) == response.encode()
+
+
+def test_field_decoders_read_what_the_packed_layout_wrote():
+    decoded = StatusRequest()
+    istream = _Istream(status_request(badge_id=7).encode())
+    decoded.decode_timestamp(istream)
+    decoded.decode_badge_assignement(istream)
+
+    assert (decoded.timestamp.seconds, decoded.timestamp.ms) == (1700000000, 250)
+    assert decoded.has_badge_assignement == 1
+    assert (decoded.badge_assignement.ID, decoded.badge_assignement.group) == (7, 3)
+
+
+def test_union_option_encoders_and_decoders():
+    request = Request()
+    request.type.status_request = status_request(badge_id=7)
+    buf = bytearray(request.length())
+    ostream = _Ostream(buf)
+    ostream.write(struct.pack("<B", request.type.which))
+    request.type.encode_status_request(ostream)
+    assert bytes(buf) == request.encode()
+
+    decoded = Request()
+    istream = _Istream(buf, 1)
+    decoded.type.decode_status_request(istream)
+    assert decoded.type.which == request.type.which
+    assert decoded.type.status_request.badge_assignement.ID == 7
+
+
+def test_fixed_layout_messages_round_trip():
+    response = StatusResponse()
+    response.clock_status = 1
+    response.scan_status = 1
+    response.time_delta = -12
+    response.timestamp = timestamp()
+
+    encoded = response.encode()
+    assert encoded == struct.pack("<BBBBiIH", 1, 0, 1, 0, -12, 1700000000, 250)
+    decoded = StatusResponse.decode(encoded)
+    assert (decoded.clock_status, decoded.scan_status, decoded.time_delta) == (1, 1, -12)
+    assert (decoded.timestamp.seconds, decoded.timestamp.ms) == (1700000000, 250)
+
+
+def test_istream_reads_views_of_the_buffer_from_its_cursor():
+    buf = bytearray(b"\x01\x02\x03\x04")
+    istream = _Istream(buf, 1)
+    chunk = istream.read(2)
+    assert isinstance(chunk, memoryview)
+    assert istream.offset == 3
+
+    buf[1] = 0xFF
+    assert bytes(chunk) == b"\xff\x03"
+
+
+def test_consecutive_records_decode_from_their_offsets():
+    buf = struct.pack("<Hb", 7, -60) + struct.pack("<Hb", 8, -70)
+    devices = [ScanDevice.decode_from(buf, offset) for offset in (0, 3)]
+    assert [(device.ID, device.rssi) for device in devices] == [(7, -60), (8, -70)]
+
+
+def test_encode_into_writes_at_the_offset_and_returns_the_end():
+    request = Request()
+    request.type.status_request = status_request(badge_id=7)
+    buf = bytearray(b"\xaa" * (2 + request.length()))
+
+    end = request.encode_into(buf, 2)
+
+    assert end == len(buf)
+    assert buf[:2] == b"\xaa\xaa"
+    assert bytes(buf[2:]) == request.encode()
+    with pytest.raises(Exception, match="Not enough space"):
+        request.encode_into(bytearray(request.length() - 1))
+
+
+def test_generated_module_is_up_to_date_with_the_schema():
+    with open(badge_protocol.__file__) as f:
+        assert f.read() == Generator(MESSAGES, UNIONS).generate()
+
+
+def test_messages_have_no_instance_dict():
+    request = status_request(badge_id=7)
+    assert not hasattr(request, "__dict__")
+    with pytest.raises(AttributeError):
+        request.unknown_field = 1
+
+
+def test_decode_array_matches_decoding_each_record():
+    pytest.importorskip("numpy")
+    records = [(7, -60), (8, -70), (65535, 0)]
+    buf = b"\x00" + b"".join(struct.pack("<Hb", *record) for record in records) + b"\x01"
+
+    devices = ScanDevice.decode_array(buf, offset=1)
+
+    assert list(zip(devices["ID"].tolist(), devices["rssi"].tolist())) == records
+    assert len(ScanDevice.decode_array(buf, offset=1, count=2)) == 2
+
+    report = ScanReport.decode_array(struct.pack("<QHBb4x", 1234, 7, 3, -55))[0]
+    assert (report["timestamp"], report["rssi"]) == (1234, -55)
+    assert (report["badge_assignement"]["ID"], report["badge_assignement"]["group"]) == (7, 3)
+
+
+def test_only_fixed_layout_messages_have_a_dtype():
+    with pytest.raises(TypeError):
+        Request.numpy_dtype()
@@ -0,0 +1,115 @@
+import threading
+import time
+
+from badge_advertisement import BadgeAdvertisement, encode_manufacturer_data
+from badge_scanner import (
+    DEFAULT_SCAN_SECONDS,
+    FleetMonitor,
+    SeenBadge,
+    merge_scans,
+    split_by_scan,
+)
+from simulated_badge_connection import ManualClock
+
+ADDRESS = "c0:de:00:00:00:01"
+
+
+# Listener that keeps listening until told to stop, and raises on the adapters in `broken`.
+class FakeListener(object):
+    def __init__(self, broken=()):
+        self.broken = set(broken)
+        self.entered = threading.Event()
+        self.failed = threading.Event()
+
+    def __call__(self, iface, report, should_stop):
+        if iface in self.broken:
+            self.failed.set()
+            raise OSError("Operation not permitted")
+        self.entered.set()
+        while not should_stop():
+            time.sleep(0.001)
+
+
+def started_monitor(ifaces=(0,), broken=()):
+    clock = ManualClock(100.0)
+    listener = FakeListener(broken)
+    monitor = FleetMonitor(ifaces, stale_after=10.0, listener=listener, clock=clock.monotonic)
+    monitor.start()
+    assert listener.entered.wait(1.0)
+    return monitor, clock, listener
+
+
+def test_monitor_is_ready_after_listening_for_a_scan():
+    monitor, clock, _ = started_monitor()
+    try:
+        assert not monitor.ready
+        clock.advance(DEFAULT_SCAN_SECONDS)
+        assert monitor.ready
+    finally:
+        monitor.stop()
+    assert not monitor.ready
+
+
+def test_monitor_with_a_failing_adapter_is_not_ready():
+    monitor, clock, listener = started_monitor(ifaces=(0, 1), broken=(1,))
+    try:
+        with monitor.condition:
+            assert monitor.condition.wait_for(
+                lambda: listener.failed.is_set() and monitor.listening == 1, 1.0
+            )
+        clock.advance(DEFAULT_SCAN_SECONDS * 10)
+        assert not monitor.ready
+    finally:
+        monitor.stop()
+
+
+def test_pause_keeps_the_monitor_ready_until_its_table_goes_stale():
+    monitor, clock, _ = started_monitor()
+    try:
+        clock.advance(DEFAULT_SCAN_SECONDS)
+        with monitor.paused():
+            clock.advance(5.0)
+            assert monitor.ready
+            clock.advance(6.0)
+            assert not monitor.ready
+
+        # A pause before a full scan does not count as having listened.
+        with monitor.paused():
+            pass
+        clock.advance(DEFAULT_SCAN_SECONDS / 2)
+        with monitor.paused():
+            assert not monitor.ready
+    finally:
+        monitor.stop()
+
+
+def test_reports_expire_after_stale_after():
+    monitor = FleetMonitor(stale_after=10.0, listener=FakeListener())
+    advertisement = BadgeAdvertisement(ADDRESS, 80, 0b1111, 7, 3)
+    data = encode_manufacturer_data(advertisement)
+
+    monitor.handle_report(0, ADDRESS.upper(), -60, data, now=0.0)
+    monitor.handle_report(1, ADDRESS, -50, data, now=1.0)
+    monitor.handle_report(0, "c0:de:00:00:00:02", -40, b"\x00\x01", now=1.0)
+
+    assert monitor.advertisements(now=5.0) == {ADDRESS: advertisement}
+    assert monitor.status(ADDRESS, now=5.0).rssi_by_iface == {0: -60, 1: -50}
+    assert monitor.status(ADDRESS, now=12.0) is None
+
+
+def test_scans_merge_into_the_strongest_adapter_per_badge():
+    seen = merge_scans({0: {ADDRESS.upper(): -70, "c0:de:00:00:00:02": -50}, 1: {ADDRESS: -60}})
+
+    assert seen[ADDRESS] == SeenBadge(ADDRESS, -60, 1, {0: -70, 1: -60})
+    assert seen["c0:de:00:00:00:02"].iface == 0
+
+
+def test_split_puts_the_strongest_badges_first_and_keeps_the_missing_in_order():
+    seen = merge_scans({0: {"c0:de:00:00:00:01": -70, "c0:de:00:00:00:02": -50}})
+    badges = [("a", "C0:DE:00:00:00:01"), ("b", "c0:de:00:00:00:03"),
+              ("c", "c0:de:00:00:00:02"), ("d", "c0:de:00:00:00:04")]
+
+    present, missing = split_by_scan(badges, seen)
+
+    assert [participant for participant, _ in present] == ["c", "a"]
+    assert [participant for participant, _ in missing] == ["b", "d"]
@@ -0,0 +1,166 @@
+import pytest
+
+pytest.importorskip("bluepy")
+
+from bluepy.btle import BTLEDisconnectError, BTLEException  # noqa: E402
+
+from badge_benchmark import FakePeripheral  # noqa: E402
+from badge_connection import BadgeDisconnectedError, BadgeTimeoutError  # noqa: E402
+from ble_badge_connection import BLEBadgeConnection  # noqa: E402
+from gatt_handle_cache import GattHandleCache, GattHandles  # noqa: E402
+
+ADDRESS = "c0:de:00:00:00:00"
+HANDLES = GattHandles(tx=0x10, rx=0x12, cccd=0x13)
+
+
+# FakePeripheral recording its writes, MTU exchanges and disconnection, whose writes to
+#   `failing_handle` raise `error`.
+class RecordingPeripheral(FakePeripheral):
+    failing_handle = None
+    error = BTLEException("write failed")
+    instances = []
+
+    def __init__(self, *args, **kwargs):
+        FakePeripheral.__init__(self, *args, **kwargs)
+        self.disconnected = False
+        self.written = []
+        self.mtu_requests = []
+        self.instances.append(self)
+
+    def setMTU(self, mtu):
+        self.mtu_requests.append(mtu)
+        return FakePeripheral.setMTU(self, mtu)
+
+    def writeCharacteristic(self, handle, val, withResponse=False):
+        if handle == self.failing_handle:
+            raise self.error
+        self.written.append((handle, bytes(val)))
+        return FakePeripheral.writeCharacteristic(self, handle, val, withResponse)
+
+    def getServiceByUUID(self, uuid):
+        raise BTLEException("discovery failed")
+
+    def disconnect(self):
+        self.disconnected = True
+
+
+def connection_with(handles=HANDLES, **peripheral_attributes):
+    peripheral_attributes["instances"] = []
+    peripheral_class = type("Peripheral", (RecordingPeripheral,), peripheral_attributes)
+    connection_class = type(
+        "Connection", (BLEBadgeConnection,), {"peripheral_class": peripheral_class}
+    )
+    handle_cache = GattHandleCache(path=None)
+    if handles is not None:
+        handle_cache.put(ADDRESS, handles)
+    return connection_class(ADDRESS, handle_cache=handle_cache, metrics=None), peripheral_class
+
+
+def test_failed_discovery_closes_the_link():
+    connection, peripheral_class = connection_with(handles=None)
+
+    with pytest.raises(BTLEException):
+        connection.connect()
+
+    assert peripheral_class.instances[0].disconnected
+    assert connection.conn is None
+
+
+def test_lost_link_while_subscribing_closes_it():
+    connection, peripheral_class = connection_with(
+        failing_handle=HANDLES.cccd, error=BTLEDisconnectError("gone")
+    )
+
+    with pytest.raises(BTLEDisconnectError):
+        connection.connect()
+
+    assert peripheral_class.instances[0].disconnected
+
+
+def test_lost_link_while_sending_raises_badge_disconnected_error():
+    connection, _ = connection_with(
+        failing_handle=HANDLES.tx, error=BTLEDisconnectError("gone")
+    )
+    connection.connect()
+
+    with pytest.raises(BadgeDisconnectedError):
+        connection.send(b"\x01\x00\x01", response_len=0)
+
+
+def test_helper_timeout_while_sending_raises_badge_timeout_error():
+    connection, _ = connection_with(
+        failing_handle=HANDLES.tx, error=BTLEException("Timed out while writing")
+    )
+    connection.connect()
+
+    with pytest.raises(BadgeTimeoutError):
+        connection.send(b"\x01\x00\x01", response_len=0)
+
+
+def test_lost_link_while_receiving_raises_badge_disconnected_error():
+    connection, peripheral_class = connection_with()
+    connection.connect()
+
+    def lost(timeout):
+        raise BTLEDisconnectError("gone")
+
+    peripheral_class.instances[0].waitForNotifications = lost
+    with pytest.raises(BadgeDisconnectedError):
+        connection.await_data(4, timeout=1.0)
+
+
+def test_received_bytes_are_taken_in_order_across_notifications():
+    connection, _ = connection_with()
+    for chunk in (b"\x01\x02", b"\x03", b"\x04\x05"):
+        connection.received(chunk)
+
+    assert connection.take_received(6) is None
+    assert connection.take_received(3) == b"\x01\x02\x03"
+    assert connection.take_all_received() == b"\x04\x05"
+    assert connection.take_all_received() is None
+
+    connection.received(b"\x06")
+    connection.clear_received()
+    assert connection.take_all_received() is None
+
+
+def test_await_data_pumps_notifications_until_enough_arrived():
+    connection, peripheral_class = connection_with()
+    connection.connect()
+    peripheral = peripheral_class.instances[0]
+    notifications = [b"\x01\x02", b"\x03\x04", b"\x05"]
+
+    def notify(timeout):
+        peripheral.delegate.handleNotification(HANDLES.rx, notifications.pop(0))
+        return True
+
+    peripheral.waitForNotifications = notify
+    assert connection.await_data(4, timeout=1.0) == b"\x01\x02\x03\x04"
+    assert connection.receive_available(timeout=1.0) == b"\x05"
+
+
+def test_long_messages_are_split_into_writes_that_fit_the_mtu():
+    connection, peripheral_class = connection_with(max_mtu=64)
+    connection.connect()
+    peripheral = peripheral_class.instances[0]
+    message = bytes(range(100))
+
+    connection.send(message, response_len=0)
+
+    assert connection.mtu == 64
+    writes = [data for handle, data in peripheral.written if handle == HANDLES.tx]
+    assert [len(data) for data in writes] == [61, 39]
+    assert b"".join(writes) == message
+    assert connection.handle_cache.get(ADDRESS).mtu == 64
+
+
+def test_badge_known_to_keep_the_default_mtu_is_not_asked_again():
+    connection, peripheral_class = connection_with(handles=HANDLES._replace(mtu=23))
+    connection.connect()
+    peripheral = peripheral_class.instances[0]
+
+    connection.send(bytes(30), response_len=0)
+
+    assert peripheral.mtu_requests == []
+    writes = [data for handle, data in peripheral.written if handle == HANDLES.tx]
+    assert [len(data) for data in writes] == [20, 10]
@@ -0,0 +1,100 @@
+import types
+
+import pytest
+
+import clock_sync
+from badge import get_timestamps_from_time
+from badge_protocol import StatusResponse, Timestamp
+from clock_sync import ClockSynchroniser, exchange
+from simulated_badge_connection import ManualClock
+
+ADDRESS = "c0:de:00:00:00:01"
+
+
+# Badge whose clock is `offset` seconds ahead of the host's, answering status requests after
+#   the round trips in `rtts` (the last one repeats), both directions taking as long.
+class ScriptedBadge(object):
+    def __init__(self, clock, offset, rtts):
+        self.address = ADDRESS.upper()
+        self.clock = clock
+        self.offset = offset
+        self.rtts = list(rtts)
+        self.requests = 0
+
+    def get_status(self, t, new_id=None, new_group_number=None, timeout=None):
+        sent_time = t()
+        rtt = self.rtts[min(self.requests, len(self.rtts) - 1)]
+        self.requests += 1
+        self.clock.advance(rtt / 2)
+        received = self.clock.monotonic()
+        status = StatusResponse()
+        status.clock_status = 1
+        status.time_delta = 1
+        status.timestamp = Timestamp()
+        status.timestamp.seconds, status.timestamp.ms = get_timestamps_from_time(
+            received + self.offset
+        )
+        self.offset = sent_time - received
+        self.clock.advance(rtt / 2)
+        return status
+
+    # Lets the badge clock run `ppm` parts per million fast for `seconds`.
+    def drift(self, seconds, ppm):
+        self.clock.advance(seconds)
+        self.offset += seconds * ppm / 1e6
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = ManualClock(1700000000.0)
+    # Round trips are measured with time.perf_counter().
+    monkeypatch.setattr(clock_sync, "time", types.SimpleNamespace(perf_counter=clock.monotonic))
+    return clock
+
+
+def test_exchange_measures_the_offset_before_setting_the_clock(clock):
+    badge = ScriptedBadge(clock, offset=5.0, rtts=[0.1])
+
+    sample = exchange(badge, latency=0.05, clock=clock.monotonic)
+
+    assert sample.rtt == pytest.approx(0.1)
+    assert sample.offset_before == pytest.approx(5.0, abs=0.001)
+    assert sample.offset_after == pytest.approx(0.0)
+    assert badge.offset == pytest.approx(0.0005, abs=1e-6)
+
+
+def test_sync_compensates_for_the_latency_of_the_best_round_trip(clock):
+    badge = ScriptedBadge(clock, offset=5.0, rtts=[0.3, 0.1])
+    synchroniser = ClockSynchroniser(exchanges=3, clock=clock.monotonic)
+
+    estimate = synchroniser.synchronise(badge)
+
+    assert badge.requests == 3
+    assert estimate.rtt == pytest.approx(0.1)
+    assert estimate.uncertainty == pytest.approx(0.05)
+    assert abs(badge.offset) <= 0.001
+    assert synchroniser.estimate(ADDRESS) is estimate
+
+
+def test_slow_last_exchange_makes_the_sync_go_on(clock):
+    badge = ScriptedBadge(clock, offset=0.0, rtts=[0.1, 0.1, 0.4, 0.1])
+    synchroniser = ClockSynchroniser(exchanges=3, clock=clock.monotonic)
+
+    estimate = synchroniser.synchronise(badge)
+
+    assert badge.requests == 4
+    assert estimate.uncertainty == pytest.approx(0.05)
+
+
+def test_drift_is_estimated_across_syncs(clock):
+    badge = ScriptedBadge(clock, offset=0.0, rtts=[0.1])
+    synchroniser = ClockSynchroniser(exchanges=2, clock=clock.monotonic)
+    synchroniser.synchronise(badge)
+
+    badge.drift(100.0, ppm=50)
+    estimate = synchroniser.synchronise(badge)
+    assert estimate.drift_ppm == pytest.approx(50, abs=10)
+
+    synchroniser.clock_was_set(ADDRESS)
+    badge.drift(100.0, ppm=500)
+    assert synchroniser.synchronise(badge).drift_ppm == pytest.approx(50, abs=10)
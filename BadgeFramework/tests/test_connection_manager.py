@@ -0,0 +1,112 @@
+import threading
+
+import pytest
+
+from connection_manager import ConnectionInUseError, ConnectionManager
+from fleet_executor import run_on_fleet
+from simulated_badge_connection import SimulatedFleet
+
+ADDRESS = SimulatedFleet.address_of(0)
+
+
+@pytest.fixture
+def manager():
+    fleet = SimulatedFleet(1)
+    manager = ConnectionManager(connection_factory=fleet.connect)
+    yield manager
+    manager.close_all()
+
+
+def test_released_link_is_reused(manager):
+    connection = manager.acquire(ADDRESS)
+    manager.release(ADDRESS, connection)
+
+    assert manager.acquire(ADDRESS) is connection
+
+
+def test_held_link_is_not_shared(manager):
+    manager.acquire(ADDRESS)
+
+    with pytest.raises(ConnectionInUseError):
+        manager.acquire(ADDRESS)
+
+
+def test_discarded_held_link_is_closed_when_handed_back(manager):
+    connection = manager.acquire(ADDRESS)
+    manager.discard(ADDRESS)
+
+    assert ADDRESS not in manager
+    assert connection.is_connected()
+    manager.release(ADDRESS, connection)
+    assert not connection.is_connected()
+
+
+def test_late_release_does_not_release_a_newer_link(manager):
+    old = manager.acquire(ADDRESS)
+    manager.discard(ADDRESS)
+    old.disconnect()
+    new = manager.acquire(ADDRESS)
+
+    manager.release(ADDRESS, old)
+
+    with pytest.raises(ConnectionInUseError):
+        manager.acquire(ADDRESS)
+    assert new.is_connected()
+
+
+def test_idle_links_beyond_max_connections_are_closed():
+    fleet = SimulatedFleet(3)
+    manager = ConnectionManager(max_connections=2, connection_factory=fleet.connect)
+    connections = []
+    for address in fleet.addresses():
+        connections.append(manager.acquire(address))
+        manager.release(address, connections[-1])
+
+    assert len(manager) == 2
+    assert not connections[0].is_connected()
+    assert all(connection.is_connected() for connection in connections[1:])
+    manager.close_all()
+
+
+def test_fleet_timeout_drops_the_abandoned_link_from_the_pool(manager):
+    held = []
+    finish = threading.Event()
+    released = threading.Event()
+
+    def operation(participant, address):
+        connection = manager.acquire(address)
+        held.append(connection)
+        finish.wait()
+        manager.release(address, connection)
+        released.set()
+
+    report = run_on_fleet(
+        [(0, ADDRESS)],
+        operation,
+        timeout=0.05,
+        on_timeout=lambda participant, address: manager.discard(address),
+    )
+
+    assert len(report.timed_out) == 1
+    assert ADDRESS not in manager
+    assert held[0].is_connected()
+    finish.set()
+    assert released.wait(1.0)
+    assert not held[0].is_connected()
+
+
+def test_close_all_keeps_the_links_asked_for():
+    fleet = SimulatedFleet(2)
+    manager = ConnectionManager(connection_factory=fleet.connect)
+    kept, closed = fleet.addresses()
+    connections = {}
+    for address in fleet.addresses():
+        connections[address] = manager.acquire(address)
+        manager.release(address, connections[address])
+
+    manager.close_all(keep=[kept])
+
+    assert kept in manager and closed not in manager
+    assert connections[kept].is_connected()
+    assert not connections[closed].is_connected()
+    manager.close_all()
@@ -0,0 +1,63 @@
+import threading
+
+from badge_connection import BadgeTimeoutError
+from fleet_executor import _FleetRun, run_on_fleet
+
+BADGES = [(0, "c0:de:00:00:00:00"), (1, "c0:de:00:00:00:01")]
+
+
+# Returns whether another thread can take `condition`'s lock.
+def lock_is_free(condition):
+    free = []
+
+    def probe():
+        if condition.acquire(timeout=1.0):
+            condition.release()
+            free.append(True)
+
+    thread = threading.Thread(target=probe)
+    thread.start()
+    thread.join()
+    return bool(free)
+
+
+def test_results_come_back_in_badge_order():
+    report = run_on_fleet(BADGES, lambda participant, address: participant * 10, max_workers=2)
+
+    assert [result.value for result in report.results] == [0, 10]
+    assert not report.failed
+
+
+def test_failure_only_fails_its_own_badge():
+    def operation(participant, address):
+        if participant == 0:
+            raise ConnectionError("refused")
+        return participant
+
+    report = run_on_fleet(BADGES, operation)
+
+    assert isinstance(report.results[0].error, ConnectionError)
+    assert report.results[1].value == 1
+
+
+def test_on_timeout_runs_without_the_lock_held():
+    release = threading.Event()
+    cleaned_up = []
+
+    def operation(participant, address):
+        if participant == 0:
+            release.wait()
+        return participant
+
+    def on_timeout(participant, address):
+        cleaned_up.append((address, lock_is_free(fleet_run.condition)))
+
+    fleet_run = _FleetRun(BADGES, operation, 2, 0.05, on_timeout)
+    try:
+        results = fleet_run.run()
+    finally:
+        release.set()
+
+    assert isinstance(results[0].error, BadgeTimeoutError)
+    assert results[1].value == 1
+    assert cleaned_up == [(BADGES[0][1], True)]
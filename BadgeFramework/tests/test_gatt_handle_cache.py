@@ -0,0 +1,34 @@
+from gatt_handle_cache import GattHandleCache, GattHandles
+
+ADDRESS = "c0:de:00:00:00:00"
+HANDLES = GattHandles(tx=0x10, rx=0x12, cccd=0x13, mtu=23)
+
+
+def test_handles_survive_a_new_cache_on_the_same_file(tmp_path):
+    path = str(tmp_path / "cache" / "handles.json")
+    GattHandleCache(path).put(ADDRESS.upper(), HANDLES)
+
+    cache = GattHandleCache(path)
+    assert cache.get(ADDRESS) == HANDLES
+
+    cache.invalidate(ADDRESS)
+    assert GattHandleCache(path).get(ADDRESS) is None
+
+
+def test_corrupt_file_is_treated_as_empty(tmp_path):
+    path = tmp_path / "handles.json"
+    path.write_text("{not json")
+    cache = GattHandleCache(str(path))
+
+    assert cache.get(ADDRESS) is None
+    cache.put(ADDRESS, HANDLES)
+    assert GattHandleCache(str(path)).get(ADDRESS) == HANDLES
+
+
+def test_in_memory_cache_writes_no_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cache = GattHandleCache(path=None)
+    cache.put(ADDRESS, HANDLES)
+
+    assert cache.get(ADDRESS) == HANDLES
+    assert list(tmp_path.iterdir()) == []
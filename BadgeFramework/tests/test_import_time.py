@@ -0,0 +1,17 @@
+from badge_benchmark import measure_import_time
+
+# Budget for `import badge` in a fresh interpreter, best of IMPORT_RUNS. It is about 20 ms
+#   on a laptop; the margin is for slow CI machines and the Raspberry Pi hubs.
+IMPORT_BUDGET_MS = 100
+IMPORT_RUNS = 3
+
+# Modules `import badge` must not pull in: they are only needed by optional features.
+LAZY_MODULES = ("numpy", "bluepy")
+
+
+def test_import_badge_stays_within_budget():
+    total_us, entries = measure_import_time("badge", IMPORT_RUNS)
+
+    imported = {name for _, name in entries}
+    assert not imported & set(LAZY_MODULES)
+    assert total_us <= IMPORT_BUDGET_MS * 1000
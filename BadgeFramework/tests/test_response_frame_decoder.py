@@ -0,0 +1,136 @@
+import pytest
+
+from badge import (
+    LENGTH_HEADER,
+    OpenBadge,
+    ResponseDecodeError,
+    ResponseFrameDecoder,
+)
+from badge_connection import BadgeConnection, BadgeTimeoutError
+from badge_protocol import (
+    Response,
+    Response_start_imu_response_tag,
+    Response_status_response_tag,
+    StartImuResponse,
+    StatusResponse,
+    Timestamp,
+)
+
+
+def status_frame(time_delta=0):
+    response = Response()
+    response.type.status_response = StatusResponse()
+    response.type.status_response.time_delta = time_delta
+    response.type.status_response.timestamp = Timestamp()
+    payload = response.encode()
+    return LENGTH_HEADER.pack(len(payload)) + payload
+
+
+def imu_frame():
+    response = Response()
+    response.type.start_imu_response = StartImuResponse()
+    response.type.start_imu_response.timestamp = Timestamp()
+    payload = response.encode()
+    return LENGTH_HEADER.pack(len(payload)) + payload
+
+
+# A truncated status response: the tag without the message.
+CORRUPT_FRAME = LENGTH_HEADER.pack(1) + bytes([Response_status_response_tag])
+
+
+# Serves the given chunks, one per receive_available() call, and times out once they are
+#   used up.
+class ChunkConnection(BadgeConnection):
+    def __init__(self, chunks=()):
+        BadgeConnection.__init__(self)
+        self.chunks = list(chunks)
+
+    def is_connected(self):
+        return True
+
+    def send(self, message, response_len=0, timeout=None, acknowledged=True):
+        pass
+
+    def receive_available(self, timeout=None):
+        if not self.chunks:
+            raise BadgeTimeoutError("no more chunks")
+        return self.chunks.pop(0)
+
+
+def test_decodes_every_frame_of_a_chunk():
+    decoder = ResponseFrameDecoder()
+    responses = decoder.feed(status_frame(1) + imu_frame() + status_frame(2))
+
+    assert [r.type.which for r in responses] == [
+        Response_status_response_tag,
+        Response_start_imu_response_tag,
+        Response_status_response_tag,
+    ]
+    assert [responses[0].type.status_response.time_delta,
+            responses[2].type.status_response.time_delta] == [1, 2]
+    assert decoder.pending() == 0
+
+
+def test_frames_split_across_chunks_are_decoded_once_complete():
+    stream = status_frame(7) + imu_frame()
+    decoder = ResponseFrameDecoder()
+
+    decoded = []
+    for i in range(len(stream)):
+        decoded += decoder.feed(stream[i : i + 1])
+
+    assert [r.type.which for r in decoded] == [
+        Response_status_response_tag,
+        Response_start_imu_response_tag,
+    ]
+    assert decoded[0].type.status_response.time_delta == 7
+
+
+def test_partial_frame_stays_buffered():
+    frame = status_frame()
+    decoder = ResponseFrameDecoder()
+
+    assert decoder.feed(frame[:-1]) == []
+    assert decoder.pending() == len(frame) - 1
+    assert len(decoder.feed(frame[-1:])) == 1
+
+
+def test_corrupt_frame_does_not_lose_the_others():
+    decoder = ResponseFrameDecoder()
+
+    with pytest.raises(ResponseDecodeError) as info:
+        decoder.feed(status_frame(1) + CORRUPT_FRAME + imu_frame())
+
+    assert [r.type.which for r in info.value.responses] == [
+        Response_status_response_tag,
+        Response_start_imu_response_tag,
+    ]
+    # The corrupt frame was skipped.
+    assert decoder.feed(status_frame(2))[0].type.status_response.time_delta == 2
+
+
+def test_badge_dispatches_the_good_responses_of_a_corrupt_chunk():
+    badge = OpenBadge(ChunkConnection(), metrics=None)
+    status = badge.expect_response(Response_status_response_tag)
+    imu = badge.expect_response(Response_start_imu_response_tag)
+
+    with pytest.raises(ResponseDecodeError):
+        badge.receive_data(status_frame(3) + CORRUPT_FRAME + imu_frame())
+
+    assert status.result().time_delta == 3
+    assert imu.done
+
+
+def test_receive_response_keeps_a_partial_frame_after_a_timeout():
+    frame = status_frame(5)
+    connection = ChunkConnection([frame[:3]])
+    badge = OpenBadge(connection, metrics=None)
+    pending = badge.expect_response(Response_status_response_tag)
+
+    with pytest.raises(BadgeTimeoutError):
+        badge.receive_response(timeout=0.0)
+
+    connection.chunks.append(frame[3:] + status_frame(6))
+    badge.receive_response(timeout=0.0)
+    assert pending.result().time_delta == 5
+    assert badge.unexpected_responses == 1
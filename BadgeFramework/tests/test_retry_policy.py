@@ -0,0 +1,203 @@
+import random
+import threading
+import time
+
+import pytest
+
+from badge_connection import BadgeTimeoutError
+from connection_manager import ConnectionManager
+from hub_connection_V1 import Connection, _connect_lock
+from retry_policy import CircuitBreaker, RetryPolicy, call_with_deadline
+from simulated_badge_connection import SimulatedFleet
+
+ADDRESS = SimulatedFleet.address_of(0)
+
+
+def test_delays_grow_exponentially_up_to_max_delay():
+    policy = RetryPolicy(attempts=6, base_delay=0.5, multiplier=2.0, max_delay=3.0, jitter=0.0)
+    assert list(policy.delays()) == [0.5, 1.0, 2.0, 3.0, 3.0]
+
+
+def test_jitter_shortens_delays_by_at_most_its_fraction():
+    policy = RetryPolicy(attempts=20, base_delay=1.0, multiplier=1.0, jitter=0.5,
+                         rng=random.Random(1))
+    delays = list(policy.delays())
+    assert all(0.5 <= delay <= 1.0 for delay in delays)
+    assert len(set(delays)) > 1
+
+
+def test_call_retries_and_raises_the_last_error():
+    calls = []
+
+    def fail():
+        calls.append(len(calls))
+        raise ConnectionError("attempt {}".format(len(calls)))
+
+    policy = RetryPolicy(attempts=3, base_delay=0.0, jitter=0.0)
+    with pytest.raises(ConnectionError, match="attempt 3"):
+        policy.call(fail)
+    assert len(calls) == 3
+
+
+def test_call_does_not_retry_other_errors():
+    calls = []
+
+    def fail():
+        calls.append(None)
+        raise KeyError("bug")
+
+    policy = RetryPolicy(attempts=3, base_delay=0.0, retry_on=(ConnectionError,))
+    with pytest.raises(KeyError):
+        policy.call(fail)
+    assert len(calls) == 1
+
+
+def test_no_retry_starts_that_could_not_end_by_the_deadline():
+    calls = []
+
+    def fail():
+        calls.append(None)
+        raise ConnectionError("refused")
+
+    policy = RetryPolicy(attempts=5, base_delay=1.0, jitter=0.0)
+    with pytest.raises(ConnectionError):
+        policy.call(fail, deadline=time.monotonic() + 0.5)
+    assert len(calls) == 1
+
+    with pytest.raises(BadgeTimeoutError):
+        policy.call(fail, deadline=time.monotonic() - 1.0)
+    assert len(calls) == 1
+
+
+def test_late_result_of_abandoned_call_is_cleaned_up():
+    finish = threading.Event()
+    cleaned = []
+    done = threading.Event()
+
+    def slow():
+        finish.wait()
+        return "late"
+
+    def cleanup(result):
+        cleaned.append(result)
+        done.set()
+
+    with pytest.raises(BadgeTimeoutError):
+        call_with_deadline(slow, 0.01, cleanup)
+    finish.set()
+    assert done.wait(1.0)
+    assert cleaned == ["late"]
+
+
+# Connects to the simulated badge, the first time only once `finish` is set.
+def _stuck_first_connect(fleet, finish):
+    opened = []
+
+    def connect(address):
+        first = not opened
+        opened.append(fleet.connection(address))
+        if first:
+            opened[-1].stuck_thread = threading.current_thread()
+            finish.wait()
+        opened[-1].connect()
+        return opened[-1]
+
+    return connect, opened
+
+
+def test_retry_does_not_connect_alongside_an_abandoned_attempt():
+    fleet = SimulatedFleet(1)
+    finish = threading.Event()
+    connect, opened = _stuck_first_connect(fleet, finish)
+    manager = ConnectionManager(connection_factory=connect)
+    policy = RetryPolicy(attempts=2, base_delay=0.0, jitter=0.0, attempt_timeout=0.05)
+
+    with pytest.raises(Exception, match="Could not connect"):
+        Connection(0, ADDRESS, manager, retry_policy=policy)
+    assert len(opened) == 1
+    # Let the retry finish giving up before the stuck attempt can let it through.
+    for thread in threading.enumerate():
+        if thread.name == "deadline" and thread is not opened[0].stuck_thread:
+            thread.join(1.0)
+
+    finish.set()
+    # The abandoned attempt holds the lock until its late link is closed.
+    lock = _connect_lock(ADDRESS)
+    assert lock.acquire(timeout=1.0)
+    lock.release()
+    assert not opened[0].is_connected()
+    assert ADDRESS not in manager
+
+    connection = Connection(0, ADDRESS, manager, retry_policy=policy)
+    try:
+        assert connection.connection is opened[1]
+        connection.badge.get_status(timeout=1.0)
+    finally:
+        connection.disconnect()
+    assert ADDRESS in manager
+    manager.close_all()
+
+
+def test_late_result_closes_only_its_own_connection():
+    fleet = SimulatedFleet(1)
+    manager = ConnectionManager(connection_factory=fleet.connect)
+    pooled = manager.acquire(ADDRESS)
+    late = fleet.connect(ADDRESS)
+
+    manager.discard(ADDRESS, late)
+
+    assert not late.is_connected()
+    assert pooled.is_connected()
+    assert ADDRESS in manager
+    manager.release(ADDRESS, pooled)
+    manager.close_all()
+
+
+def test_circuit_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10.0)
+    for _ in range(2):
+        breaker.record_failure(ADDRESS, now=0.0)
+        assert breaker.allow(ADDRESS, now=0.0)
+    breaker.record_failure(ADDRESS, now=0.0)
+
+    assert breaker.is_open(ADDRESS)
+    assert not breaker.allow(ADDRESS, now=5.0)
+    assert breaker.retry_after(ADDRESS, now=5.0) == 5.0
+
+
+def test_success_resets_the_failure_count():
+    breaker = CircuitBreaker(failure_threshold=2)
+    breaker.record_failure(ADDRESS, now=0.0)
+    breaker.record_success(ADDRESS)
+    breaker.record_failure(ADDRESS, now=0.0)
+    assert not breaker.is_open(ADDRESS)
+
+
+def test_half_open_circuit_allows_a_single_probe():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10.0)
+    breaker.record_failure(ADDRESS, now=0.0)
+
+    assert breaker.allow(ADDRESS, now=10.0)
+    assert not breaker.allow(ADDRESS, now=10.0)
+
+    breaker.record_success(ADDRESS)
+    assert not breaker.is_open(ADDRESS)
+    assert breaker.allow(ADDRESS, now=10.0)
+
+
+def test_failed_probes_back_off_up_to_max_reset_timeout():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10.0, max_reset_timeout=30.0)
+    now = 0.0
+    open_times = []
+    for _ in range(4):
+        breaker.record_failure(ADDRESS, now=now)
+        open_times.append(breaker.retry_after(ADDRESS, now=now))
+        now += open_times[-1]
+        assert breaker.allow(ADDRESS, now=now)
+    assert open_times == [10.0, 20.0, 30.0, 30.0]
+
+
+def test_circuits_are_keyed_case_insensitively():
+    breaker = CircuitBreaker(failure_threshold=1)
+    breaker.record_failure(ADDRESS.upper(), now=0.0)
+    assert breaker.is_open(ADDRESS)
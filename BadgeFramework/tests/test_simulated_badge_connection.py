@@ -0,0 +1,58 @@
+import pytest
+
+from badge import LENGTH_HEADER, OpenBadge
+from badge_connection import BadgeDisconnectedError, BadgeTimeoutError
+from simulated_badge_connection import ManualClock, SimulatedFleet
+
+ADDRESS = SimulatedFleet.address_of(0)
+
+
+@pytest.fixture
+def clock():
+    return ManualClock(start=100.0)
+
+
+def test_response_arrives_after_a_round_trip(clock):
+    fleet = SimulatedFleet(1, clock=clock, latency=0.02)
+    badge = OpenBadge(fleet.connect(ADDRESS), metrics=None)
+    start = clock.monotonic()
+
+    badge.get_status()
+
+    # The write is acknowledged after a round trip, when the response has arrived too.
+    assert clock.monotonic() - start == pytest.approx(0.04)
+
+
+def test_await_data_times_out_on_the_simulated_clock(clock):
+    fleet = SimulatedFleet(1, clock=clock)
+    connection = fleet.connect(ADDRESS)
+    start = clock.monotonic()
+
+    with pytest.raises(BadgeTimeoutError):
+        connection.await_data(LENGTH_HEADER.size, timeout=3.0)
+    assert clock.monotonic() - start == pytest.approx(3.0)
+
+
+def test_badge_clock_drifts(clock):
+    fleet = SimulatedFleet(1, clock=clock)
+    fleet.badges[ADDRESS].drift_ppm = 100.0
+    badge = OpenBadge(fleet.connect(ADDRESS), metrics=None)
+    badge.get_status(t=1000.0)
+
+    clock.advance(1000.0)
+    status = badge.get_status(t=2000.0)
+
+    # 1000 s at 100 ppm fast puts the badge 100 ms ahead of the host.
+    assert status.time_delta == -100
+
+
+def test_restart_drops_the_link_and_keeps_the_badge_away(clock):
+    fleet = SimulatedFleet(1, clock=clock, badge_options={"restart_seconds": 5.0})
+    connection = fleet.connect(ADDRESS)
+    OpenBadge(connection, metrics=None).restart()
+
+    assert not connection.is_connected()
+    with pytest.raises(BadgeDisconnectedError):
+        fleet.connect(ADDRESS)
+    clock.advance(5.0)
+    assert fleet.connect(ADDRESS).is_connected()